@@ -0,0 +1,5 @@
+"""
+Throughput and latency benchmarks for the api and the rules engine. Run with
+
+    python -m benchmarks.run --output results.json
+"""
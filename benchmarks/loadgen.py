@@ -0,0 +1,524 @@
+"""
+Load generator simulating many concurrent players.
+
+Every simulated player follows the flow of client.py: it loads the block
+catalog, lists the open games, joins one or creates a new one, polls the
+game until it is its turn and then, after thinking for a while, places a
+random legal block with a transaction which it creates and commits. When
+the game ends the player goes back to the lobby. Players are asyncio tasks
+with their own keep-alive connection, so thousands of them fit in one
+process.
+
+Without --url a server on a temporary SQLite database is started in a
+separate process. Latency percentiles, error rates and throughput of every
+endpoint are printed every --interval seconds and summed up at the end.
+
+    python -m benchmarks.loadgen --players 500 --duration 60
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+from urllib.parse import urlsplit
+
+from blokus.engine import COLORS, Board, legal_moves, placement_mask
+from benchmarks.run import summarize
+
+# Largest number of players of a game
+SEATS = len(COLORS)
+
+
+class HTTPError(Exception):
+    """
+    Raised when the server closes the connection or sends a broken response
+    """
+
+
+class Connection(object):
+    """
+    Minimal HTTP/1.1 client on asyncio streams keeping its connection open
+    between requests like a browser or the requests session of client.py
+    """
+
+    def __init__(self, host, port, timeout):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._reader = None
+        self._writer = None
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except OSError:
+                pass
+        self._reader = self._writer = None
+
+    async def request(self, method, path, body=None, headers=None):
+        """
+        Sends a request and returns (status, headers, body). JSON bodies are
+        encoded. A connection closed by the server is opened again once.
+        """
+        try:
+            return await asyncio.wait_for(self._request(method, path, body, headers), self.timeout)
+        except Exception:
+            await self.close()
+            raise
+
+    async def _request(self, method, path, body, headers):
+        payload = b"" if body is None else json.dumps(body).encode()
+        lines = [
+            "{} {} HTTP/1.1".format(method, path),
+            "Host: {}:{}".format(self.host, self.port),
+            "Accept: application/vnd.mason+json",
+            "Content-Length: {}".format(len(payload)),
+        ]
+        if body is not None:
+            lines.append("Content-Type: application/json")
+        for name, value in (headers or {}).items():
+            lines.append("{}: {}".format(name, value))
+        data = ("\r\n".join(lines) + "\r\n\r\n").encode() + payload
+
+        for attempt in (0, 1):
+            reused = self._writer is not None
+            if not reused:
+                self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+            try:
+                self._writer.write(data)
+                await self._writer.drain()
+                return await self._read_response(method)
+            except (HTTPError, ConnectionError, asyncio.IncompleteReadError):
+                await self.close()
+                # Keep-alive connections may be closed by the server at any time
+                if not reused or attempt:
+                    raise
+
+    async def _read_response(self, method):
+        status_line = await self._reader.readline()
+        if not status_line:
+            raise HTTPError("Connection closed")
+        parts = status_line.decode("latin-1").split(None, 2)
+        if len(parts) < 2 or not parts[1].isdigit():
+            raise HTTPError("Broken status line {!r}".format(status_line))
+        status = int(parts[1])
+        headers = {}
+        while True:
+            line = await self._reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        if method == "HEAD" or status in (204, 304) or 100 <= status < 200:
+            body = b""
+        elif headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await self._reader.readline()).split(b";")[0], 16)
+                if size == 0:
+                    await self._reader.readline()
+                    break
+                chunks.append(await self._reader.readexactly(size))
+                await self._reader.readline()
+            body = b"".join(chunks)
+        elif "content-length" in headers:
+            body = await self._reader.readexactly(int(headers["content-length"]))
+        else:
+            body = await self._reader.read()
+            headers["connection"] = "close"
+
+        if headers.get("connection", "").lower() == "close":
+            await self.close()
+        return status, headers, body
+
+
+class Stats(object):
+    """
+    Latencies and errors of every endpoint, for the current interval and
+    the whole run
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.interval_start = self.start
+        self.interval = {}
+        self.total = {}
+        self.intervals = []
+        self.counters = {"games_created": 0, "games_joined": 0, "games_finished": 0, "moves": 0}
+
+    def record(self, endpoint, latency, status):
+        for bucket in (self.interval, self.total):
+            entry = bucket.setdefault(endpoint, {"latencies": [], "errors": 0, "statuses": {}})
+            entry["latencies"].append(latency)
+            entry["statuses"][status] = entry["statuses"].get(status, 0) + 1
+            if not isinstance(status, int) or status >= 500:
+                entry["errors"] += 1
+
+    def count(self, name):
+        self.counters[name] += 1
+
+    @staticmethod
+    def _summary(bucket, elapsed):
+        result = {}
+        for endpoint, entry in sorted(bucket.items()):
+            stats = summarize(entry["latencies"], elapsed)
+            ordered = sorted(entry["latencies"])
+            stats["p95_ms"] = ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))] * 1000
+            stats["errors"] = entry["errors"]
+            stats["error_rate"] = entry["errors"] / len(ordered)
+            stats["statuses"] = {str(k): v for k, v in sorted(entry["statuses"].items(), key=str)}
+            result[endpoint] = stats
+        return result
+
+    def roll(self, players):
+        """
+        Closes the current interval and returns its summary
+        """
+        now = time.perf_counter()
+        summary = {
+            "time": now - self.start,
+            "players": players,
+            "endpoints": self._summary(self.interval, now - self.interval_start),
+        }
+        self.intervals.append(summary)
+        self.interval = {}
+        self.interval_start = now
+        return summary
+
+    def report(self):
+        elapsed = time.perf_counter() - self.start
+        return {
+            "seconds": elapsed,
+            "counters": dict(self.counters),
+            "endpoints": self._summary(self.total, elapsed),
+            "intervals": self.intervals,
+        }
+
+
+def format_interval(summary):
+    """
+    Returns the lines printed for one interval
+    """
+    endpoints = summary["endpoints"]
+    requests = sum(s["requests"] for s in endpoints.values())
+    errors = sum(s["errors"] for s in endpoints.values())
+    rps = sum(s["requests_per_second"] for s in endpoints.values())
+    lines = ["[{:7.1f}s] players {:5d}  requests {:6d}  {:8.1f}/s  errors {}".format(
+        summary["time"], summary["players"], requests, rps, errors)]
+    for name, s in endpoints.items():
+        lines.append("    {:<26} {:8.1f}/s  p50 {:7.1f}  p95 {:7.1f}  p99 {:7.1f} ms  errors {:.1%}".format(
+            name, s["requests_per_second"], s["p50_ms"], s["p95_ms"], s["p99_ms"], s["error_rate"]))
+    return lines
+
+
+class Player(object):
+    """
+    One simulated player
+    """
+
+    def __init__(self, number, base, stats, args, rng):
+        url = urlsplit(base)
+        self.conn = Connection(url.hostname, url.port or 80, args.timeout)
+        self.prefix = url.path.rstrip("/")
+        self.number = number
+        self.stats = stats
+        self.args = args
+        self.rng = rng
+        self.catalog = []
+        self.etag = None
+
+    async def call(self, endpoint, method, path, body=None, headers=None):
+        """
+        Sends a request timing it under the endpoint name. Returns (status,
+        decoded JSON body or None, headers); status is None if it failed.
+        """
+        start = time.perf_counter()
+        try:
+            status, resp_headers, data = await self.conn.request(method, self.prefix + path, body, headers)
+        except (OSError, HTTPError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+            self.stats.record(endpoint, time.perf_counter() - start, type(e).__name__)
+            return None, None, {}
+        self.stats.record(endpoint, time.perf_counter() - start, status)
+        try:
+            decoded = json.loads(data) if data else None
+        except ValueError:
+            decoded = None
+        return status, decoded, resp_headers
+
+    async def think(self, mean):
+        if mean > 0:
+            await asyncio.sleep(self.rng.expovariate(1.0 / mean))
+
+    async def run(self, deadline):
+        try:
+            status, body, _ = await self.call("BlockCollection.get", "GET", "/api/blocks/")
+            if status != 200:
+                return
+            self.catalog = [(b["id"], b["shape"]) for b in body["items"]]
+            while time.perf_counter() < deadline:
+                joined = await self.join()
+                if joined is None:
+                    await self.think(self.args.poll)
+                    continue
+                await self.play(*joined, deadline)
+        finally:
+            await self.conn.close()
+
+    async def join(self):
+        """
+        Joins an open game from the lobby or creates one. Returns (handle,
+        color) or None if joining failed.
+        """
+        status, lobby, _ = await self.call(
+            "GameCollection.get", "GET", "/api/games/?open=1&fields=handle,open_seats")
+        if status != 200:
+            return None
+        games = [g["handle"] for g in lobby["items"] if g["open_seats"] > 0]
+        if games:
+            handle = self.rng.choice(games[:20])
+        else:
+            handle = "load-{}".format(uuid.uuid4().hex[:12])
+            status, _, _ = await self.call("GameCollection.post", "POST", "/api/games/", {"handle": handle})
+            if status != 201:
+                return None
+            self.stats.count("games_created")
+
+        status, game, _ = await self.call("GameItem.get", "GET", "/api/games/{}/".format(handle))
+        if status != 200:
+            return None
+        free = [c for c in COLORS if c not in {p["color"] for p in game["players"]}]
+        if not free:
+            return None
+        color = self.rng.choice(free)
+        status, _, _ = await self.call(
+            "GameItem.post", "POST", "/api/games/{}/".format(handle), {"color": color})
+        if status != 201:
+            return None
+        self.stats.count("games_joined")
+        self.etag = None
+        return handle, color
+
+    async def poll(self, handle):
+        """
+        Gets the game, revalidating with the ETag of the last answer. Returns
+        the game, the unchanged previous game on 304, or None on errors.
+        """
+        headers = {"If-None-Match": self.etag} if self.etag else None
+        status, game, resp_headers = await self.call(
+            "GameItem.get", "GET", "/api/games/{}/".format(handle), headers=headers)
+        if status == 304:
+            return self.game
+        if status != 200:
+            return None
+        self.etag = resp_headers.get("etag")
+        self.game = game
+        return game
+
+    async def play(self, handle, color, deadline):
+        self.game = None
+        waited = time.perf_counter()
+        while time.perf_counter() < deadline:
+            game = await self.poll(handle)
+            if game is None:
+                return
+            board = Board.from_string(game["placed_blocks"])
+            players = game["players"]
+            used = {p["color"]: {int(b) for b in p["used_blocks"].split(",") if b} for p in players}
+            seats = [p["color"] for p in players]
+            options = {c: self._moves(board, c, used[c]) for c in seats}
+            if len(seats) == SEATS and not any(options.values()):
+                self.stats.count("games_finished")
+                return
+            if len(seats) == SEATS and game["turn_information"] == color:
+                await self.think(self.args.think)
+                if not await self.move(handle, color, board, seats, used, options[color]):
+                    return
+                waited = time.perf_counter()
+            else:
+                if time.perf_counter() - waited > self.args.table_timeout:
+                    # Nobody moved for too long, e.g. a player left the table
+                    return
+                await self.think(self.args.poll)
+
+    def _moves(self, board, color, used):
+        return legal_moves(board, color, [(b, s) for b, s in self.catalog if b not in used])
+
+    async def move(self, handle, color, board, seats, used, moves):
+        """
+        Places a random legal block, or passes, with the transaction cycle or
+        a single request to the moves endpoint
+        """
+        move = self.rng.choice(moves) if moves else None
+        new_board = Board(board.bitboards)
+        used_blocks = "".join("{},".format(b) for b in sorted(used[color]))
+        if move is not None:
+            block, orientation, x, y = move
+            new_board.place(color, placement_mask(dict(self.catalog)[block], orientation, x, y))
+            used_blocks += "{},".format(block)
+
+        if self.args.moves == "single":
+            body = {"player": color}
+            if move is not None:
+                body.update(zip(("block", "orientation", "x", "y"), move))
+            status, _, _ = await self.call("MoveFactory.post", "POST", "/api/games/{}/moves/".format(handle), body)
+            if status == 201:
+                self.stats.count("moves")
+            return status == 201
+
+        # Like the server, the turn goes to the next player in joining order
+        # who can still move
+        index = seats.index(color)
+        next_player = color
+        for step in range(1, SEATS + 1):
+            candidate = seats[(index + step) % SEATS]
+            candidate_used = used[candidate] | ({move[0]} if move and candidate == color else set())
+            if self._moves(new_board, candidate, candidate_used):
+                next_player = candidate
+                break
+        status, _, headers = await self.call(
+            "TransactionFactory.post", "POST", "/api/transactions/", {"player": color, "game": handle})
+        if status != 201:
+            return False
+        path = urlsplit(headers["location"]).path
+        if self.prefix and path.startswith(self.prefix):
+            path = path[len(self.prefix):]
+        status, _, _ = await self.call("TransactionItem.put", "PUT", path, {
+            "player": color, "game": handle, "placed_blocks": new_board.to_string(),
+            "used_blocks": used_blocks, "next_player": next_player, "commit": 1,
+        })
+        if status == 202:
+            self.stats.count("moves")
+        # 409 means another request changed the game first, poll again
+        return status in (202, 409)
+
+
+async def run_load(base, args):
+    """
+    Starts the players over the ramp up time and reports every interval
+    """
+    stats = Stats()
+    rng = random.Random(args.seed)
+    deadline = time.perf_counter() + args.duration
+    tasks = []
+
+    async def reporter():
+        while True:
+            await asyncio.sleep(args.interval)
+            running = sum(1 for t in tasks if not t.done())
+            print("\n".join(format_interval(stats.roll(running))), flush=True)
+
+    report_task = asyncio.ensure_future(reporter())
+    for number in range(args.players):
+        player = Player(number, base, stats, args, random.Random(rng.getrandbits(64)))
+        tasks.append(asyncio.ensure_future(player.run(deadline)))
+        if args.ramp > 0:
+            await asyncio.sleep(args.ramp / args.players)
+    await asyncio.gather(*tasks, return_exceptions=True)
+    report_task.cancel()
+    if stats.interval:
+        print("\n".join(format_interval(stats.roll(0))), flush=True)
+    return stats.report()
+
+
+def _serve(db_fname, config, ports):
+    """
+    Runs a threaded server on a free port in a child process
+    """
+    from werkzeug.serving import make_server
+    from blokus import create_app, db
+    from blokus.models import generate_blocks
+    from benchmarks.run import _QuietRequestHandler
+
+    app = create_app(dict({"SQLALCHEMY_DATABASE_URI": "sqlite:///" + db_fname}, **config))
+    with app.app_context():
+        db.create_all()
+        generate_blocks()
+    server = make_server("127.0.0.1", 0, app, threaded=True, request_handler=_QuietRequestHandler)
+    ports.put(server.server_port)
+    server.serve_forever()
+
+
+def start_server(db_fname, config):
+    """
+    Starts a server process and returns it with its URL
+    """
+    ports = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_serve, args=(db_fname, config, ports), daemon=True)
+    process.start()
+    return process, "http://127.0.0.1:{}".format(ports.get(timeout=60))
+
+
+def _raise_file_limit(players):
+    """
+    Every player keeps a socket open, raise the soft limit of open files
+    """
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    wanted = players + 256
+    if soft != resource.RLIM_INFINITY and soft < wanted:
+        limit = wanted if hard == resource.RLIM_INFINITY else min(wanted, hard)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (limit, hard))
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="Server to load, by default one is started on a temporary database")
+    parser.add_argument("--players", type=int, default=100, help="Number of simulated players")
+    parser.add_argument("--duration", type=float, default=60, help="Seconds to run")
+    parser.add_argument("--ramp", type=float, default=10, help="Seconds over which the players are started")
+    parser.add_argument("--think", type=float, default=2.0, help="Mean seconds a player thinks before a move")
+    parser.add_argument("--poll", type=float, default=0.5, help="Mean seconds between polls of the game")
+    parser.add_argument("--table-timeout", type=float, default=60,
+        help="Seconds a player waits at a table where nothing happens")
+    parser.add_argument("--moves", choices=("transaction", "single"), default="transaction",
+        help="Send moves as a transaction create and commit or in a single request")
+    parser.add_argument("--timeout", type=float, default=30, help="Seconds before a request fails")
+    parser.add_argument("--interval", type=float, default=5, help="Seconds between reports")
+    parser.add_argument("--production", action="store_true",
+        help='Start the server with SQLITE_PROFILE = "production"')
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the players")
+    parser.add_argument("--output", help="File the JSON report is written to")
+    return parser
+
+
+def main(argv=None):
+    args = make_parser().parse_args(argv)
+
+    _raise_file_limit(args.players)
+    process = None
+    db_fd, db_fname = tempfile.mkstemp()
+    try:
+        base = args.url
+        if base is None:
+            config = {"SQLITE_PROFILE": "production"} if args.production else {}
+            process, base = start_server(db_fname, config)
+        result = asyncio.run(run_load(base, args))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.join()
+        os.close(db_fd)
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(db_fname + suffix):
+                os.unlink(db_fname + suffix)
+
+    print(json.dumps({k: v for k, v in result.items() if k != "intervals"}, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
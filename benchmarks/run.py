@@ -0,0 +1,309 @@
+"""
+Benchmarks of the hot api endpoints and of placement validation.
+
+A temporary database is seeded with games played with random legal moves,
+then every endpoint is called through the Flask test client and through a
+real WSGI server on localhost. Results are written as JSON and can be
+compared with an earlier run to spot regressions.
+"""
+
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import timeit
+
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+from blokus import create_app, db
+from blokus.models import *
+from blokus.engine import COLORS, Board, legal_moves, placement_mask
+from blokus.gameplay import GAME_OVER, apply_move, available_blocks
+
+FIRST_MOVE = "1" + "0" * 399
+
+
+def seed(games, moves, targets, rng):
+    """
+    Adds the block catalog, games of four players with up to moves random
+    legal moves each and targets one player games with an uncommitted
+    transaction for the commit benchmark. Returns the handles of the played
+    games and the (handle, transaction id) pairs of the targets.
+    """
+    generate_blocks()
+    catalog = [(b.id, b.shape) for b in Block.query.all()]
+    handles = []
+    for g in range(games):
+        game = Game(handle="bench-{}".format(g), placed_blocks="0" * 400, turn_information=1)
+        for color in (1, 2, 3, 4):
+            game.players.append(Player(color=color, used_blocks=""))
+        db.session.add(game)
+        db.session.flush()
+        for _ in range(moves):
+            if game.turn_information == GAME_OVER:
+                break
+            player = next(p for p in game.players if p.color == game.turn_information)
+            board = Board.from_bytes(game.board)
+            options = legal_moves(board, player.color, available_blocks(player, catalog))
+            apply_move(game, player, *rng.choice(options))
+        db.session.commit()
+        handles.append(game.handle)
+
+    commits = []
+    for t in range(targets):
+        game = Game(handle="commit-{}".format(t), placed_blocks="0" * 400, turn_information=1)
+        player = Player(color=1, used_blocks="")
+        game.players.append(player)
+        transaction = Transaction(game=game, player=player, board=game.board, used_blocks="")
+        db.session.add(game)
+        db.session.add(transaction)
+        db.session.flush()
+        commits.append((game.handle, transaction.id))
+    db.session.commit()
+    return handles, commits
+
+
+def endpoint_requests(handles, commits):
+    """
+    Returns the benchmarked endpoints as functions from the iteration number
+    to a (method, url, json body, expected status) request
+    """
+    def put_commit(i):
+        handle, transaction = commits[i]
+        return "PUT", "/api/transactions/{}/".format(transaction), {
+            "player": 1, "game": handle, "placed_blocks": FIRST_MOVE,
+            "next_player": 1, "commit": 1
+        }, 202
+
+    return {
+        "GameItem.get": lambda i: (
+            "GET", "/api/games/{}/".format(handles[i % len(handles)]), None, 200
+        ),
+        "GameCollection.get": lambda i: ("GET", "/api/games/", None, 200),
+        "TransactionFactory.post": lambda i: (
+            "POST", "/api/transactions/", {"player": 1, "game": handles[i % len(handles)]}, 201
+        ),
+        "TransactionItem.put commit": put_commit,
+    }
+
+
+def summarize(latencies, elapsed):
+    """
+    Returns the request rate and latency percentiles in milliseconds
+    """
+    ordered = sorted(latencies)
+    def percentile(p):
+        return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] * 1000
+    return {
+        "requests": len(ordered),
+        "requests_per_second": len(ordered) / elapsed,
+        "p50_ms": percentile(50),
+        "p99_ms": percentile(99),
+        "max_ms": ordered[-1] * 1000,
+    }
+
+
+def measure(send, make_request, count, warmup):
+    """
+    Sends warmup requests and then count timed requests one after another
+    """
+    for i in range(warmup):
+        send(*make_request(i))
+    latencies = []
+    start = time.perf_counter()
+    for i in range(warmup, warmup + count):
+        request = make_request(i)
+        t0 = time.perf_counter()
+        send(*request)
+        latencies.append(time.perf_counter() - t0)
+    return summarize(latencies, time.perf_counter() - start)
+
+
+def _check(method, url, status, expected):
+    if status != expected:
+        raise RuntimeError("{} {} returned {}, expected {}".format(method, url, status, expected))
+
+
+def bench_test_client(app, endpoints, count, warmup, offset):
+    client = app.test_client()
+    def send(method, url, body, expected):
+        resp = client.open(url, method=method, json=body)
+        resp.get_data()
+        _check(method, url, resp.status_code, expected)
+    return {
+        name: measure(send, lambda i, r=make_request: r(i + offset), count, warmup)
+        for name, make_request in endpoints.items()
+    }
+
+
+class _QuietRequestHandler(WSGIRequestHandler):
+    # Keep-alive connections like a browser or the pygame client would use
+    protocol_version = "HTTP/1.1"
+
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+def bench_wsgi(app, endpoints, count, warmup, offset):
+    server = make_server("127.0.0.1", 0, app, threaded=True, request_handler=_QuietRequestHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    conn = http.client.HTTPConnection("127.0.0.1", server.server_port)
+    def send(method, url, body, expected):
+        headers = {}
+        payload = None
+        if body is not None:
+            payload = json.dumps(body)
+            headers["Content-Type"] = "application/json"
+        conn.request(method, url, body=payload, headers=headers)
+        resp = conn.getresponse()
+        resp.read()
+        _check(method, url, resp.status, expected)
+    try:
+        return {
+            name: measure(send, lambda i, r=make_request: r(i + offset), count, warmup)
+            for name, make_request in endpoints.items()
+        }
+    finally:
+        conn.close()
+        server.shutdown()
+
+
+def bench_engine(board, catalog, number):
+    """
+    Microbenchmarks of validating placements on a midgame board, in
+    microseconds per call
+    """
+    color = next((c for c in COLORS if legal_moves(board, c, catalog)), 1)
+    options = legal_moves(board, color, catalog)
+    shapes = dict(catalog)
+    masks = [placement_mask(shapes[b], o, x, y) for b, o, x, y in options]
+    # A board after one legal move, or the same board if the color must pass
+    after = Board(board.bitboards)
+    if masks:
+        after.place(color, masks[0])
+
+    def per_call(stmt, calls):
+        return min(timeit.repeat(stmt, number=number, repeat=3)) / (number * max(calls, 1)) * 1e6
+
+    return {
+        "legal_moves": len(options),
+        "is_legal_us": per_call(lambda: [board.is_legal(color, m) for m in masks], len(masks)),
+        "validate_placement_us": per_call(lambda: [board.validate_placement(color, m) for m in masks], len(masks)),
+        "validate_transition_us": per_call(lambda: board.validate_transition(after, color), 1),
+        "legal_moves_us": per_call(lambda: legal_moves(board, color, catalog), 1),
+    }
+
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(games=50, moves=20, requests=200, warmup=20, server=True, engine_number=200, seed_value=0):
+    """
+    Seeds a temporary database and runs every benchmark. Returns the results
+    as a dictionary.
+    """
+    rng = random.Random(seed_value)
+    db_fd, db_fname = tempfile.mkstemp()
+    runs = 2 if server else 1
+    app = create_app({
+        "SQLALCHEMY_DATABASE_URI": "sqlite:///" + db_fname,
+        "SNAPSHOT_INTERVAL": 16,
+    })
+    try:
+        with app.app_context():
+            db.create_all()
+            start = time.perf_counter()
+            handles, commits = seed(games, moves, (requests + warmup) * runs, rng)
+            seed_seconds = time.perf_counter() - start
+            catalog = [(b.id, b.shape) for b in Block.query.all()]
+            board = Board.from_bytes(Game.query.filter_by(handle=handles[0]).first().board)
+            transactions = Transaction.query.count()
+
+        endpoints = endpoint_requests(handles, commits)
+        results = {
+            "meta": {
+                "revision": _git_revision(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "games": games,
+                "transactions": transactions,
+                "requests": requests,
+                "seed_seconds": seed_seconds,
+            },
+            "test_client": bench_test_client(app, endpoints, requests, warmup, 0),
+        }
+        if server:
+            results["wsgi"] = bench_wsgi(app, endpoints, requests, warmup, requests + warmup)
+        results["engine"] = bench_engine(board, catalog, engine_number)
+        with app.app_context():
+            db.engine.dispose()
+        return results
+    finally:
+        os.close(db_fd)
+        os.unlink(db_fname)
+
+
+def compare(results, baseline):
+    """
+    Returns lines comparing the latencies and engine timings to a baseline
+    """
+    lines = []
+    for section in ("test_client", "wsgi"):
+        for name, stats in results.get(section, {}).items():
+            old = baseline.get(section, {}).get(name)
+            if old:
+                lines.append("{:<12} {:<28} p50 {:+6.1f}%  p99 {:+6.1f}%".format(
+                    section, name,
+                    (stats["p50_ms"] / old["p50_ms"] - 1) * 100,
+                    (stats["p99_ms"] / old["p99_ms"] - 1) * 100
+                ))
+    for name, value in results["engine"].items():
+        old = baseline.get("engine", {}).get(name)
+        if name.endswith("_us") and old:
+            lines.append("{:<12} {:<28} {:+6.1f}%".format("engine", name, (value / old - 1) * 100))
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--games", type=int, default=50, help="Number of seeded games")
+    parser.add_argument("--moves", type=int, default=20, help="Moves played in every seeded game")
+    parser.add_argument("--requests", type=int, default=200, help="Timed requests per endpoint")
+    parser.add_argument("--warmup", type=int, default=20, help="Untimed requests per endpoint")
+    parser.add_argument("--no-server", action="store_true", help="Skip the WSGI server runs")
+    parser.add_argument("--output", help="File the JSON results are written to")
+    parser.add_argument("--compare", help="Earlier results to compare against")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(
+        games=args.games, moves=args.moves, requests=args.requests,
+        warmup=args.warmup, server=not args.no_server
+    )
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare) as f:
+            print("\n".join(compare(results, json.load(f))))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
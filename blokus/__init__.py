@@ -29,10 +29,23 @@ def create_app(test_config=None):
     except OSError:
         pass
 
+    from blokus.storage import configure_engine, install_pragmas
+    configure_engine(app)
     db.init_app(app)
+    install_pragmas(app)
+    from blokus.metrics import init_metrics
+    init_metrics(app)
+    from blokus.notify import GameNotifier
+    from blokus.cache import create_backend
+    app.extensions["blokus_notifier"] = GameNotifier()
+    app.extensions["blokus_cache"] = create_backend(app.config)
+    from blokus.ai import BotRunner
+    app.extensions["blokus_bots"] = BotRunner(app)
     from . import models
+    from . import migrate
     from . import api
     app.cli.add_command(models.init_db_command)
+    app.cli.add_command(migrate.migrate_db_command)
     #app.cli.add_command(models.generate_test_data)
     #app.cli.add_command(models.generate_blocks)
     app.register_blueprint(api.api_bp)
@@ -47,10 +60,10 @@ def create_app(test_config=None):
     
     @app.route("/api/")
     def entry():
-        from blokus.utils import BlokusBuilder
+        from blokus.utils import BlokusBuilder, dumps
         body = BlokusBuilder()
         body.add_namespace("blokus", LINK_RELATIONS_URL)
         body.add_control_get_blocks()
         body.add_control_get_games()
-        return Response(json.dumps(body), 200, mimetype=MASON)
+        return Response(dumps(body), 200, mimetype=MASON)
     return app
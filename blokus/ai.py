@@ -0,0 +1,357 @@
+"""
+Server side AI players.
+
+A bot picks its move with Monte Carlo tree search: the tree is grown with
+UCT from the bot's legal moves and every new node is scored by a random
+playout. Playouts do not enumerate legal moves, they try random blocks on
+random free corner cells and check each try with a few bitwise operations,
+and they stop after PLAYOUT_ROUNDS rounds where the placed cells are
+counted, which is the Blokus score. Searches run in a process pool so they
+do not block the request workers, the chosen move is then applied and
+committed from a background thread like a move of any other player.
+"""
+
+import math
+import random
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from sqlalchemy.orm import selectinload
+from blokus import db
+from blokus.constants import MAX_PLAYERS
+from blokus.models import *
+from blokus.engine import (
+    BOARD_SIZE, CORNERS, Board, IllegalMoveError, cells, compile_shape,
+    diagonals, edges, legal_moves, popcount
+)
+from blokus.utils import lock_for_update, parse_used_blocks
+
+# Seconds a bot may think about one move, unless configured
+MOVE_TIME = 1.0
+# Rounds of moves a playout makes before the position is scored
+PLAYOUT_ROUNDS = 4
+# Random placements a playout tries before the player passes
+PLAYOUT_TRIES = 24
+# Moves considered in a tree node, the largest blocks first
+MAX_CHILDREN = 48
+# UCT exploration constant
+EXPLORATION = 0.7
+# Tries to commit the move of a bot, the last one is a pass
+COMMIT_RETRIES = 3
+# Seconds to wait before the second try, every further try waits longer
+RETRY_DELAY = 0.1
+
+
+class _Position(object):
+    """
+    Game state inside a search: color bitboards, the blocks every color has
+    left, the seating order and whose turn it is
+    """
+
+    __slots__ = ("bitboards", "remaining", "order", "turn", "passes")
+
+    def __init__(self, bitboards, remaining, order, turn, passes=0):
+        self.bitboards = bitboards
+        self.remaining = remaining
+        self.order = order
+        self.turn = turn
+        self.passes = passes
+
+    def copy(self):
+        return _Position(
+            list(self.bitboards),
+            {color: list(blocks) for color, blocks in self.remaining.items()},
+            self.order, self.turn, self.passes
+        )
+
+    @property
+    def color(self):
+        return self.order[self.turn]
+
+    @property
+    def finished(self):
+        return self.passes >= len(self.order)
+
+    def play(self, move):
+        """
+        Applies a (block id, mask) move, or a pass if move is None
+        """
+        if move is None:
+            self.passes += 1
+        else:
+            block_id, mask = move
+            self.bitboards[self.color] |= mask
+            self.remaining[self.color].remove(block_id)
+            self.passes = 0
+        self.turn = (self.turn + 1) % len(self.order)
+
+    def rewards(self):
+        """
+        Returns the share of the win of every color, ties split the win
+        """
+        scores = {color: popcount(self.bitboards[color]) for color in self.order}
+        best = max(scores.values())
+        winners = [color for color, score in scores.items() if score == best]
+        return {color: (1.0 / len(winners) if color in winners else 0.0) for color in self.order}
+
+
+class _Node(object):
+    __slots__ = ("move", "color", "parent", "children", "untried", "visits", "value")
+
+    def __init__(self, move, color, parent):
+        self.move = move
+        self.color = color
+        self.parent = parent
+        self.children = []
+        self.untried = None
+        self.visits = 0
+        self.value = 0.0
+
+    def select(self):
+        log_visits = math.log(self.visits)
+        return max(self.children, key=lambda c: (
+            c.value / c.visits + EXPLORATION * math.sqrt(log_visits / c.visits)
+        ))
+
+
+def _candidate_moves(position, shapes, rng):
+    """
+    Returns up to MAX_CHILDREN legal (block id, mask) moves of the color to
+    move, largest blocks first, or [None] if it has to pass
+    """
+    color = position.color
+    board = Board(position.bitboards)
+    moves = legal_moves(board, color, [(b, shapes[b]) for b in position.remaining[color]])
+    if not moves:
+        return [None]
+    rng.shuffle(moves)
+    moves.sort(key=lambda m: -len(compile_shape(shapes[m[0]])[m[1]].offsets))
+    return [
+        (block_id, compile_shape(shapes[block_id])[orientation].placements[x + y * BOARD_SIZE])
+        for block_id, orientation, x, y in moves[:MAX_CHILDREN]
+    ]
+
+
+def _playout(position, shapes, rng):
+    """
+    Plays random placements for PLAYOUT_ROUNDS rounds and returns the rewards
+    """
+    for _ in range(PLAYOUT_ROUNDS * len(position.order)):
+        if position.finished:
+            break
+        color = position.color
+        own = position.bitboards[color]
+        occupied = 0
+        for bitboard in position.bitboards:
+            occupied |= bitboard
+        if own == 0:
+            forbidden = occupied
+            corners = CORNERS & ~occupied
+        else:
+            forbidden = occupied | edges(own)
+            corners = diagonals(own) & ~forbidden
+        corner_cells = cells(corners)
+        remaining = position.remaining[color]
+        move = None
+        if corner_cells and remaining:
+            for _ in range(PLAYOUT_TRIES):
+                block_id = rng.choice(remaining)
+                orientation = rng.choice(compile_shape(shapes[block_id]))
+                cx, cy = rng.choice(corner_cells)
+                dx, dy = rng.choice(orientation.offsets)
+                x, y = cx - dx, cy - dy
+                if not (0 <= x < BOARD_SIZE and 0 <= y < BOARD_SIZE):
+                    continue
+                mask = orientation.placements[x + y * BOARD_SIZE]
+                if mask and not mask & forbidden:
+                    move = (block_id, mask)
+                    break
+        position.play(move)
+    return position.rewards()
+
+
+def choose_move(board, seats, color, catalog, move_time, seed=None):
+    """
+    Searches for the move of color. board is a packed board, seats the
+    (color, used block ids) pairs in seating order and catalog the (block
+    id, shape) pairs of all blocks. Returns (block id, orientation, x, y),
+    or None if the color has to pass. Runs in a pool worker process.
+    """
+    rng = random.Random(seed)
+    shapes = dict(catalog)
+    order = tuple(c for c, _ in seats)
+    remaining = {c: [b for b, _ in catalog if b not in used] for c, used in seats}
+    root_position = _Position(Board.from_bytes(board).bitboards, remaining, order, order.index(color))
+
+    options = legal_moves(Board(root_position.bitboards), color, [(b, shapes[b]) for b in remaining[color]])
+    if len(options) <= 1:
+        return options[0] if options else None
+
+    root = _Node(None, None, None)
+    deadline = time.perf_counter() + move_time
+    playouts = 0
+    while playouts == 0 or time.perf_counter() < deadline:
+        node = root
+        position = root_position.copy()
+        # Selection
+        while node.untried is not None and not node.untried and node.children:
+            node = node.select()
+            position.play(node.move)
+        # Expansion
+        if not position.finished:
+            if node.untried is None:
+                node.untried = _candidate_moves(position, shapes, rng)
+            if node.untried:
+                move = node.untried.pop(0)
+                child = _Node(move, position.color, node)
+                node.children.append(child)
+                position.play(move)
+                node = child
+        # Simulation and backpropagation
+        rewards = _playout(position, shapes, rng)
+        while node is not None:
+            node.visits += 1
+            if node.color is not None:
+                node.value += rewards[node.color]
+            node = node.parent
+        playouts += 1
+
+    best = max(root.children, key=lambda c: c.visits)
+    if best.move is None:
+        return None
+    block_id, mask = best.move
+    # Translate the chosen mask back to the orientation and anchor of the api
+    for option in options:
+        b, orientation, x, y = option
+        if b == block_id and compile_shape(shapes[b])[orientation].placements[x + y * BOARD_SIZE] == mask:
+            return option
+    return None
+
+
+class BotRunner(object):
+    """
+    Plays the turns of AI players. Searches run in a process pool of
+    AI_WORKERS processes, or in the calling thread if AI_INLINE is set, and
+    the moves are committed from a background thread. Bots only move once
+    every seat of the game is taken.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._pool = None
+        self._lock = threading.Lock()
+        self._pending = set()
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.app.config.get("AI_WORKERS"))
+            return self._pool
+
+    def schedule(self, state):
+        """
+        Starts the search for the next move if it is the turn of a bot and
+        no search for this version of the game is running. Called with the
+        state of a game after it was committed and whenever a state is read,
+        so a turn that was lost to a failure or a restart is played later.
+        """
+        players = state["players"]
+        seat = next((p for p in players if p["color"] == state["turn_information"]), None)
+        if seat is None or not seat.get("ai") or len(players) < MAX_PLAYERS:
+            return
+        key = (state["handle"], state["version"])
+        with self._lock:
+            if key in self._pending:
+                return
+            self._pending.add(key)
+
+        catalog = [(b.id, b.shape) for b in Block.query.order_by(Block.id)]
+        args = (
+            state["board"],
+            [(p["color"], parse_used_blocks(p["used_blocks"])) for p in players],
+            seat["color"], catalog, self.app.config.get("AI_MOVE_TIME", MOVE_TIME)
+        )
+        if self.app.config.get("AI_INLINE", False):
+            try:
+                move = choose_move(*args)
+            except Exception:
+                self.app.logger.exception("AI search for game %s failed, passing", key[0])
+                move = None
+            self._commit(key, move)
+            return
+        pool = None
+        try:
+            pool = self._get_pool()
+            future = pool.submit(choose_move, *args)
+        except Exception as e:
+            # The next read of the game tries again
+            self.app.logger.exception("AI search for game %s could not be started", key[0])
+            with self._lock:
+                self._pending.discard(key)
+                if isinstance(e, BrokenProcessPool) and self._pool is pool:
+                    # A worker died, start a new pool for the next search
+                    self._pool = None
+                    pool.shutdown(wait=False)
+            return
+        future.add_done_callback(lambda f: self._finish(key, f))
+
+    def _finish(self, key, future):
+        try:
+            move = future.result()
+        except Exception:
+            self.app.logger.exception("AI search for game %s failed, passing", key[0])
+            move = None
+        # The callback runs in the pool's thread, commit from a separate one
+        threading.Thread(target=self._commit_in_app, args=(key, move), daemon=True).start()
+
+    def _commit_in_app(self, key, move):
+        with self.app.app_context():
+            self._commit(key, move)
+
+    def _commit(self, key, move):
+        """
+        Plays the move, retrying if the commit fails, e.g. because the
+        database is locked. The last try passes, so that a move which can
+        not be committed does not leave the game waiting for the bot.
+        """
+        try:
+            for attempt, tried in enumerate([move] * (COMMIT_RETRIES - 1) + [None]):
+                try:
+                    self._play(key, tried)
+                    return
+                except Exception:
+                    db.session.rollback()
+                    self.app.logger.exception(
+                        "AI move for game %s failed, try %d of %d", key[0], attempt + 1, COMMIT_RETRIES
+                    )
+                    if attempt + 1 < COMMIT_RETRIES:
+                        time.sleep(RETRY_DELAY * (attempt + 1))
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+    def _play(self, key, move):
+        """
+        Applies the chosen move if the game is still at the searched version
+        """
+        from blokus.cache import commit_game
+        from blokus.gameplay import apply_move
+
+        handle, version = key
+        db_game = lock_for_update(
+            Game.query.options(selectinload(Game.players)).filter_by(handle=handle)
+        ).first()
+        if db_game is None or db_game.version != version:
+            db.session.rollback()
+            return
+        db_player = next(p for p in db_game.players if p.color == db_game.turn_information)
+        try:
+            apply_move(db_game, db_player, *(move or ()))
+        except (LookupError, IllegalMoveError):
+            # The catalog changed during the search
+            db.session.rollback()
+            db_game = Game.query.filter_by(handle=handle).first()
+            db_player = next(p for p in db_game.players if p.color == db_game.turn_information)
+            apply_move(db_game, db_player)
+        commit_game(db_game)
@@ -1,20 +1,27 @@
 from flask import Blueprint
 from flask_restful import Api
 
-from blokus.resources.game import GameCollection, GameItem
+from blokus.resources.game import GameCollection, GameItem, GameState
 from blokus.resources.block import BlockCollection, BlockItem
 from blokus.resources.transaction import TransactionFactory, TransactionItem
-from blokus.resources.player import PlayerItem
+from blokus.resources.player import PlayerItem, PlayerMoveCollection
+from blokus.resources.move import MoveFactory
+from blokus.resources.history import GameHistory, GameReplay
 
 api_bp = Blueprint("api", __name__, url_prefix="/api")
 api = Api(api_bp)
 
 api.add_resource(GameCollection, "/games/")
 api.add_resource(GameItem, "/games/<game>/")
+api.add_resource(MoveFactory, "/games/<game>/moves/")
+api.add_resource(GameState, "/games/<game>/state/")
+api.add_resource(GameReplay, "/games/<game>/replay/")
+api.add_resource(GameHistory, "/games/<game>/history/")
 api.add_resource(BlockCollection, "/blocks/")
 api.add_resource(BlockItem, "/blocks/<block>/")
 api.add_resource(TransactionFactory, "/transactions/")
 api.add_resource(TransactionItem, "/transactions/<transaction>/")
 api.add_resource(PlayerItem, "/games/<game>/players/<player>/")
+api.add_resource(PlayerMoveCollection, "/games/<game>/players/<player>/moves/")
 
 
@@ -0,0 +1,201 @@
+"""
+In process cache of active game states with write-through on commits.
+
+Reads of hot games are served from memory and only cold games are loaded
+from the database. The storage is pluggable: LocalBackend keeps the states
+in this process and is used for tests and single process servers, while
+RedisBackend shares them between worker processes. With several worker
+processes a shared backend must be used, otherwise a process may keep
+serving a state that another process has already changed.
+"""
+
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app
+from sqlalchemy.orm import selectinload
+from blokus import db
+from blokus.models import *
+from blokus.notify import notify_game_changed
+
+
+class LocalBackend(object):
+    """
+    Thread safe LRU mapping of game states that also drops entries not used
+    for idle_timeout seconds. A state only replaces a cached state of an
+    older version, so a commit that finishes late can not overwrite a newer
+    state.
+    """
+
+    def __init__(self, max_size=1024, idle_timeout=300):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, last_used = entry
+            if now - last_used > self.idle_timeout:
+                del self._entries[key]
+                return None
+            self._entries[key] = (value, now)
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0]["version"] < value["version"]:
+                entry = (value, now)
+            self._entries[key] = (entry[0], now)
+            self._entries.move_to_end(key)
+            # The least recently used entries are also the longest idle ones
+            while self._entries:
+                oldest_key, (_, last_used) = next(iter(self._entries.items()))
+                if len(self._entries) <= self.max_size and now - last_used <= self.idle_timeout:
+                    break
+                del self._entries[oldest_key]
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RedisBackend(object):
+    """
+    Cache shared by all worker processes through Redis. Entries expire after
+    idle_timeout seconds without use, size limits are left to the Redis
+    maxmemory policy. Every entry is a hash of the pickled state and its
+    version, which the set script compares so that only newer states are
+    written. Requires the redis package.
+    """
+
+    # KEYS[1] entry, ARGV[1] version, ARGV[2] pickled state, ARGV[3] timeout
+    SET_SCRIPT = """
+    local current = redis.call("HGET", KEYS[1], "version")
+    if not current or tonumber(current) < tonumber(ARGV[1]) then
+        redis.call("HSET", KEYS[1], "version", ARGV[1], "state", ARGV[2])
+    end
+    redis.call("EXPIRE", KEYS[1], ARGV[3])
+    """
+
+    def __init__(self, url, idle_timeout=300, prefix="blokus:game:"):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.idle_timeout = idle_timeout
+        self.prefix = prefix
+        self._set_script = self.client.register_script(self.SET_SCRIPT)
+
+    def get(self, key):
+        pipe = self.client.pipeline()
+        pipe.hget(self.prefix + key, "state")
+        pipe.expire(self.prefix + key, self.idle_timeout)
+        value, _ = pipe.execute()
+        return None if value is None else pickle.loads(value)
+
+    def set(self, key, value):
+        self._set_script(
+            keys=[self.prefix + key],
+            args=[value["version"], pickle.dumps(value), self.idle_timeout]
+        )
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+
+def create_backend(config):
+    """
+    Creates the cache backend selected by GAME_CACHE_BACKEND, or returns None
+    if caching is disabled
+    """
+    kind = config.get("GAME_CACHE_BACKEND", "local")
+    idle_timeout = config.get("GAME_CACHE_IDLE_TIMEOUT", 300)
+    if kind is None:
+        return None
+    if kind == "local":
+        return LocalBackend(config.get("GAME_CACHE_SIZE", 1024), idle_timeout)
+    if kind == "redis":
+        return RedisBackend(config["GAME_CACHE_URL"], idle_timeout)
+    raise ValueError("Unknown GAME_CACHE_BACKEND {}".format(kind))
+
+
+def game_state(db_game):
+    """
+    Returns the cached representation of a game: its decoded board, turn,
+    version and players in joining order
+    """
+    return {
+        "id": db_game.id,
+        "handle": db_game.handle,
+        # PostgreSQL drivers return memoryviews, which can not be pickled
+        "board": None if db_game.board is None else bytes(db_game.board),
+        "turn_information": db_game.turn_information or 0,
+        "version": db_game.version,
+        "players": [
+            {"id": p.id, "color": p.color, "used_blocks": p.used_blocks, "ai": bool(p.ai)}
+            for p in sorted(db_game.players, key=lambda p: p.id)
+        ]
+    }
+
+
+def load_game_state(handle):
+    """
+    Returns the state of the game from the cache, loading it from the
+    database on a miss. Returns None if the game does not exist.
+    """
+    backend = current_app.extensions.get("blokus_cache")
+    state = backend.get(handle) if backend is not None else None
+    if state is None:
+        db_game = Game.query.options(selectinload(Game.players)).filter_by(handle=handle).first()
+        if db_game is None:
+            return None
+        state = game_state(db_game)
+        if backend is not None:
+            backend.set(handle, state)
+    wake_bots(state)
+    return state
+
+
+def commit_game(db_game):
+    """
+    Commits the session, writes the new state of the game through to the
+    cache and wakes up requests waiting for the game to change
+    """
+    db.session.flush()
+    state = game_state(db_game)
+    db.session.commit()
+    backend = current_app.extensions.get("blokus_cache")
+    if backend is not None:
+        backend.set(state["handle"], state)
+    notify_game_changed(state["handle"])
+    wake_bots(state)
+
+
+def wake_bots(state):
+    """
+    Lets a bot play if it is its turn in the game. Searches that are
+    already running for the same version of the game are not repeated.
+    """
+    bots = current_app.extensions.get("blokus_bots")
+    if bots is not None:
+        bots.schedule(state)
+
+
+def forget_game(handle):
+    """
+    Drops a deleted game from the cache and wakes up its waiting requests
+    """
+    backend = current_app.extensions.get("blokus_cache")
+    if backend is not None:
+        backend.delete(handle)
+    notify_game_changed(handle)
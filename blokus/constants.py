@@ -1,4 +1,5 @@
 MASON = "application/vnd.mason+json"
+NDJSON = "application/x-ndjson"
 LINK_RELATIONS_URL = "/blokus/link-relations"
 
 ERROR_PROFILE = "/profiles/error/"
@@ -6,4 +7,27 @@ GAME_PROFILE = "/profiles/game/"
 PLAYER_PROFILE = "/profiles/player/"
 TRANSACTION_PROFILE = "/profiles/transaction/"
 BLOCK_PROFILE = "/profiles/block/"
+MOVE_PROFILE = "/profiles/move/"
 
+MAX_PLAYERS = 4
+
+# Default and largest number of items on one page of a collection
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# Blocks rarely change so clients may reuse them without revalidating
+BLOCK_CACHE_CONTROL = "public, max-age=3600"
+
+# Longest time a game state request may wait for a change, in seconds
+LONG_POLL_MAX_WAIT = 30
+# How often waiting requests re-check the database for changes made by
+# other processes, in seconds
+LONG_POLL_INTERVAL = 1
+
+
+# A snapshot of the board is stored after every this many committed moves of
+# a game, which bounds the number of moves a replay has to apply
+SNAPSHOT_INTERVAL = 16
+
+# Rows fetched from the database at a time when streaming a game history
+HISTORY_BATCH_SIZE = 500
@@ -0,0 +1,384 @@
+"""
+Bitboard based rules engine for Blokus.
+
+The board is 20x20 cells and cell (x, y) maps to bit x + y*20, which is the
+same indexing the client and the placed_blocks string use. Every color has
+its own integer bitboard, so checking a placement is a handful of bitwise
+operations instead of scanning the neighbours of every cell.
+"""
+
+from functools import lru_cache
+
+BOARD_SIZE = 20
+BLOCK_SIZE = 5
+CELL_COUNT = BOARD_SIZE * BOARD_SIZE
+COLORS = (1, 2, 3, 4)
+
+FULL_BOARD = (1 << CELL_COUNT) - 1
+
+# Packed boards are the four color bitboards as 50 byte little endian integers
+PACKED_COLOR_SIZE = CELL_COUNT // 8
+PACKED_BOARD_SIZE = PACKED_COLOR_SIZE * len(COLORS)
+
+# Column masks used to stop horizontal shifts from wrapping to the next row
+_FIRST_COLUMN = sum(1 << (y * BOARD_SIZE) for y in range(BOARD_SIZE))
+_LAST_COLUMN = _FIRST_COLUMN << (BOARD_SIZE - 1)
+NOT_FIRST_COLUMN = FULL_BOARD ^ _FIRST_COLUMN
+NOT_LAST_COLUMN = FULL_BOARD ^ _LAST_COLUMN
+
+
+def cell_bit(x, y):
+    """
+    Returns the bit of the cell at column x and row y
+    """
+    return 1 << (x + y * BOARD_SIZE)
+
+
+CORNERS = (
+    cell_bit(0, 0)
+    | cell_bit(BOARD_SIZE - 1, 0)
+    | cell_bit(0, BOARD_SIZE - 1)
+    | cell_bit(BOARD_SIZE - 1, BOARD_SIZE - 1)
+)
+
+
+class IllegalMoveError(ValueError):
+    """
+    Error for a placement that breaks the rules of the game
+    """
+
+
+def popcount(mask):
+    """
+    Returns the number of set bits in the mask
+    """
+    return bin(mask).count("1")
+
+
+def edges(mask):
+    """
+    Returns the cells sharing a side with any cell of the mask
+    """
+    return (
+        ((mask << 1) & NOT_FIRST_COLUMN)
+        | ((mask >> 1) & NOT_LAST_COLUMN)
+        | (mask << BOARD_SIZE)
+        | (mask >> BOARD_SIZE)
+    ) & FULL_BOARD
+
+
+def diagonals(mask):
+    """
+    Returns the cells touching any cell of the mask by a corner only
+    """
+    return (
+        ((mask << (BOARD_SIZE + 1)) & NOT_FIRST_COLUMN)
+        | ((mask << (BOARD_SIZE - 1)) & NOT_LAST_COLUMN)
+        | ((mask >> (BOARD_SIZE - 1)) & NOT_FIRST_COLUMN)
+        | ((mask >> (BOARD_SIZE + 1)) & NOT_LAST_COLUMN)
+    ) & FULL_BOARD
+
+
+def is_connected(mask):
+    """
+    Returns True if the cells of the mask form a single side connected piece
+    """
+    if mask == 0:
+        return False
+    reached = mask & -mask
+    while True:
+        grown = (reached | edges(reached)) & mask
+        if grown == reached:
+            return reached == mask
+        reached = grown
+
+
+def cells(mask):
+    """
+    Returns the (x, y) coordinates of the cells set in the mask
+    """
+    result = []
+    while mask:
+        low = mask & -mask
+        index = low.bit_length() - 1
+        result.append((index % BOARD_SIZE, index // BOARD_SIZE))
+        mask ^= low
+    return result
+
+
+def fits_block_frame(mask):
+    """
+    Returns True if the cells of the mask fit inside the 5x5 frame of a block
+    """
+    if popcount(mask) > BLOCK_SIZE * BLOCK_SIZE:
+        return False
+    xs, ys = zip(*cells(mask))
+    return max(xs) - min(xs) < BLOCK_SIZE and max(ys) - min(ys) < BLOCK_SIZE
+
+
+class Orientation(object):
+    """
+    One distinct rotation or reflection of a block shape. Offsets are (dx, dy)
+    pairs relative to the center cell of the 5x5 block frame, which is the
+    anchor the client uses when placing a block under the mouse. Block shapes
+    must cover the center cell, so the anchor of a placement is always one of
+    its cells and on the board. frame_mask has bit dx+2 + (dy+2)*5 set for
+    every cell and placements holds the board mask for every anchor cell, or
+    0 where the block would leave the board.
+    """
+
+    __slots__ = ("offsets", "frame_mask", "placements")
+
+    def __init__(self, offsets):
+        self.offsets = offsets
+        half = BLOCK_SIZE // 2
+        self.frame_mask = sum(1 << (dx + half + (dy + half) * BLOCK_SIZE) for dx, dy in offsets)
+        placements = []
+        for y in range(BOARD_SIZE):
+            for x in range(BOARD_SIZE):
+                mask = 0
+                for dx, dy in offsets:
+                    cx, cy = x + dx, y + dy
+                    if not (0 <= cx < BOARD_SIZE and 0 <= cy < BOARD_SIZE):
+                        mask = 0
+                        break
+                    mask |= cell_bit(cx, cy)
+                placements.append(mask)
+        self.placements = tuple(placements)
+
+
+def _normalized(offsets):
+    """
+    Returns the offsets translated so the smallest coordinates are 0, sorted
+    in board index order. Equal results mean the same set of placements.
+    """
+    min_x = min(dx for dx, dy in offsets)
+    min_y = min(dy for dx, dy in offsets)
+    return tuple(sorted(((dx - min_x, dy - min_y) for dx, dy in offsets), key=lambda c: (c[1], c[0])))
+
+
+@lru_cache(maxsize=None)
+def compile_shape(shape):
+    """
+    Returns every distinct rotation and reflection of a 25 character block
+    shape as a tuple of Orientations. Rotations come first in 90 degree
+    counterclockwise steps, matching pygame.transform.rotate, followed by the
+    rotations of the mirrored shape. Symmetric duplicates are dropped.
+    """
+    half = BLOCK_SIZE // 2
+    base = tuple(
+        (i % BLOCK_SIZE - half, i // BLOCK_SIZE - half)
+        for i, c in enumerate(shape) if c != "0"
+    )
+    if not base:
+        return ()
+    mirrored = tuple((-dx, dy) for dx, dy in base)
+    orientations = []
+    seen = set()
+    for offsets in (base, mirrored):
+        for _ in range(4):
+            key = _normalized(offsets)
+            if key not in seen:
+                seen.add(key)
+                orientations.append(Orientation(offsets))
+            # Counterclockwise on screen, where y grows downwards
+            offsets = tuple((dy, -dx) for dx, dy in offsets)
+    return tuple(orientations)
+
+
+def match_placement(shape, mask):
+    """
+    Finds the orientation of the shape covering exactly the cells of the mask.
+    Returns (orientation index, x, y) of the anchor or None if there is none.
+    """
+    placed = _normalized(cells(mask))
+    first = cells(mask & -mask)[0] if mask else None
+    for index, orientation in enumerate(compile_shape(shape)):
+        if len(orientation.offsets) != len(placed) or _normalized(orientation.offsets) != placed:
+            continue
+        # The lowest board index cell is the first offset in board index order
+        dx, dy = min(orientation.offsets, key=lambda c: (c[1], c[0]))
+        return index, first[0] - dx, first[1] - dy
+    return None
+
+
+def placement_mask(shape, orientation, x, y):
+    """
+    Returns the board mask of the shape placed in the given orientation with
+    its frame center on cell (x, y). Raises IllegalMoveError if there is no
+    such orientation or the block would leave the board.
+    """
+    orientations = compile_shape(shape)
+    if not 0 <= orientation < len(orientations):
+        raise IllegalMoveError("Block has no orientation {}".format(orientation))
+    mask = 0
+    if 0 <= x < BOARD_SIZE and 0 <= y < BOARD_SIZE:
+        mask = orientations[orientation].placements[x + y * BOARD_SIZE]
+    if mask == 0:
+        raise IllegalMoveError("Block does not fit on the board at that position")
+    return mask
+
+
+class Board(object):
+    """
+    Game board stored as one bitboard per color
+    """
+
+    __slots__ = ("bitboards",)
+
+    def __init__(self, bitboards=None):
+        # Index 0 is unused so the list can be indexed with the color id
+        self.bitboards = list(bitboards) if bitboards is not None else [0] * 5
+
+    @classmethod
+    def from_string(cls, placed_blocks):
+        """
+        Builds a board from the 400 character placed_blocks string
+        """
+        if placed_blocks is None or len(placed_blocks) != CELL_COUNT:
+            raise ValueError("Board state must be {} characters long".format(CELL_COUNT))
+        bitboards = [0] * 5
+        for color in COLORS:
+            bits = placed_blocks.translate(_COLOR_TABLES[color])
+            if len(bits.strip("01")) != 0:
+                raise ValueError("Board state may only contain the digits 0-4")
+            # The string is stored cell 0 first, int() wants the high bit first
+            bitboards[color] = int(bits[::-1], 2)
+        return cls(bitboards)
+
+    @classmethod
+    def from_bytes(cls, packed):
+        """
+        Builds a board from its packed binary form
+        """
+        if packed is None or len(packed) != PACKED_BOARD_SIZE:
+            raise ValueError("Packed board must be {} bytes long".format(PACKED_BOARD_SIZE))
+        bitboards = [0] * 5
+        for i, color in enumerate(COLORS):
+            start = i * PACKED_COLOR_SIZE
+            bitboards[color] = int.from_bytes(packed[start:start + PACKED_COLOR_SIZE], "little")
+        return cls(bitboards)
+
+    def to_bytes(self):
+        """
+        Returns the board packed as one 50 byte bitboard per color
+        """
+        return b"".join(self.bitboards[color].to_bytes(PACKED_COLOR_SIZE, "little") for color in COLORS)
+
+    def to_string(self):
+        """
+        Returns the board as the 400 character placed_blocks string
+        """
+        result = ["0"] * CELL_COUNT
+        for color in COLORS:
+            digit = str(color)
+            for x, y in cells(self.bitboards[color]):
+                result[x + y * BOARD_SIZE] = digit
+        return "".join(result)
+
+    @property
+    def occupied(self):
+        """
+        Returns the mask of all cells taken by any color
+        """
+        b = self.bitboards
+        return b[1] | b[2] | b[3] | b[4]
+
+    def is_legal(self, color, mask):
+        """
+        Returns True if the color may place a piece covering the mask
+        """
+        own = self.bitboards[color]
+        if mask & self.occupied:
+            return False
+        if own == 0:
+            return bool(mask & CORNERS)
+        return not (mask & edges(own)) and bool(mask & diagonals(own))
+
+    def validate_placement(self, color, mask):
+        """
+        Raises IllegalMoveError describing why the placement is not allowed
+        """
+        own = self.bitboards[color]
+        if mask == 0 or mask & ~FULL_BOARD:
+            raise IllegalMoveError("Placement must cover cells on the board")
+        if mask & self.occupied:
+            raise IllegalMoveError("Placement overlaps blocks already on the board")
+        if own == 0:
+            if not mask & CORNERS:
+                raise IllegalMoveError("First block of a color must cover a corner")
+            return
+        if mask & edges(own):
+            raise IllegalMoveError("Block may not share a side with a block of the same color")
+        if not mask & diagonals(own):
+            raise IllegalMoveError("Block must touch a block of the same color by a corner")
+
+    def place(self, color, mask):
+        """
+        Adds the mask to the bitboard of the color without checking legality
+        """
+        self.bitboards[color] |= mask
+
+    def validate_transition(self, new_board, color):
+        """
+        Checks that new_board is this board with at most one legal block of
+        the given color added. Returns the mask of the added cells, which is
+        0 when the player passed.
+        """
+        for other in COLORS:
+            if other != color and new_board.bitboards[other] != self.bitboards[other]:
+                raise IllegalMoveError("Only blocks of the moving color may change")
+        old = self.bitboards[color]
+        new = new_board.bitboards[color]
+        if old & ~new:
+            raise IllegalMoveError("Blocks already on the board may not be removed")
+        added = new ^ old
+        if added == 0:
+            return 0
+        if not is_connected(added) or not fits_block_frame(added):
+            raise IllegalMoveError("Placed cells must form a single block")
+        self.validate_placement(color, added)
+        return added
+
+
+def legal_moves(board, color, blocks):
+    """
+    Returns every legal (block id, orientation index, x, y) placement for the
+    color. blocks is an iterable of (block id, shape) pairs the color may
+    still use. Instead of trying all 400 anchors, only placements covering a
+    corner cell the color is allowed to grow into are considered.
+    """
+    own = board.bitboards[color]
+    occupied = board.occupied
+    if own == 0:
+        forbidden = occupied
+        corners = CORNERS & ~occupied
+    else:
+        forbidden = occupied | edges(own)
+        corners = diagonals(own) & ~forbidden
+    corner_cells = cells(corners)
+    moves = []
+    for block_id, shape in blocks:
+        for index, orientation in enumerate(compile_shape(shape)):
+            placements = orientation.placements
+            tried = set()
+            for cx, cy in corner_cells:
+                for dx, dy in orientation.offsets:
+                    x, y = cx - dx, cy - dy
+                    anchor = x + y * BOARD_SIZE
+                    if not (0 <= x < BOARD_SIZE and 0 <= y < BOARD_SIZE) or anchor in tried:
+                        continue
+                    tried.add(anchor)
+                    mask = placements[anchor]
+                    if mask and not mask & forbidden:
+                        moves.append((block_id, index, x, y))
+    return moves
+
+
+# str.translate tables mapping one color to "1" and every other digit to "0"
+_COLOR_TABLES = {
+    color: str.maketrans({
+        str(digit): ("1" if digit == color else "0") for digit in range(5)
+    })
+    for color in COLORS
+}
@@ -0,0 +1,78 @@
+"""
+Game flow shared by the resources: applying a move to a game and deciding
+whose turn is next.
+"""
+
+from blokus import db
+from blokus.models import *
+from blokus.engine import Board, IllegalMoveError, legal_moves, placement_mask
+from blokus.history import record_move
+from blokus.utils import parse_used_blocks
+
+# turn_information of a game in which no player can move anymore
+GAME_OVER = 0
+
+
+def available_blocks(db_player, catalog):
+    """
+    Returns the (block id, shape) pairs of the catalog the player has not used
+    """
+    used = parse_used_blocks(db_player.used_blocks)
+    return [(block_id, shape) for block_id, shape in catalog if block_id not in used]
+
+
+def next_turn(board, players, color, catalog):
+    """
+    Returns the color of the first player after color, in joining order, who
+    still has a legal move. Players without moves are passed automatically.
+    Returns GAME_OVER if nobody can move.
+    """
+    seats = sorted(players, key=lambda p: p.id)
+    colors = [p.color for p in seats]
+    start = colors.index(color) if color in colors else -1
+    for step in range(1, len(seats) + 1):
+        candidate = seats[(start + step) % len(seats)]
+        if legal_moves(board, candidate.color, available_blocks(candidate, catalog)):
+            return candidate.color
+    return GAME_OVER
+
+
+def apply_move(db_game, db_player, block=None, orientation=None, x=None, y=None):
+    """
+    Places a block for the player, or passes if block is None, advances the
+    turn and records the move as a committed Transaction holding only the
+    move itself, see blokus.history. The caller commits the session. Raises IllegalMoveError if the move breaks the rules and
+    LookupError if the block does not exist.
+    """
+    board = Board.from_bytes(db_game.board)
+    catalog = [(b.id, b.shape) for b in Block.query.all()]
+    used_blocks = db_player.used_blocks or ""
+    if block is not None:
+        shape = dict(catalog).get(block)
+        if shape is None:
+            raise LookupError("No block was found with the id {}".format(block))
+        if block in parse_used_blocks(used_blocks):
+            raise IllegalMoveError("Block {} has already been used".format(block))
+        mask = placement_mask(shape, orientation, x, y)
+        board.validate_placement(db_player.color, mask)
+        board.place(db_player.color, mask)
+        used_blocks += "{},".format(block)
+
+    db_player.used_blocks = used_blocks
+    turn = next_turn(board, db_game.players, db_player.color, catalog)
+
+    db_game.board = board.to_bytes()
+    db_game.turn_information = turn
+    db_game.version += 1
+    transaction = Transaction(
+        game=db_game,
+        player=db_player,
+        commit=1,
+        block=block,
+        orientation=orientation,
+        x=x,
+        y=y,
+        next_player=turn
+    )
+    record_move(db_game, transaction, board)
+    return transaction
@@ -0,0 +1,76 @@
+"""
+Event sourced history of games.
+
+Committed moves are stored as deltas: the player, the id of the placed block,
+its orientation and the anchor cell. Every few moves the resulting board is
+also stored as a Snapshot, so any historical board is rebuilt by applying at
+most that many moves on top of the nearest earlier snapshot.
+
+Transactions committed through the legacy transaction resource carry a full
+copy of the board instead of a delta and are replayed as snapshots.
+Block shapes are looked up from the current catalog, so editing a block that
+has already been played changes the replay of the moves after the latest
+snapshot.
+"""
+
+from flask import current_app
+from blokus import db
+from blokus.constants import SNAPSHOT_INTERVAL
+from blokus.models import *
+from blokus.engine import Board, placement_mask
+
+
+def record_move(db_game, transaction, board):
+    """
+    Adds a committed move transaction to the session and snapshots board, the
+    board after the move, if the move is due for one
+    """
+    interval = current_app.config.get("SNAPSHOT_INTERVAL", SNAPSHOT_INTERVAL)
+    # Count before adding so the session is not flushed ahead of the commit
+    with db.session.no_autoflush:
+        moves = Transaction.query.filter_by(game_id=db_game.id, commit=1).count() + 1
+    db.session.add(transaction)
+    if moves % interval == 0:
+        db.session.add(Snapshot(game=db_game, transaction=transaction, board=board.to_bytes()))
+
+
+def replay(db_game, transaction_id=None):
+    """
+    Rebuilds the board of the game as it was right after the committed
+    transaction with the given id, or after the latest move if the id is
+    None. Returns the Board and the last replayed Transaction, which is None
+    if nothing had been committed yet. Raises LookupError if a replayed move
+    uses a block that no longer exists.
+    """
+    snapshots = Snapshot.query.filter_by(game_id=db_game.id)
+    moves = db.session.query(Transaction, Player.color).outerjoin(
+        Player, Transaction.player_id == Player.id
+    ).filter(Transaction.game_id == db_game.id, Transaction.commit == 1)
+    if transaction_id is not None:
+        snapshots = snapshots.filter(Snapshot.transaction_id <= transaction_id)
+        moves = moves.filter(Transaction.id <= transaction_id)
+
+    board = Board()
+    last = None
+    snapshot = snapshots.order_by(Snapshot.transaction_id.desc()).first()
+    if snapshot is not None:
+        board = Board.from_bytes(snapshot.board)
+        last = snapshot.transaction
+        moves = moves.filter(Transaction.id > snapshot.transaction_id)
+
+    shapes = None
+    for db_trans, color in moves.order_by(Transaction.id):
+        last = db_trans
+        if db_trans.board is not None:
+            board = Board.from_bytes(db_trans.board)
+            continue
+        if db_trans.block is None:
+            continue
+        if shapes is None:
+            shapes = dict(db.session.query(Block.id, Block.shape))
+        if db_trans.block not in shapes:
+            raise LookupError("No block was found with the id {}".format(db_trans.block))
+        board.place(color, placement_mask(
+            shapes[db_trans.block], db_trans.orientation, db_trans.x, db_trans.y
+        ))
+    return board, last
@@ -0,0 +1,167 @@
+"""
+Opt-in request instrumentation.
+
+With METRICS = True every request records its latency, the number and total
+time of the SQL statements it issued and the size of its response, grouped
+by endpoint. The numbers are served at /metrics in the Prometheus text
+format and requests slower than METRICS_SLOW_REQUEST seconds are logged with
+their statements. Metrics are kept per process.
+"""
+
+import threading
+import time
+from flask import Response, g, has_request_context, request
+from sqlalchemy import event
+from blokus import db
+
+PROMETHEUS = "text/plain; version=0.0.4"
+
+# Upper bounds of the histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# Requests slower than this many seconds are logged, unless configured
+SLOW_REQUEST = 0.5
+
+
+class Histogram(object):
+    """
+    Cumulative histogram in the form Prometheus expects
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+    def samples(self, name, labels):
+        """
+        Returns the exposition lines of the histogram
+        """
+        for bound, count in zip(self.buckets, self.counts):
+            yield "{}_bucket{} {}".format(name, _labels(labels, le=_number(bound)), count)
+        yield "{}_bucket{} {}".format(name, _labels(labels, le="+Inf"), self.count)
+        yield "{}_sum{} {}".format(name, _labels(labels), _number(self.sum))
+        yield "{}_count{} {}".format(name, _labels(labels), self.count)
+
+
+class Metrics(object):
+    """
+    Histograms of all requests keyed by metric name and labels
+    """
+
+    # name: (buckets, help text)
+    HISTOGRAMS = {
+        "blokus_request_duration_seconds": (LATENCY_BUCKETS, "Time spent handling requests"),
+        "blokus_request_sql_statements": (STATEMENT_BUCKETS, "SQL statements issued per request"),
+        "blokus_request_sql_seconds": (LATENCY_BUCKETS, "Time spent in SQL statements per request"),
+        "blokus_response_size_bytes": (SIZE_BUCKETS, "Size of the response bodies"),
+    }
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {name: {} for name in self.HISTOGRAMS}
+
+    def observe(self, name, labels, value):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            histogram = self._histograms[name].get(key)
+            if histogram is None:
+                histogram = self._histograms[name][key] = Histogram(self.HISTOGRAMS[name][0])
+            histogram.observe(value)
+
+    def render(self):
+        """
+        Returns all metrics in the Prometheus text format
+        """
+        lines = []
+        with self._lock:
+            for name, (_, help_text) in self.HISTOGRAMS.items():
+                lines.append("# HELP {} {}".format(name, help_text))
+                lines.append("# TYPE {} histogram".format(name))
+                for key, histogram in sorted(self._histograms[name].items()):
+                    lines.extend(histogram.samples(name, dict(key)))
+        return "\n".join(lines) + "\n"
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _labels(labels, **extra):
+    items = list(labels.items()) + list(extra.items())
+    if not items:
+        return ""
+    escaped = (
+        '{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n"))
+        for k, v in items
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+def init_metrics(app):
+    """
+    Installs the request hooks, the SQL listeners and the /metrics endpoint
+    if METRICS is enabled in the config
+    """
+    if not app.config.get("METRICS", False):
+        return
+    metrics = app.extensions["blokus_metrics"] = Metrics()
+    slow_request = app.config.get("METRICS_SLOW_REQUEST", SLOW_REQUEST)
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if has_request_context() and "metrics_queries" in g:
+            conn.info.setdefault("metrics_start", []).append(time.perf_counter())
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if has_request_context() and "metrics_queries" in g:
+            started = conn.info["metrics_start"].pop()
+            g.metrics_queries.append((statement, time.perf_counter() - started))
+
+    with app.app_context():
+        event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+        event.listen(db.engine, "after_cursor_execute", after_cursor_execute)
+
+    @app.before_request
+    def start_timer():
+        g.metrics_start = time.perf_counter()
+        g.metrics_queries = []
+
+    @app.after_request
+    def record_request(response):
+        if "metrics_start" not in g or request.endpoint == "metrics":
+            return response
+        duration = time.perf_counter() - g.metrics_start
+        queries = g.metrics_queries
+        endpoint = request.endpoint or "unmatched"
+        # Streamed bodies have no length until they are sent
+        size = response.content_length if not response.is_streamed else None
+
+        labels = {"endpoint": endpoint, "method": request.method}
+        metrics.observe("blokus_request_duration_seconds",
+            dict(labels, status=response.status_code), duration)
+        metrics.observe("blokus_request_sql_statements", labels, len(queries))
+        metrics.observe("blokus_request_sql_seconds", labels, sum(t for _, t in queries))
+        if size is not None:
+            metrics.observe("blokus_response_size_bytes", labels, size)
+
+        if duration >= slow_request:
+            app.logger.warning(
+                "Slow request %s %s took %.1f ms with %d SQL statements:\n%s",
+                request.method, request.full_path, duration * 1000, len(queries),
+                "\n".join("  {:.1f} ms  {}".format(t * 1000, s) for s, t in queries)
+            )
+        return response
+
+    @app.route("/metrics", endpoint="metrics")
+    def send_metrics():
+        return Response(metrics.render(), 200, content_type=PROMETHEUS)
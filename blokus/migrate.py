@@ -0,0 +1,118 @@
+"""
+In place upgrade of existing databases to the current models.
+
+create_all only creates missing tables, so databases made by older versions
+lack the columns and indexes added since. The upgrade adds them, converts
+boards stored as 400 character strings into packed bitboards and is safe to
+run any number of times.
+"""
+
+import click
+import sqlalchemy as sa
+from flask.cli import with_appcontext
+from blokus import db
+from blokus.models import *
+from blokus.engine import Board
+
+# Columns of older versions that held the board as a string of color digits,
+# mapped to the packed column replacing them
+LEGACY_BOARDS = {
+    "game": ("placed_blocks", "board"),
+    "transaction": ("board_state", "board"),
+}
+
+
+def _column_ddl(column, dialect):
+    """
+    Returns the column definition used in ALTER TABLE ... ADD COLUMN
+    """
+    ddl = "{} {}".format(
+        dialect.identifier_preparer.quote(column.name),
+        column.type.compile(dialect=dialect)
+    )
+    if column.server_default is not None:
+        ddl += " DEFAULT {}".format(column.server_default.arg)
+        if not column.nullable:
+            ddl += " NOT NULL"
+    return ddl
+
+
+def _convert_legacy_boards(conn, table, legacy, packed):
+    """
+    Fills the packed board of rows that only have the legacy string. Returns
+    the number of converted rows and the ids of rows with unreadable boards.
+    """
+    quote = conn.dialect.identifier_preparer.quote
+    rows = conn.execute(sa.text(
+        "SELECT id, {legacy} FROM {table} WHERE {packed} IS NULL AND {legacy} IS NOT NULL".format(
+            table=quote(table.name), legacy=quote(legacy), packed=quote(packed))
+    )).fetchall()
+    converted = 0
+    broken = []
+    for row_id, value in rows:
+        try:
+            board = Board.from_string(value).to_bytes()
+        except ValueError:
+            broken.append(row_id)
+            continue
+        conn.execute(
+            table.update().where(table.c.id == row_id).values({packed: board})
+        )
+        converted += 1
+    return converted, broken
+
+
+def upgrade_database(echo=lambda message: None):
+    """
+    Brings the database up to date with the models, reporting every change
+    through echo. Raises IntegrityError if existing rows break a new unique
+    index, for example two players of a game sharing a color.
+    """
+    with db.engine.begin() as conn:
+        dialect = conn.dialect
+        inspector = sa.inspect(conn)
+        existing_tables = set(inspector.get_table_names())
+        for table in db.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                table.create(conn)
+                echo("Created table {}".format(table.name))
+                continue
+
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    conn.execute(sa.text("ALTER TABLE {} ADD COLUMN {}".format(
+                        dialect.identifier_preparer.quote(table.name),
+                        _column_ddl(column, dialect)
+                    )))
+                    echo("Added column {}.{}".format(table.name, column.name))
+
+            if table.name in LEGACY_BOARDS and LEGACY_BOARDS[table.name][0] in existing:
+                legacy, packed = LEGACY_BOARDS[table.name]
+                converted, broken = _convert_legacy_boards(conn, table, legacy, packed)
+                if converted:
+                    echo("Converted {} boards of {}".format(converted, table.name))
+                if broken:
+                    echo("Skipped unreadable boards of {} {}".format(
+                        table.name, ", ".join(str(i) for i in broken)))
+
+            indexes = {i["name"] for i in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in indexes:
+                    index.create(conn)
+                    echo("Created index {}".format(index.name))
+
+
+@click.command("migrate-db")
+@with_appcontext
+def migrate_db_command():
+    """
+    Upgrades an existing database in place
+    """
+    try:
+        upgrade_database(click.echo)
+    except sa.exc.IntegrityError as e:
+        raise click.ClickException(
+            "Existing rows break a unique index, fix them and run again: {}".format(e.orig)
+        )
+    click.echo("Database is up to date")
@@ -1,17 +1,44 @@
 import click
+from functools import lru_cache
 from flask.cli import with_appcontext
 from blokus import db
+from blokus.engine import Board
 
 class Game(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     handle = db.Column(db.String, nullable=False, unique=True)
 
-    placed_blocks = db.Column(db.String)
+    # Packed per color bitboards, see placed_blocks for the legacy string
+    board = db.Column(db.LargeBinary)
     turn_information = db.Column(db.Integer)
+    # Bumped whenever the board, the turn or the players change. Every UPDATE
+    # of a game only matches the version it was read with, so concurrent
+    # changes raise StaleDataError instead of overwriting each other.
+    version = db.Column(db.Integer, nullable=False, default=0, server_default="0")
 
     players = db.relationship("Player", back_populates="game", cascade="all, delete")
+    snapshots = db.relationship("Snapshot", back_populates="game", cascade="all, delete")
+
+    __mapper_args__ = {
+        "version_id_col": version,
+        "version_id_generator": False
+    }
+
+    @property
+    def placed_blocks(self):
+        """
+        Board state as the 400 character string of color digits
+        """
+        if self.board is None:
+            return None
+        return Board.from_bytes(self.board).to_string()
+
+    @placed_blocks.setter
+    def placed_blocks(self, value):
+        self.board = None if value is None else Board.from_string(value).to_bytes()
 
     @staticmethod
+    @lru_cache(maxsize=None)
     def get_schema():
         schema = {
             "type" : "object",
@@ -38,10 +65,16 @@ class Player(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     color = db.Column(db.Integer, nullable=False)
     used_blocks = db.Column(db.String)
+    # Moves of AI players are chosen by the server, see blokus.ai
+    ai = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
     game_id = db.Column(db.Integer, db.ForeignKey('game.id', ondelete="CASCADE"))
     game = db.relationship("Game", back_populates="players")
 
+    # Players are looked up by game and color, and a color is taken only once
+    __table_args__ = (db.Index("ix_player_game_id_color", "game_id", "color", unique=True),)
+
     @staticmethod
+    @lru_cache(maxsize=None)
     def get_schema():
         schema = {
             "type" : "object",
@@ -56,7 +89,12 @@ class Player(db.Model):
         }
         props["used_blocks"] = {
             "description": "Players used blocks comma separated list",
-            "type": "string"
+            "type": "string",
+            "pattern": "^(\\d+,)*$"
+        }
+        props["ai"] = {
+            "description": "True if the server plays the moves of this player",
+            "type": "boolean"
         }
         return schema
 
@@ -67,6 +105,7 @@ class Block(db.Model):
     shape = db.Column(db.String, nullable=False)
 
     @staticmethod
+    @lru_cache(maxsize=None)
     def get_schema():
         schema = {
             "type" : "object",
@@ -74,10 +113,11 @@ class Block(db.Model):
         }
         props = schema["properties"] = {}
         props["shape"] = {
-            "description": "5*5 long string describing the shape of the block. 0 for free and 1 for reserved slot",
+            "description": "5*5 long string describing the shape of the block. 0 for free and 1 for reserved slot. The center slot must be reserved, it is the anchor of placements",
             "type": "string",
             "minLength": 25,
             "maxLength": 25,
+            "pattern": "^[01]{12}1[01]{12}$"
         }
 
         return schema
@@ -85,16 +125,43 @@ class Block(db.Model):
 class Transaction(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     game_id = db.Column(db.Integer, db.ForeignKey('game.id'))
-    player_id = db.Column(db.Integer, db.ForeignKey('player.id', ondelete="CASCADE"))
+    player_id = db.Column(db.Integer, db.ForeignKey('player.id', ondelete="CASCADE"), index=True)
     player = db.relationship("Player", foreign_keys = [player_id])
     game = db.relationship("Game", foreign_keys = [game_id])
     commit = db.Column(db.Integer)
 
     used_blocks = db.Column(db.String)
-    board_state = db.Column(db.String)
+    # Packed per color bitboards, see board_state for the legacy string
+    board = db.Column(db.LargeBinary)
     next_player = db.Column(db.Integer)
 
+    # Moves made through the move resource only store what changed: the id
+    # of the placed block, its orientation and the anchor cell, or nothing
+    # for a pass. board and used_blocks are left empty for them and the
+    # board is rebuilt by replaying the moves, see blokus.history.
+    block = db.Column(db.Integer)
+    orientation = db.Column(db.Integer)
+    x = db.Column(db.Integer)
+    y = db.Column(db.Integer)
+
+    # The history of a game is read in id order
+    __table_args__ = (db.Index("ix_transaction_game_id_id", "game_id", "id"),)
+
+    @property
+    def board_state(self):
+        """
+        Board state as the 400 character string of color digits
+        """
+        if self.board is None:
+            return None
+        return Board.from_bytes(self.board).to_string()
+
+    @board_state.setter
+    def board_state(self, value):
+        self.board = None if value is None else Board.from_string(value).to_bytes()
+
     @staticmethod
+    @lru_cache(maxsize=None)
     def get_schema():
         schema = {
             "type" : "object",
@@ -113,7 +180,8 @@ class Transaction(db.Model):
         }
         props["used_blocks"] = {
             "description": "Blocks used by the player",
-            "type": "string"
+            "type": "string",
+            "pattern": "^(\\d+,)*$"
         }
         props["placed_blocks"] = {
             "description": "Blocks placed on the board",
@@ -127,8 +195,77 @@ class Transaction(db.Model):
             "description": "Set 1 if you want to commit the transaction",
             "type": "integer"
         }
+        props["version"] = {
+            "description": "Version of the game the commit is based on",
+            "type": "integer"
+        }
         return schema
 
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def get_move_schema():
+        schema = {
+            "type" : "object",
+            "required": ["player"]
+        }
+        props = schema["properties"] = {}
+        props["player"] = {
+            "description": "Color id of the player making the move",
+            "type": "integer",
+            "minimum": 1,
+            "maximum": 4
+        }
+        props["block"] = {
+            "description": "Id of the placed block. Leave out to pass the turn",
+            "type": "integer"
+        }
+        props["orientation"] = {
+            "description": "Index of the block orientation as listed by the moves resource",
+            "type": "integer",
+            "minimum": 0
+        }
+        props["x"] = {
+            "description": "Column of the anchor cell under the block center",
+            "type": "integer",
+            "minimum": 0,
+            "maximum": 19
+        }
+        props["y"] = {
+            "description": "Row of the anchor cell under the block center",
+            "type": "integer",
+            "minimum": 0,
+            "maximum": 19
+        }
+        props["version"] = {
+            "description": "Version of the game the move is based on",
+            "type": "integer"
+        }
+        return schema
+
+class Snapshot(db.Model):
+    """
+    Board of a game after one committed transaction. Taken every few moves so
+    that replaying the history never has to start from the empty board.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    game_id = db.Column(db.Integer, db.ForeignKey("game.id", ondelete="CASCADE"), nullable=False)
+    transaction_id = db.Column(
+        db.Integer, db.ForeignKey("transaction.id", ondelete="CASCADE"),
+        nullable=False, unique=True
+    )
+    # Packed per color bitboards
+    board = db.Column(db.LargeBinary, nullable=False)
+
+    # Replays look for the latest snapshot of a game before a transaction
+    __table_args__ = (db.Index("ix_snapshot_game_id_transaction_id", "game_id", "transaction_id"),)
+    # Deleting a game deletes its players, and with foreign keys on the
+    # database cascades that to their transactions and snapshots before the
+    # session gets to the snapshots
+    __mapper_args__ = {"confirm_deleted_rows": False}
+
+    game = db.relationship("Game", back_populates="snapshots")
+    transaction = db.relationship("Transaction")
+
 @click.command("init-db")
 @with_appcontext
 def init_db_command():
@@ -139,85 +276,75 @@ def init_db_command():
     generate_blocks()
 
 
+# Shapes of the standard block set, see Block.get_schema for the format
+BLOCK_SHAPES = (
+    ("00000"
+     "00000"
+     "00100"
+     "00000"
+     "00000"),
+    ("00000"
+     "00100"
+     "00100"
+     "00000"
+     "00000"),
+    ("00000"
+     "00100"
+     "00100"
+     "00100"
+     "00000"),
+    ("00100"
+     "00100"
+     "00100"
+     "00100"
+     "00000"),
+    ("00100"
+     "00100"
+     "00100"
+     "00100"
+     "00100"),
+    ("00000"
+     "00100"
+     "01110"
+     "00000"
+     "00000"),
+    ("00000"
+     "00000"
+     "01110"
+     "01010"
+     "00000"),
+    ("00000"
+     "00110"
+     "00100"
+     "00100"
+     "00000"),
+    ("00000"
+     "01100"
+     "00100"
+     "00100"
+     "00000"),
+    ("00000"
+     "00110"
+     "00100"
+     "01100"
+     "00000"),
+    ("00000"
+     "01100"
+     "00100"
+     "00110"
+     "00000"),
+    ("00010"
+     "00110"
+     "00100"
+     "00100"
+     "00000"),
+)
+
+
 def generate_blocks():
     """
     This function populates the database with valid blocks
     """
-    blocks = []
-
-    blocks.append(Block())
-    blocks[0].shape = ("00000"
-                       "00000"
-                       "00100"
-                       "00000"
-                       "00000")
-    blocks.append(Block())
-    blocks[1].shape = ("00000"
-                       "00100"
-                       "00100"
-                       "00000"
-                       "00000")
-    blocks.append(Block())
-    blocks[2].shape = ("00000"
-                       "00100"
-                       "00100"
-                       "00100"
-                       "00000")
-    blocks.append(Block())
-    blocks[3].shape = ("00100"
-                       "00100"
-                       "00100"
-                       "00100"
-                       "00000")
-    blocks.append(Block())
-    blocks[4].shape = ("00100"
-                       "00100"
-                       "00100"
-                       "00100"
-                       "00100")
-    blocks.append(Block())
-    blocks[5].shape = ("00000"
-                       "00100"
-                       "01110"
-                       "00000"
-                       "00000")
-    blocks.append(Block())
-    blocks[6].shape = ("00000"
-                       "00000"
-                       "01110"
-                       "01010"
-                       "00000")
-    blocks.append(Block())
-    blocks[7].shape = ("00000"
-                       "00110"
-                       "00100"
-                       "00100"
-                       "00000")
-    blocks.append(Block())
-    blocks[8].shape = ("00000"
-                       "01100"
-                       "00100"
-                       "00100"
-                       "00000")
-    blocks.append(Block())
-    blocks[9].shape = ("00000"
-                       "00110"
-                       "00100"
-                       "01100"
-                       "00000")
-    blocks.append(Block())
-    blocks[10].shape = ("00000"
-                        "01100"
-                        "00100"
-                        "00110"
-                        "00000")
-    blocks.append(Block())
-    blocks[11].shape = ("00010"
-                        "00110"
-                        "00100"
-                        "00100"
-                        "00000")
-
-    for b in blocks:
-        db.session.add(b)
+    for shape in BLOCK_SHAPES:
+        db.session.add(Block(shape=shape))
     db.session.commit()
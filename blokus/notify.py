@@ -0,0 +1,53 @@
+"""
+In process wake ups for requests long polling a game for changes.
+"""
+
+import threading
+from flask import current_app
+
+
+class GameNotifier(object):
+    """
+    Keeps one condition variable per game handle that has waiting requests.
+    Waiters always re-read the game from the database after waking up, so a
+    missed or spurious notification only costs latency, never correctness.
+    Changes made by other processes are picked up when the wait times out.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._conditions = {}
+
+    def wait(self, handle, timeout):
+        """
+        Blocks until the game is notified or the timeout in seconds passes
+        """
+        with self._lock:
+            condition, waiters = self._conditions.get(handle, (None, 0))
+            if condition is None:
+                condition = threading.Condition(self._lock)
+            self._conditions[handle] = (condition, waiters + 1)
+            try:
+                condition.wait(timeout)
+            finally:
+                condition, waiters = self._conditions[handle]
+                if waiters == 1:
+                    del self._conditions[handle]
+                else:
+                    self._conditions[handle] = (condition, waiters - 1)
+
+    def notify(self, handle):
+        """
+        Wakes up every request waiting for the game
+        """
+        with self._lock:
+            entry = self._conditions.get(handle)
+            if entry is not None:
+                entry[0].notify_all()
+
+
+def notify_game_changed(handle):
+    """
+    Wakes up the requests of the current app waiting for the game
+    """
+    current_app.extensions["blokus_notifier"].notify(handle)
@@ -6,28 +6,45 @@ from blokus import db
 from blokus.models import *
 from blokus.constants import *
 from blokus.utils import *
+from blokus.engine import compile_shape
 
 
 class BlockCollection(Resource):
     def get(self):
         """
-        Returns all the blocks from the database and a link for adding blocks
+        Returns the whole block catalog, including the precomputed
+        orientations of every block, and a link for adding blocks. The
+        catalog_hash is also the ETag so clients can cache the catalog.
         """
-        body = BlokusBuilder()
+        db_blocks = Block.query.order_by(Block.id).all()
+        etag = hash_etag([(b.id, b.shape) for b in db_blocks])
+        not_modified = create_not_modified_response(etag)
+        if not_modified is not None:
+            return not_modified
+
+        body = BlokusBuilder(catalog_hash=etag)
         body.add_namespace("blokus", LINK_RELATIONS_URL)
         body.add_control("self", url_for("api.blockcollection"))
 
         #add all the blocks to a list and add to body
         body["items"] = []
-        for db_block in Block.query.all():
+        block_url = url_template("api.blockitem", "block")
+        for db_block in db_blocks:
+            orientations = compile_shape(db_block.shape)
             item = BlokusBuilder(
-                shape = db_block.shape
+                id = db_block.id,
+                shape = db_block.shape,
+                cells = len(orientations[0].offsets) if orientations else 0,
+                orientations = [
+                    {"offsets": o.offsets, "mask": o.frame_mask}
+                    for o in orientations
+                ]
             )
-            item.add_control("self", url_for("api.blockitem", block=db_block.id))
+            item.add_control("self", block_url(db_block.id))
             item.add_control("profile", BLOCK_PROFILE)
             body["items"].append(item)
 
-        return Response(json.dumps(body), 200, mimetype=MASON)
+        return create_cached_response(body, etag, BLOCK_CACHE_CONTROL)
     def post(self):
         """
         Adds new block to the database
@@ -42,12 +59,16 @@ class BlockCollection(Resource):
             validate(request.json, Block.get_schema())
         except ValidationError as e:
             return create_error_response(400, "Invalid JSON document", str(e))
-        #Create the block class
+        #Create the block class and compile its orientations ahead of use
         block=Block(shape=request.json["shape"])
+        compile_shape(block.shape)
 
+        #The id comes back from the INSERT itself, RETURNING on PostgreSQL,
+        #so it is read before the commit expires the block
         db.session.add(block)
-        db.session.commit()
+        db.session.flush()
         id = str(block.id)
+        db.session.commit()
         #Return the location of the block
         return Response(status=201, headers={
             "Location": url_for("api.blockitem", block=id)
@@ -58,14 +79,16 @@ class BlockItem(Resource):
         """
         Returns specific block from the database
         """
-        db_block = Block.query.filter_by(id=block).first()
+        db_block = Block.query.filter_by(id=parse_id(block)).first()
         if db_block is None:
             return create_error_response(
                 404, "Not Found",
-                "No block was found with the id {}".format(sensor)
+                "No block was found with the id {}".format(block)
             )
-
-
+        etag = hash_etag(db_block.id, db_block.shape)
+        not_modified = create_not_modified_response(etag)
+        if not_modified is not None:
+            return not_modified
 
         body = BlokusBuilder(
             shape=db_block.shape
@@ -75,17 +98,17 @@ class BlockItem(Resource):
         body.add_control("profile", BLOCK_PROFILE)
         body.add_control_get_blocks()
 
-        return Response(json.dumps(body), 200, mimetype=MASON)
+        return create_cached_response(body, etag, BLOCK_CACHE_CONTROL)
 
     def put(self, block):
         """
         Edits specific block in the database
         """
-        db_block = Block.query.filter_by(id=block).first()
+        db_block = Block.query.filter_by(id=parse_id(block)).first()
         if db_block is None:
             return create_error_response(
                 404, "Not Found",
-                "No block was found with the id {}".format(sensor)
+                "No block was found with the id {}".format(block)
             )
 
         if not request.json:
@@ -100,6 +123,7 @@ class BlockItem(Resource):
             return create_error_response(400, "Invalid JSON document", str(e))
 
         db_block.shape=request.json["shape"]
+        compile_shape(db_block.shape)
 
         db.session.commit()
 
@@ -109,7 +133,7 @@ class BlockItem(Resource):
         """
         Delete specific block from the database
         """
-        db_block = Block.query.filter_by(id=block).first()
+        db_block = Block.query.filter_by(id=parse_id(block)).first()
         if db_block == None:
             return create_error_response(
                 404, "Not found",
@@ -1,60 +1,70 @@
 import json
+import math
+import time
 from jsonschema import validate, ValidationError
-from flask import Response, request, url_for
+from flask import Response, current_app, request, url_for
 from flask_restful import Resource
 from blokus import db
 from blokus.models import *
 from blokus.constants import *
+from sqlalchemy import func
 from sqlalchemy.exc import IntegrityError
-from blokus.utils import BlokusBuilder, create_error_response
+from sqlalchemy.orm.exc import StaleDataError
+from blokus.utils import *
+from blokus.cache import commit_game, forget_game, game_state, load_game_state, wake_bots
 
 class GameItem(Resource):
     #Get specific game from the database
     def get(self, game):
-        db_game = Game.query.filter_by(handle=game).first()
-        if db_game is None:
+        state = load_game_state(game)
+        if state is None:
             return create_error_response(404, "Not found",
                 "No game was found with the name {}".format(game)
             )
+        etag = make_etag("game", state["id"], state["version"])
+        not_modified = create_not_modified_response(etag)
+        if not_modified is not None:
+            return not_modified
 
         body = BlokusBuilder(
-                handle=db_game.handle,
-                players=db_game.players,
-                placed_blocks=db_game.placed_blocks,
+                handle=state["handle"],
             )
-        
+        add_board(body, "placed_blocks", state["board"])
+
         body.add_namespace("blokus", LINK_RELATIONS_URL)
         body.add_control("self", url_for("api.gameitem", game=game))
         body.add_control("profile", GAME_PROFILE)
         body.add_control_delete_game(game)
         body.add_control_add_player(game)
+        body.add_control_make_move(game)
+        body.add_control_get_state(game)
+        body.add_control_get_replay(game)
+        body.add_control_get_history(game)
         body.add_control_get_games()
         body.add_control_get_transactions()
 
-        #Hacky way to default turn information to 0
-        if not db_game.turn_information == None:
-            body['turn_information'] = db_game.turn_information
-        else:
-            body['turn_information'] = 0
+        body['turn_information'] = state["turn_information"]
         #Add all players as a list
         body['players'] = []
 
-        for db_player in Player.query.filter_by(game_id=db_game.id).all():
+        player_url = url_template("api.playeritem", "game", "player")
+        game_href = url_template("api.gameitem", "game")(game)
+        for player in state["players"]:
             item = BlokusBuilder(
-                game_id = db_player.game_id,
-                color = db_player.color,
-                used_blocks = db_player.used_blocks,
+                game_id = state["id"],
+                color = player["color"],
+                used_blocks = player["used_blocks"],
+                ai = player.get("ai", False),
             )
-            item.add_control("self", url_for("api.playeritem", game=db_game.handle, player=str(db_player.color)))
+            item.add_control("self", player_url(game, player["color"]))
             item.add_control("profile", PLAYER_PROFILE)
-            item.add_control("game", url_for("api.gameitem", game = db_game.handle))
+            item.add_control("game", game_href)
             body['players'].append(item)
-            print(item)
-        return Response(json.dumps(body), 200, mimetype=MASON)
+        return create_cached_response(body, etag)
 
 	# Add a player to an existing game
     def post(self, game):
-        db_game = Game.query.filter_by(handle=game).first()
+        db_game = lock_for_update(Game.query.filter_by(handle=game)).first()
         if db_game == None:
             return create_error_response(
                 404, "Not found",
@@ -78,7 +88,8 @@ class GameItem(Resource):
     )
         player = Player(
             color=request.json["color"],
-            used_blocks = ""
+            used_blocks = "",
+            ai = request.json.get("ai", False)
         )
         
 
@@ -88,12 +99,15 @@ class GameItem(Resource):
             if len(db_game.players) == 0:
                 db_game.turn_information = player.color
             db_game.players.append(player)
-            db.session.commit()
+            db_game.version += 1
+            commit_game(db_game)
 
         except IntegrityError:
             return create_error_response(409, "Already exists",
                 "Player with color '{}' already exists.".format(request.json["color"])
             )
+        except StaleDataError:
+            return create_conflict_response(game)
 
         return Response(status=201, headers={
             "Location": url_for("api.playeritem", player = str(request.json["color"]), game = db_game.handle)
@@ -109,12 +123,87 @@ class GameItem(Resource):
 
         db.session.delete(db_game)
         db.session.commit()
+        forget_game(game)
 
         return Response(status=204)
 
+class GameState(Resource):
+    # Long poll the state of a game
+    def get(self, game):
+        """
+        Returns the compact state of the game. If ?version=<n> is given and
+        still current, waits up to ?wait=<seconds> for the game to change and
+        returns 304 if it did not.
+        """
+        version = request.args.get("version", type=int)
+        wait = request.args.get("wait", type=float)
+        #A NaN wait would never run out and keep the request waiting forever
+        if "wait" in request.args and (wait is None or not math.isfinite(wait)):
+            return create_error_response(400, "Bad request",
+                "Parameter wait must be a number of seconds"
+            )
+        wait = min(max(wait or 0, 0), LONG_POLL_MAX_WAIT)
+        notifier = current_app.extensions["blokus_notifier"]
+        deadline = time.monotonic() + wait
+        while True:
+            db_game = Game.query.filter_by(handle=game).first()
+            if db_game is None:
+                return create_error_response(404, "Not found",
+                    "No game was found with the name {}".format(game)
+                )
+            if version is None or db_game.version != version:
+                break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return Response(status=304)
+            # End the read transaction so the next query sees new commits
+            db.session.rollback()
+            notifier.wait(game, min(remaining, LONG_POLL_INTERVAL))
+        wake_bots(game_state(db_game))
+
+        body = BlokusBuilder(
+            handle=db_game.handle,
+            version=db_game.version,
+            turn_information=db_game.turn_information or 0,
+            players=[
+                {"color": p.color, "used_blocks": p.used_blocks}
+                for p in db_game.players
+            ]
+        )
+        add_board(body, "placed_blocks", db_game.board)
+        body.add_control("self", url_for("api.gamestate", game=game))
+        body.add_control("up", url_for("api.gameitem", game=game))
+        return Response(dumps(body), 200, mimetype=MASON)
+
 class GameCollection(Resource):
-	# Get a list of existing games
+	# Get a page of existing games. Supports ?limit, ?after and ?before for
+	# paging, ?open=1 for games with free seats and ?fields to pick fields
     def get(self):
+        try:
+            limit, after, before = get_page_args()
+        except ValueError as e:
+            return create_error_response(400, "Bad request", str(e))
+        fields = get_fields()
+
+        #Count the players of every game in the same statement
+        player_counts = db.session.query(
+            Player.game_id, func.count(Player.id).label("players")
+        ).group_by(Player.game_id).subquery()
+        player_count = func.coalesce(player_counts.c.players, 0)
+        query = db.session.query(Game, player_count).outerjoin(
+            player_counts, player_counts.c.game_id == Game.id
+        )
+        if request.args.get("open") == "1":
+            query = query.filter(player_count < MAX_PLAYERS)
+        rows, has_prev, has_next = paginate(query, Game.id, limit, after, before)
+        games = [game for game, count in rows]
+
+        #The versions tell if anything on the page has changed
+        etag = hash_etag([(g.id, g.handle, g.version) for g in games], has_prev, has_next)
+        not_modified = create_not_modified_response(etag)
+        if not_modified is not None:
+            return not_modified
+
         body = BlokusBuilder()
 
         body.add_namespace("blokus", LINK_RELATIONS_URL)
@@ -122,17 +211,24 @@ class GameCollection(Resource):
         body.add_control_get_blocks()
 
         body.add_control_add_game()
+        if games:
+            add_page_controls(body, "api.gamecollection", games[0].id, games[-1].id, has_prev, has_next)
         body["items"] = []
-        for game in Game.query.all():
+        game_url = url_template("api.gameitem", "game")
+        for game, count in rows:
             item = BlokusBuilder(
                 handle=game.handle,
-                placed_blocks = game.placed_blocks
+                player_count=count,
+                open_seats=MAX_PLAYERS - count
             )
-            item.add_control("self", url_for("api.gameitem", game=game.handle))
+            if fields is None or fields & {"placed_blocks", "packed_board"}:
+                add_board(item, "placed_blocks", game.board)
+            select_fields(item, fields)
+            item.add_control("self", game_url(game.handle))
             item.add_control("profile", GAME_PROFILE)
             body["items"].append(item)
 
-        return Response(json.dumps(body), 200, mimetype=MASON)
+        return create_cached_response(body, etag)
 
 	# Create a new game
     def post(self):
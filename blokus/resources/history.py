@@ -0,0 +1,116 @@
+from flask import Response, request, stream_with_context, url_for
+from flask_restful import Resource
+from blokus import db
+from blokus.models import *
+from blokus.constants import *
+from blokus.utils import *
+from blokus.history import replay
+
+class GameReplay(Resource):
+    # Rebuild the board of a game at any point of its history
+    def get(self, game):
+        """
+        Returns the board of the game right after the committed transaction
+        given with ?at=<transaction id>, or the current board if it is left out
+        """
+        at = request.args.get("at", type=int)
+        if "at" in request.args and at is None:
+            return create_error_response(400, "Bad request",
+                "Parameter at must be a transaction id"
+            )
+        db_game = Game.query.filter_by(handle=game).first()
+        if db_game is None:
+            return create_error_response(404, "Not found",
+                "No game was found with the name {}".format(game)
+            )
+        if at is not None and Transaction.query.filter_by(
+                id=at, game_id=db_game.id, commit=1).first() is None:
+            return create_error_response(404, "Not found",
+                "No committed transaction {} was found in the game {}".format(at, game)
+            )
+        try:
+            board, last = replay(db_game, at)
+        except LookupError as e:
+            return create_error_response(409, "Conflict", str(e))
+
+        body = BlokusBuilder(
+            handle=db_game.handle,
+            transaction=None if last is None else last.id,
+            turn_information=None if last is None else last.next_player
+        )
+        add_board(body, "placed_blocks", board.to_bytes())
+        body.add_namespace("blokus", LINK_RELATIONS_URL)
+        body.add_control("self", url_for("api.gamereplay", game=game))
+        body.add_control("up", url_for("api.gameitem", game=game))
+        if last is not None:
+            body.add_control("blokus:transaction",
+                url_for("api.transactionitem", transaction=str(last.id))
+            )
+        return Response(dumps(body), 200, mimetype=MASON)
+
+class GameHistory(Resource):
+    # Stream the committed moves of a game
+    def get(self, game):
+        """
+        Streams the committed moves of the game in order as a Mason list, or
+        as one JSON object per line with ?format=ndjson or an Accept header
+        of application/x-ndjson. ?after=<transaction id> continues an earlier
+        read. Rows are read in batches so the history is never held in memory.
+        """
+        after = request.args.get("after", type=int)
+        if "after" in request.args and after is None:
+            return create_error_response(400, "Bad request",
+                "Parameter after must be a transaction id"
+            )
+        db_game = Game.query.filter_by(handle=game).first()
+        if db_game is None:
+            return create_error_response(404, "Not found",
+                "No game was found with the name {}".format(game)
+            )
+
+        #Plain columns skip building ORM objects for every row
+        query = db.session.query(
+            Transaction.id, Player.color, Transaction.block, Transaction.orientation,
+            Transaction.x, Transaction.y, Transaction.next_player, Transaction.board
+        ).outerjoin(Player, Transaction.player_id == Player.id).filter(
+            Transaction.game_id == db_game.id, Transaction.commit == 1
+        )
+        if after is not None:
+            query = query.filter(Transaction.id > after)
+        rows = query.order_by(Transaction.id).yield_per(HISTORY_BATCH_SIZE)
+
+        if request.args.get("format") == "ndjson" or (
+                request.args.get("format") is None
+                and request.accept_mimetypes.best_match([MASON, NDJSON]) == NDJSON):
+            def generate():
+                for row in rows:
+                    yield dumps(_history_item(row)) + b"\n"
+            return Response(stream_with_context(generate()), 200, mimetype=NDJSON)
+
+        body = BlokusBuilder(handle=db_game.handle)
+        body.add_namespace("blokus", LINK_RELATIONS_URL)
+        body.add_control("self", url_for("api.gamehistory", game=game))
+        body.add_control("up", url_for("api.gameitem", game=game))
+        body.add_control_get_replay(game)
+        #Everything but the items is written first and the list is closed last
+        head = dumps(dict(body, items=[]))[:-2]
+        def generate():
+            yield head
+            for index, row in enumerate(rows):
+                yield (b"," if index else b"") + dumps(_history_item(row))
+            yield b"]}"
+        return Response(stream_with_context(generate()), 200, mimetype=MASON)
+
+
+def _history_item(row):
+    """
+    Builds one move of the history. Passes have no block and legacy
+    transactions carry their whole board instead of a move.
+    """
+    transaction_id, color, block, orientation, x, y, next_player, board = row
+    item = {"transaction": transaction_id, "player": color, "next_player": next_player}
+    if block is not None:
+        item.update(block=block, orientation=orientation, x=x, y=y)
+    elif board is not None:
+        add_board(item, "board_state", board)
+    return item
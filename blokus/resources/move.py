@@ -0,0 +1,91 @@
+import json
+from jsonschema import validate, ValidationError
+from flask import Response, request, url_for
+from flask_restful import Resource
+from blokus import db
+from blokus.models import *
+from blokus.constants import *
+from blokus.utils import BlokusBuilder, create_conflict_response, create_error_response, dumps, lock_for_update
+from blokus.engine import IllegalMoveError
+from blokus.gameplay import apply_move
+from blokus.cache import commit_game
+from sqlalchemy.orm import selectinload
+from sqlalchemy.orm.exc import StaleDataError
+
+class MoveFactory(Resource):
+    def post(self, game):
+        """
+        Places a block or passes the turn in a single request. The move is
+        validated, applied to the game and recorded as a committed transaction
+        """
+        #Moves to the same game are applied one at a time
+        db_game = lock_for_update(
+            Game.query.options(selectinload(Game.players)).filter_by(handle=game)
+        ).first()
+        if db_game is None:
+            return create_error_response(
+                404, "Not found",
+                "No game was found with the handle {}".format(game)
+            )
+
+        if not request.json:
+            return create_error_response(
+                415, "Unsupported media type",
+                "Requests must be JSON"
+            )
+
+        try:
+            validate(request.json, Transaction.get_move_schema())
+        except ValidationError as e:
+            return create_error_response(400, "Invalid JSON document", str(e))
+        if "block" in request.json and not all(k in request.json for k in ("orientation", "x", "y")):
+            return create_error_response(400, "Invalid JSON document",
+                "Placing a block requires orientation, x and y"
+            )
+
+        color = request.json["player"]
+        db_player = next((p for p in db_game.players if p.color == color), None)
+        if db_player is None:
+            return create_error_response(
+                404, "Not found",
+                "No player was found with the color id {}".format(color)
+            )
+        if request.json.get("version", db_game.version) != db_game.version:
+            return create_conflict_response(game)
+        if db_game.turn_information != color:
+            return create_error_response(
+                409, "Not your turn",
+                "It is the turn of player {}".format(db_game.turn_information)
+            )
+
+        try:
+            transaction = apply_move(
+                db_game, db_player,
+                request.json.get("block"),
+                request.json.get("orientation"),
+                request.json.get("x"),
+                request.json.get("y")
+            )
+        except LookupError as e:
+            return create_error_response(404, "Not found", str(e))
+        except IllegalMoveError as e:
+            return create_error_response(400, "Illegal move", str(e))
+        try:
+            commit_game(db_game)
+        except StaleDataError:
+            return create_conflict_response(game)
+
+        #Return the new state so the client does not need to fetch the game again
+        body = BlokusBuilder(
+            placed_blocks = db_game.placed_blocks,
+            turn_information = db_game.turn_information,
+            version = db_game.version,
+            used_blocks = db_player.used_blocks
+        )
+        body.add_namespace("blokus", LINK_RELATIONS_URL)
+        body.add_control("profile", TRANSACTION_PROFILE)
+        body.add_control_get_game(db_game.handle)
+        location = url_for("api.transactionitem", transaction=str(transaction.id))
+        return Response(dumps(body), 201, mimetype=MASON, headers={
+            "Location": location
+        })
@@ -5,34 +5,79 @@ from flask_restful import Resource
 from blokus import db
 from blokus.models import *
 from blokus.constants import *
-from blokus.utils import BlokusBuilder, create_error_response
+from blokus.utils import *
+from blokus.engine import Board, legal_moves
+from blokus.cache import load_game_state
+
+def find_player(game, player):
+    """
+    Finds the player from the cached state of its game. Returns the game
+    state and the player, or None, None and an error response if either
+    does not exist.
+    """
+    state = load_game_state(game)
+    if state is None:
+        return None, None, create_error_response(
+            404, "Not found",
+            "No game was found with the handle {}".format(game)
+        )
+    for p in state["players"]:
+        if str(p["color"]) == player:
+            return state, p, None
+    return None, None, create_error_response(
+        404, "Not found",
+        "No player was found with the color id {}".format(player)
+    )
 
 class PlayerItem(Resource):
     def get(self, game, player):
         """
         This function answers to the get-request for the player-resource at /api/game/<game>/players/<player>/
         """
-        db_game = Game.query.filter_by(handle=game).first()
-        if db_game is None:
-             return create_error_response(
-                404, "Not found",
-                "No game was found with the handle {}".format(game)
-            )
-        db_player = Player.query.filter_by(color=player, game_id=db_game.id).first()
-        if db_player is None:
-             return create_error_response(
-                404, "Not found",
-                "No player was found with the color id {}".format(player)
-            )
+        state, player_state, error = find_player(game, player)
+        if error is not None:
+            return error
+        #Players only change together with the version of their game
+        etag = make_etag("player", state["id"], player_state["color"], state["version"])
+        not_modified = create_not_modified_response(etag)
+        if not_modified is not None:
+            return not_modified
 
         body = BlokusBuilder(
-            color = db_player.color,
-            used_blocks = db_player.used_blocks
+            color = player_state["color"],
+            used_blocks = player_state["used_blocks"],
+            ai = player_state.get("ai", False)
         )
 
         body.add_namespace("blokus", LINK_RELATIONS_URL)
-        body.add_control("self", url_for("api.playeritem", game = db_game.handle , player = str(db_player.color)))
+        body.add_control("self", url_for("api.playeritem", game = game, player = player))
         body.add_control("profile", PLAYER_PROFILE)
-        body.add_control("game", url_for("api.gameitem", game = db_game.handle))
+        body.add_control("game", url_for("api.gameitem", game = game))
+        body.add_control_get_moves(game, player)
+
+        return create_cached_response(body, etag)
+
+class PlayerMoveCollection(Resource):
+    def get(self, game, player):
+        """
+        Returns every legal placement the player can make on the current board
+        """
+        state, player_state, error = find_player(game, player)
+        if error is not None:
+            return error
+
+        used = parse_used_blocks(player_state["used_blocks"])
+        blocks = [(b.id, b.shape) for b in Block.query.all() if b.id not in used]
+        moves = legal_moves(Board.from_bytes(state["board"]), player_state["color"], blocks)
+
+        body = BlokusBuilder(count = len(moves))
+        body.add_namespace("blokus", LINK_RELATIONS_URL)
+        body.add_control("self", url_for("api.playermovecollection", game = game, player = player))
+        body.add_control("profile", MOVE_PROFILE)
+        body.add_control("up", url_for("api.playeritem", game = game, player = player))
+        body["items"] = [
+            {"block": block_id, "orientation": orientation, "x": x, "y": y}
+            for block_id, orientation, x, y in moves
+        ]
 
-        return Response(json.dumps(body), 200, mimetype = MASON)
+        return Response(dumps(body), 200, mimetype = MASON)
@@ -1,37 +1,63 @@
 import json
 from jsonschema import validate, ValidationError
-from flask import Response, request, url_for
+from flask import Response, current_app, request, url_for
 from flask_restful import Resource
 from blokus import db
 from blokus.models import *
 from blokus.constants import *
-from blokus.utils import BlokusBuilder, create_error_response
+from blokus.utils import *
+from blokus.engine import Board, match_placement
+from blokus.cache import commit_game
+from blokus.gameplay import next_turn
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import StaleDataError
+from sqlalchemy.orm import contains_eager, joinedload
 
 class TransactionFactory(Resource):
     def get(self):
         """
-        Returns list of all transactions in the database and a link for adding transactions
+        Returns a page of transactions and a link for adding transactions.
+        Supports ?limit, ?after and ?before for paging, ?game=<handle> to
+        list the transactions of one game and ?fields to pick fields
         """
+        try:
+            limit, after, before = get_page_args()
+        except ValueError as e:
+            return create_error_response(400, "Bad request", str(e))
+        fields = get_fields()
+
+        #Load the game handles in the same query instead of one query per row
+        query = Transaction.query.join(Transaction.game).options(contains_eager(Transaction.game))
+        if "game" in request.args:
+            query = query.filter(Game.handle == request.args["game"])
+        transactions, has_prev, has_next = paginate(query, Transaction.id, limit, after, before)
+
         body = BlokusBuilder()
         body.add_namespace("blokus", LINK_RELATIONS_URL)
 
         body.add_control("self", url_for("api.transactionfactory"))
         body.add_control_add_transaction()
+        if transactions:
+            add_page_controls(body, "api.transactionfactory",
+                transactions[0].id, transactions[-1].id, has_prev, has_next)
 
         body["items"] = []
-        for db_trans in Transaction.query.all():
+        transaction_url = url_template("api.transactionitem", "transaction")
+        for db_trans in transactions:
             item = BlokusBuilder(
-                used_blocks = db_trans.used_blocks,
-                board_state = db_trans.board_state
+                used_blocks = db_trans.used_blocks
             )
-            item.add_control("self", url_for("api.transactionitem", transaction=str(db_trans.id)))
+            add_move(item, db_trans)
+            if fields is None or fields & {"board_state", "packed_board"}:
+                add_board(item, "board_state", db_trans.board)
+            select_fields(item, fields)
+            item.add_control("self", transaction_url(db_trans.id))
             item.add_control("profile", TRANSACTION_PROFILE)
 
             item.add_control_get_game(db_trans.game.handle)
             body["items"].append(item)
 
-        return Response(json.dumps(body), 200, mimetype=MASON)
+        return Response(dumps(body), 200, mimetype=MASON)
 
     def post(self):
         """
@@ -82,19 +108,22 @@ class TransactionFactory(Resource):
                     )
                 transaction.next_player = color
         #Get the initial placed and used blocks from the database
-        transaction.placed_blocks = transaction.game.placed_blocks
+        transaction.board = transaction.game.board
         transaction.used_blocks = transaction.player.used_blocks
 
 
-        id = str(transaction.id)
+        #The id comes back from the INSERT itself, RETURNING on PostgreSQL,
+        #so it is read before the commit expires the transaction
         try:
             db.session.add(transaction)
+            db.session.flush()
+            id = str(transaction.id)
             db.session.commit()
         except IntegrityError:
-            pass
-        print("Players in post")
-        print(transaction.game.players)
-        id = str(transaction.id)
+            db.session.rollback()
+            return create_error_response(409, "Conflict",
+                "The transaction refers to a game or player that no longer exists"
+            )
         return Response(status=201, headers={
             "Location": url_for("api.transactionitem", transaction=id)
         })
@@ -106,7 +135,7 @@ class TransactionItem(Resource):
         """
         Returns specific transaction from the database
         """
-        db_trans = Transaction.query.filter_by(id=transaction).first()
+        db_trans = Transaction.query.options(joinedload(Transaction.game)).filter_by(id=parse_id(transaction)).first()
         if db_trans == None:
             return create_error_response(
                 404, "Not found",
@@ -114,9 +143,10 @@ class TransactionItem(Resource):
             )
 
         body = BlokusBuilder(
-            used_blocks = db_trans.used_blocks,
-            board_state = db_trans.board_state
+            used_blocks = db_trans.used_blocks
         )
+        add_move(body, db_trans)
+        add_board(body, "board_state", db_trans.board)
         body.add_namespace("blokus", LINK_RELATIONS_URL)
 
         body.add_control("self", url_for("api.transactionitem", transaction=transaction))
@@ -124,13 +154,17 @@ class TransactionItem(Resource):
         body.add_control_edit_transaction(transaction)
         body.add_control_delete_transaction(transaction)
         body.add_control_get_game(db_trans.game.handle)
-        return Response(json.dumps(body), 200, mimetype=MASON)
+        if db_trans.commit == 1:
+            body.add_control("blokus:replay", url_for(
+                "api.gamereplay", game=db_trans.game.handle, at=transaction
+            ))
+        return Response(dumps(body), 200, mimetype=MASON)
 
     def put(self, transaction):
         """
         Updates specific transaction in the database. If variable "commit" is 1 then commits the changes
         """
-        db_trans = Transaction.query.filter_by(id=transaction).first()
+        db_trans = Transaction.query.filter_by(id=parse_id(transaction)).first()
         if db_trans == None:
             return create_error_response(
                 404, "Not found",
@@ -147,6 +181,10 @@ class TransactionItem(Resource):
             validate(request.json, Transaction.get_schema())
         except ValidationError as e:
             return create_error_response(400, "Invalid JSON document", str(e))
+        #Committed transactions are the move log of the game, see blokus.history
+        if db_trans.commit == 1:
+            return create_error_response(409, "Conflict",
+                "Transaction {} has been committed and can not be changed".format(transaction))
         #Check if the game is valid
         if "game" in request.json:
             db_game = Game.query.filter_by(handle=request.json["game"]).first()
@@ -181,7 +219,10 @@ class TransactionItem(Resource):
             
         #Get the placed blocks and used blocks from the request
         if "placed_blocks" in request.json:
-            db_trans.placed_blocks = request.json["placed_blocks"]
+            try:
+                db_trans.board_state = request.json["placed_blocks"]
+            except ValueError as e:
+                return create_error_response(400, "Invalid JSON document", str(e))
         if "used_blocks" in request.json:
             db_trans.used_blocks = request.json["used_blocks"]
         
@@ -189,23 +230,67 @@ class TransactionItem(Resource):
         commited = False
         if "commit" in request.json:
             if int(request.json["commit"]) == 1:
-                next_player = Player.query.filter_by(id = db_trans.next_player).first()
-                if db_trans.game is None or db_trans.player is None or next_player is None:
+                if db_trans.game is None or db_trans.player is None:
                     return create_error_response(
                         400, "Bad request",
                         "No player or game was assigned for the transaction")
+                #Wait for other commits to the game and check against its latest state
+                lock_for_update(Game.query.filter_by(id=db_trans.game_id)).first()
+                if request.json.get("version", db_trans.game.version) != db_trans.game.version:
+                    return create_conflict_response(db_trans.game.handle)
+                if db_trans.game.turn_information != db_trans.player.color:
+                    return create_error_response(
+                        409, "Not your turn",
+                        "It is the turn of player {}".format(db_trans.game.turn_information)
+                    )
+                #Never trust the client, check the move against the rules
+                try:
+                    old_board = Board.from_bytes(db_trans.game.board)
+                    new_board = Board.from_bytes(db_trans.board)
+                    added = old_board.validate_transition(new_board, db_trans.player.color)
+                except ValueError as e:
+                    return create_error_response(400, "Illegal move", str(e))
+                #The used blocks come from the block that was placed, not the client
+                catalog = [(b.id, b.shape) for b in Block.query.order_by(Block.id)]
+                used_blocks = db_trans.player.used_blocks or ""
+                if added:
+                    used = parse_used_blocks(used_blocks)
+                    block_id = next((
+                        b for b, shape in catalog
+                        if b not in used and match_placement(shape, added)
+                    ), None)
+                    if block_id is None:
+                        return create_error_response(400, "Illegal move",
+                            "Placed cells do not match any unused block of the player")
+                    used_blocks += "{},".format(block_id)
                 commited=True
-                db_trans.game.placed_blocks = db_trans.placed_blocks
+                #Committed transactions are replayed as snapshots, see blokus.history
+                db_trans.commit = 1
+                db_trans.used_blocks = used_blocks
+                db_trans.player.used_blocks = used_blocks
+                #The server decides whose turn is next, like for moves
+                db_trans.next_player = next_turn(
+                    new_board, db_trans.game.players, db_trans.player.color, catalog
+                )
+                db_trans.game.board = db_trans.board
                 db_trans.game.turn_information = db_trans.next_player
-                db_trans.player.used_blocks = db_trans.used_blocks
+                db_trans.game.version += 1
                 
 
                 
 
         try:
-            db.session.commit()
-        except Exception as e:
-            print(e)
+            if commited:
+                commit_game(db_trans.game)
+            else:
+                db.session.commit()
+        except StaleDataError:
+            return create_conflict_response(db_trans.game.handle)
+        except Exception:
+            db.session.rollback()
+            current_app.logger.exception("Saving transaction %s failed", transaction)
+            return create_error_response(500, "Internal server error",
+                "The transaction could not be saved, try again later")
         if commited:
             return Response(status=202)
         else:
@@ -215,12 +300,15 @@ class TransactionItem(Resource):
         """
         Deletes specific transaction from the database
         """
-        db_trans = Transaction.query.filter_by(id=transaction).first()
+        db_trans = Transaction.query.filter_by(id=parse_id(transaction)).first()
         if db_trans == None:
             return create_error_response(
                 404, "Not found",
                 "No transaction was found with the id {}".format(transaction)
             )
+        if db_trans.commit == 1:
+            return create_error_response(409, "Conflict",
+                "Transaction {} has been committed and can not be deleted".format(transaction))
 
         db.session.delete(db_trans)
         db.session.commit()
@@ -0,0 +1,406 @@
+"""
+Headless self-play.
+
+Plays complete games of four computer players, either directly against the
+rules engine or through the HTTP api with the Flask test client, and checks
+every step for rule violations. Games are spread over worker processes and
+every game is seeded from the base seed and its number, so a run can be
+repeated exactly. Run with
+
+    python -m blokus.simulate --games 1000 --players random,greedy
+    python -m blokus.simulate --games 100 --mode api
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+from blokus.engine import (
+    BOARD_SIZE, COLORS, Board, IllegalMoveError, compile_shape, legal_moves,
+    placement_mask, popcount
+)
+from blokus.gameplay import GAME_OVER, available_blocks, next_turn
+from blokus.utils import parse_used_blocks
+
+# Seconds the "mcts" player thinks about one move
+MCTS_MOVE_TIME = 0.05
+# Violations kept in the report, the rest are only counted
+MAX_REPORTED_VIOLATIONS = 20
+
+
+def random_player(game, moves, rng):
+    """
+    Picks any legal move
+    """
+    return rng.choice(moves)
+
+
+def greedy_player(game, moves, rng):
+    """
+    Picks one of the legal moves placing the largest block
+    """
+    size = lambda m: len(compile_shape(game.shapes[m[0]])[m[1]].offsets)
+    largest = max(size(m) for m in moves)
+    return rng.choice([m for m in moves if size(m) == largest])
+
+
+def mcts_player(game, moves, rng):
+    """
+    Picks the move of the server side AI player
+    """
+    from blokus.ai import choose_move
+    seats = [(s.color, parse_used_blocks(s.used_blocks)) for s in game.seats]
+    move = choose_move(
+        game.board.to_bytes(), seats, game.turn, game.catalog, MCTS_MOVE_TIME,
+        seed=rng.getrandbits(32)
+    )
+    return move if move is not None else rng.choice(moves)
+
+
+STRATEGIES = {
+    "random": random_player,
+    "greedy": greedy_player,
+    "mcts": mcts_player,
+}
+
+
+class Violation(Exception):
+    """
+    Raised when a game breaks the rules or the api disagrees with the engine
+    """
+
+
+def _random_placement(shapes, remaining, rng):
+    """
+    Returns a random (block id, orientation, x, y) anywhere on the board
+    """
+    block_id = rng.choice(remaining)
+    orientation = rng.randrange(len(compile_shape(shapes[block_id])))
+    return block_id, orientation, rng.randrange(BOARD_SIZE), rng.randrange(BOARD_SIZE)
+
+
+def check_move(board, color, move, moves, shapes, rng):
+    """
+    Cross-checks the engine before a move is played: the chosen move must be
+    accepted by validate_placement and validate_transition, and a random
+    placement must get the same answer from is_legal, validate_placement and
+    legal_moves. Returns the mask of the chosen move.
+    """
+    block_id, orientation, x, y = move
+    mask = placement_mask(shapes[block_id], orientation, x, y)
+    try:
+        board.validate_placement(color, mask)
+        after = Board(board.bitboards)
+        after.place(color, mask)
+        if board.validate_transition(after, color) != mask:
+            raise Violation("validate_transition returned other cells than {}".format(move))
+    except IllegalMoveError as e:
+        raise Violation("legal_moves returned {} which is illegal: {}".format(move, e))
+
+    probe = _random_placement(shapes, sorted({m[0] for m in moves}), rng)
+    try:
+        probe_mask = placement_mask(shapes[probe[0]], *probe[1:])
+    except IllegalMoveError:
+        return mask
+    try:
+        board.validate_placement(color, probe_mask)
+        valid = True
+    except IllegalMoveError:
+        valid = False
+    if board.is_legal(color, probe_mask) != valid:
+        raise Violation("is_legal and validate_placement disagree on {}".format(probe))
+    if valid and not any(
+        placement_mask(shapes[b], o, mx, my) == probe_mask for b, o, mx, my in moves if b == probe[0]
+    ):
+        raise Violation("legal_moves is missing {}".format(probe))
+    return mask
+
+
+def _check_board(board):
+    """
+    Checks that no two colors cover the same cell
+    """
+    if popcount(board.occupied) != sum(popcount(board.bitboards[c]) for c in COLORS):
+        raise Violation("Colors overlap on the board")
+
+
+class _Game(object):
+    """
+    A game mirrored in memory. Seats mimic Player rows so the turn order is
+    decided by the same next_turn as on the server.
+    """
+
+    def __init__(self, catalog, strategies):
+        self.catalog = catalog
+        self.shapes = dict(catalog)
+        self.board = Board()
+        self.seats = [
+            SimpleNamespace(id=i, color=color, used_blocks="", strategy=strategy)
+            for i, (color, strategy) in enumerate(zip(COLORS, strategies))
+        ]
+        self.turn = COLORS[0]
+        self.moves = 0
+
+    def seat(self, color):
+        return next(s for s in self.seats if s.color == color)
+
+    def choose(self, rng):
+        """
+        Returns the legal moves of the player in turn and the chosen one, or
+        ([], None) if the player has to pass
+        """
+        seat = self.seat(self.turn)
+        moves = legal_moves(self.board, seat.color, available_blocks(seat, self.catalog))
+        if not moves:
+            return moves, None
+        return moves, STRATEGIES[seat.strategy](self, moves, rng)
+
+    def play(self, move, mask):
+        seat = self.seat(self.turn)
+        if move is not None:
+            self.board.place(seat.color, mask)
+            seat.used_blocks += "{},".format(move[0])
+            self.moves += 1
+        self.turn = next_turn(self.board, self.seats, seat.color, self.catalog)
+
+    def check_finished(self):
+        for seat in self.seats:
+            if legal_moves(self.board, seat.color, available_blocks(seat, self.catalog)):
+                raise Violation("Game ended while player {} could still move".format(seat.color))
+
+    def result(self, seed):
+        scores = {s.color: popcount(self.board.bitboards[s.color]) for s in self.seats}
+        best = max(scores.values())
+        return {
+            "seed": seed,
+            "moves": self.moves,
+            "scores": scores,
+            "winners": [s.strategy for s in self.seats if scores[s.color] == best],
+            "violations": [],
+        }
+
+
+def play_engine_game(catalog, strategies, seed):
+    """
+    Plays one game against the engine and returns its result
+    """
+    rng = random.Random(seed)
+    game = _Game(catalog, strategies)
+    try:
+        while game.turn != GAME_OVER:
+            moves, move = game.choose(rng)
+            mask = check_move(game.board, game.turn, move, moves, game.shapes, rng) if move else 0
+            game.play(move, mask)
+            _check_board(game.board)
+        game.check_finished()
+    except Violation as e:
+        result = game.result(seed)
+        result["violations"].append(str(e))
+        return result
+    return game.result(seed)
+
+
+def _expect(resp, status, what):
+    if resp.status_code != status:
+        raise Violation("{} returned {} instead of {}: {}".format(
+            what, resp.status_code, status, resp.get_data(as_text=True)[:200]))
+    return resp.json
+
+
+def play_api_game(client, catalog, strategies, seed, probe_rate=0.1):
+    """
+    Plays one game through the api with four players. After every move the
+    response must match the game mirrored with the engine, and illegal moves
+    sent now and then must be rejected without changing the game.
+    """
+    rng = random.Random(seed)
+    game = _Game(catalog, strategies)
+    handle = "sim-{}-{}".format(os.getpid(), seed)
+    game_url = "/api/games/{}/".format(handle)
+    try:
+        _expect(client.post("/api/games/", json={"handle": handle}), 201, "Creating the game")
+        for seat in game.seats:
+            _expect(client.post(game_url, json={"color": seat.color}), 201, "Joining the game")
+        version = _expect(client.get(game_url + "state/"), 200, "Getting the state")["version"]
+
+        while game.turn != GAME_OVER:
+            moves, move = game.choose(rng)
+            color = game.turn
+            if moves and rng.random() < probe_rate:
+                # check_move makes sure every legal placement is in moves
+                probe = _random_placement(game.shapes, sorted({m[0] for m in moves}), rng)
+                if probe not in moves:
+                    resp = client.post(game_url + "moves/", json=dict(
+                        zip(("block", "orientation", "x", "y"), probe), player=color, version=version))
+                    _expect(resp, 400, "Illegal move {}".format(probe))
+
+            mask = check_move(game.board, color, move, moves, game.shapes, rng) if move else 0
+            body = {"player": color, "version": version}
+            if move is not None:
+                body.update(zip(("block", "orientation", "x", "y"), move))
+            resp = _expect(client.post(game_url + "moves/", json=body), 201, "Move {}".format(move))
+            game.play(move, mask)
+            _check_board(game.board)
+            if resp["version"] != version + 1:
+                raise Violation("Version went from {} to {}".format(version, resp["version"]))
+            version = resp["version"]
+            if resp["placed_blocks"] != game.board.to_string():
+                raise Violation("Board of the api differs after move {}".format(move))
+            if resp["turn_information"] != game.turn:
+                raise Violation("Api gave the turn to {} instead of {}".format(
+                    resp["turn_information"], game.turn))
+        game.check_finished()
+
+        state = _expect(client.get(game_url + "state/"), 200, "Getting the final state")
+        if state["placed_blocks"] != game.board.to_string() or state["turn_information"] != GAME_OVER:
+            raise Violation("Final state of the api differs from the engine")
+        for player in state["players"]:
+            if player["used_blocks"] != game.seat(player["color"]).used_blocks:
+                raise Violation("Used blocks of player {} differ".format(player["color"]))
+    except Violation as e:
+        result = game.result(seed)
+        result["violations"].append(str(e))
+        return result
+    finally:
+        client.delete(game_url)
+    return game.result(seed)
+
+
+# State of a worker process, set by _init_worker
+_worker = {}
+
+
+def _init_worker(mode, strategies, catalog, directory, probe_rate):
+    _worker.update(mode=mode, strategies=strategies, catalog=catalog, probe_rate=probe_rate)
+    if mode == "api":
+        from blokus import create_app, db
+        from blokus.models import Block
+        db_fname = os.path.join(directory, "simulate-{}.db".format(os.getpid()))
+        app = create_app({
+            "SQLALCHEMY_DATABASE_URI": "sqlite:///" + db_fname,
+            "TESTING": True,
+        })
+        with app.app_context():
+            db.create_all()
+            for block_id, shape in catalog:
+                db.session.add(Block(id=block_id, shape=shape))
+            db.session.commit()
+        _worker["client"] = app.test_client()
+
+
+def _play(seed):
+    """
+    Plays game number seed in a worker process
+    """
+    rng = random.Random(seed)
+    strategies = list(_worker["strategies"])
+    # Seats are shuffled so no strategy keeps the advantage of moving first
+    rng.shuffle(strategies)
+    if _worker["mode"] == "api":
+        return play_api_game(_worker["client"], _worker["catalog"], strategies, seed, _worker["probe_rate"])
+    return play_engine_game(_worker["catalog"], strategies, seed)
+
+
+def simulate(games=100, mode="engine", strategies=("random",) * 4, processes=None,
+             seed=0, catalog=None, probe_rate=0.1):
+    """
+    Plays games and returns a report of the throughput, scores and rule
+    violations. processes=1 plays in the calling process.
+    """
+    if mode not in ("engine", "api"):
+        raise ValueError("Unknown mode {}".format(mode))
+    strategies = tuple(strategies) * (len(COLORS) // len(strategies) + 1)
+    strategies = strategies[:len(COLORS)]
+    for name in strategies:
+        if name not in STRATEGIES:
+            raise ValueError("Unknown player {}".format(name))
+    if catalog is None:
+        from blokus.models import BLOCK_SHAPES
+        catalog = list(enumerate(BLOCK_SHAPES, start=1))
+    seeds = [seed * 1000003 + i for i in range(games)]
+
+    directory = tempfile.mkdtemp()
+    args = (mode, strategies, catalog, directory, probe_rate)
+    start = time.perf_counter()
+    try:
+        if processes == 1:
+            _init_worker(*args)
+            results = [_play(s) for s in seeds]
+        else:
+            processes = processes or os.cpu_count()
+            with multiprocessing.Pool(processes, initializer=_init_worker, initargs=args) as pool:
+                chunksize = max(1, games // (processes * 8))
+                results = list(pool.imap_unordered(_play, seeds, chunksize))
+        elapsed = time.perf_counter() - start
+    finally:
+        _worker.clear()
+        shutil.rmtree(directory, ignore_errors=True)
+    return report(results, elapsed, mode, strategies, processes)
+
+
+def report(results, elapsed, mode, strategies, processes):
+    """
+    Sums up the results of played games
+    """
+    results = sorted(results, key=lambda r: r["seed"])
+    moves = sum(r["moves"] for r in results)
+    violations = [(r["seed"], v) for r in results for v in r["violations"]]
+    wins = {name: 0.0 for name in set(strategies)}
+    for r in results:
+        for name in r["winners"]:
+            wins[name] += 1.0 / len(r["winners"])
+    return {
+        "mode": mode,
+        "players": list(strategies),
+        "processes": processes,
+        "games": len(results),
+        "moves": moves,
+        "seconds": elapsed,
+        "games_per_second": len(results) / elapsed if elapsed else 0.0,
+        "moves_per_second": moves / elapsed if elapsed else 0.0,
+        "average_score": sum(sum(r["scores"].values()) for r in results) / max(1, len(COLORS) * len(results)),
+        "wins": wins,
+        "violation_count": len(violations),
+        "violations": [
+            {"seed": s, "violation": v} for s, v in violations[:MAX_REPORTED_VIOLATIONS]
+        ],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--games", type=int, default=100, help="Number of games to play")
+    parser.add_argument("--mode", choices=("engine", "api"), default="engine",
+        help="Play against the engine or through the api")
+    parser.add_argument("--players", default="random",
+        help="Comma separated strategies of the four seats, repeated to fill "
+             "them: {}".format(", ".join(STRATEGIES)))
+    parser.add_argument("--processes", type=int, help="Worker processes (default the number of CPUs)")
+    parser.add_argument("--seed", type=int, default=0, help="Base seed of the games")
+    parser.add_argument("--probe-rate", type=float, default=0.1,
+        help="Share of api turns that first send an illegal move")
+    parser.add_argument("--output", help="File the JSON report is written to")
+    args = parser.parse_args(argv)
+
+    result = simulate(
+        games=args.games, mode=args.mode, strategies=args.players.split(","),
+        processes=args.processes, seed=args.seed, probe_rate=args.probe_rate
+    )
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+    return 1 if result["violation_count"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
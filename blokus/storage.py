@@ -0,0 +1,69 @@
+"""
+Connection settings for running the api on SQLite under concurrent load.
+
+With SQLITE_PROFILE = "production" every connection is switched to write
+ahead logging, so readers no longer block while a move is committed, and the
+engine keeps a pool of connections that worker threads share. The default
+profile leaves SQLite and the engine as they are.
+"""
+
+from sqlalchemy import event
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool
+from blokus import db
+
+# Defaults of the production profile, each can be overridden in the config
+SQLITE_BUSY_TIMEOUT = 5000
+SQLITE_MMAP_SIZE = 256 * 1024 * 1024
+SQLITE_POOL_SIZE = 10
+
+
+def _uses_profile(config):
+    """
+    Returns True if the production profile applies to the configured database
+    """
+    if config.get("SQLITE_PROFILE", "default") != "production":
+        return False
+    url = make_url(config["SQLALCHEMY_DATABASE_URI"])
+    # In memory databases live in a single connection and can not be shared
+    return url.get_backend_name() == "sqlite" and url.database not in (None, "", ":memory:")
+
+
+def configure_engine(app):
+    """
+    Sets the engine options of the production profile. Must be called before
+    the database is initialized for the app.
+    """
+    if not _uses_profile(app.config):
+        return
+    options = app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", {})
+    connect_args = options.setdefault("connect_args", {})
+    # Pooled connections are handed from thread to thread, but only one
+    # thread uses a connection at a time
+    connect_args.setdefault("check_same_thread", False)
+    connect_args.setdefault("timeout", app.config.get("SQLITE_BUSY_TIMEOUT", SQLITE_BUSY_TIMEOUT) / 1000)
+    options.setdefault("poolclass", QueuePool)
+    options.setdefault("pool_size", app.config.get("SQLITE_POOL_SIZE", SQLITE_POOL_SIZE))
+    options.setdefault("max_overflow", app.config.get("SQLITE_POOL_SIZE", SQLITE_POOL_SIZE))
+
+
+def install_pragmas(app):
+    """
+    Applies the pragmas of the production profile to every new connection
+    """
+    if not _uses_profile(app.config):
+        return
+    busy_timeout = int(app.config.get("SQLITE_BUSY_TIMEOUT", SQLITE_BUSY_TIMEOUT))
+    mmap_size = int(app.config.get("SQLITE_MMAP_SIZE", SQLITE_MMAP_SIZE))
+
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA busy_timeout={}".format(busy_timeout))
+        cursor.execute("PRAGMA mmap_size={}".format(mmap_size))
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+
+    with app.app_context():
+        event.listen(db.engine, "connect", set_pragmas)
@@ -1,8 +1,21 @@
 
+import base64
+import hashlib
 import json
-from flask import Response, request, url_for
+from urllib.parse import quote
+from flask import Response, current_app, request, url_for
+from blokus import db
 from blokus.constants import *
 from blokus.models import *
+from blokus.engine import Board
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Characters werkzeug leaves unquoted in URL path variables
+_URL_SAFE = "!$&'()*+,/:;=@"
 
 class MasonBuilder(dict):
     """
@@ -74,7 +87,7 @@ class BlokusBuilder(MasonBuilder):
     def add_control_delete_game(self, game):
         self.add_control(
             "blokus:delete",
-            url_for("api.gameitem", game=game),
+            url_template("api.gameitem", "game")(game),
             method="DELETE",
             title="Delete this game"
         )
@@ -82,7 +95,7 @@ class BlokusBuilder(MasonBuilder):
     def add_control_add_game(self):
         self.add_control(
             "blokus:add-game",
-            url_for("api.gamecollection"),
+            url_template("api.gamecollection")(),
             method="POST",
             encoding="json",
             title="Add a new game",
@@ -92,7 +105,7 @@ class BlokusBuilder(MasonBuilder):
     def add_control_get_games(self):
         self.add_control(
             "blokus:games-all",
-            url_for("api.gamecollection"),
+            url_template("api.gamecollection")(),
             method="GET",
             title="Get list of games"
         )
@@ -100,7 +113,7 @@ class BlokusBuilder(MasonBuilder):
     def add_control_get_game(self, game):
         self.add_control(
             "blokus:gameitem",
-            url_for("api.gamecollection", game=game),
+            url_template("api.gameitem", "game")(game),
             method="GET",
             title="Get a game"
         )
@@ -108,7 +121,7 @@ class BlokusBuilder(MasonBuilder):
     def add_control_get_blocks(self):
         self.add_control(
             "blokus:blocks-all",
-            url_for("api.blockcollection"),
+            url_template("api.blockcollection")(),
             method="GET",
             title="Get list of existing blocks"
         )
@@ -116,17 +129,61 @@ class BlokusBuilder(MasonBuilder):
     def add_control_add_player(self, game):
         self.add_control(
             "blokus:add-player",
-            url_for("api.gameitem", game=game),
+            url_template("api.gameitem", "game")(game),
             method="POST",
             encoding="json",
             title="Add a new player to a game",
             schema=Player.get_schema()
         )
 
+    def add_control_make_move(self, game):
+        self.add_control(
+            "blokus:make-move",
+            url_template("api.movefactory", "game")(game),
+            method="POST",
+            encoding="json",
+            title="Place a block or pass the turn",
+            schema=Transaction.get_move_schema()
+        )
+
+    def add_control_get_state(self, game):
+        self.add_control(
+            "blokus:game-state",
+            url_template("api.gamestate", "game")(game) + "{?version,wait}",
+            method="GET",
+            isHrefTemplate=True,
+            title="Wait for the game state to change"
+        )
+
+    def add_control_get_replay(self, game):
+        self.add_control(
+            "blokus:replay",
+            url_template("api.gamereplay", "game")(game) + "{?at}",
+            method="GET",
+            isHrefTemplate=True,
+            title="Get the board of the game after a committed transaction"
+        )
+
+    def add_control_get_history(self, game):
+        self.add_control(
+            "blokus:history",
+            url_template("api.gamehistory", "game")(game),
+            method="GET",
+            title="Get the committed moves of the game in order"
+        )
+
+    def add_control_get_moves(self, game, player):
+        self.add_control(
+            "blokus:moves",
+            url_template("api.playermovecollection", "game", "player")(game, player),
+            method="GET",
+            title="Get all legal moves of a player"
+        )
+
     def add_control_add_transaction(self):
         self.add_control(
             "blokus:add-transaction",
-            url_for("api.transactionfactory"),
+            url_template("api.transactionfactory")(),
             method="POST",
             encoding="json",
             title="Add transaction into game",
@@ -136,7 +193,7 @@ class BlokusBuilder(MasonBuilder):
     def add_control_edit_transaction(self, transaction):
         self.add_control(
             "edit",
-            url_for("api.transactionitem", transaction=transaction),
+            url_template("api.transactionitem", "transaction")(transaction),
             method="PUT",
             encoding="json",
             title="Edit this transaction",
@@ -146,7 +203,7 @@ class BlokusBuilder(MasonBuilder):
     def add_control_get_transactions(self):
         self.add_control(
             "blokus:transactions-all",
-            url_for("api.transactionfactory"),
+            url_template("api.transactionfactory")(),
             method="GET",
             title="Get all transactions"
         )
@@ -154,14 +211,205 @@ class BlokusBuilder(MasonBuilder):
     def add_control_delete_transaction(self, transaction):
         self.add_control(
             "blokus:delete",
-            url_for("api.transactionitem", transaction=transaction),
+            url_template("api.transactionitem", "transaction")(transaction),
             method="DELETE",
             title="Delete this transaction"
         )
 
-def create_error_response(status_code, title, message=None):
+def url_template(endpoint, *variables):
+    """
+    Returns a function building the URL of the endpoint from values of the
+    given variables, in order. url_for runs once per application and URL
+    root with placeholders, later calls only quote and fill in the values,
+    which is much faster when every item of a long list links to itself.
+    """
+    cache = current_app.extensions.setdefault("blokus_url_templates", {})
+    key = (endpoint, variables, request.script_root)
+    template = cache.get(key)
+    if template is None:
+        markers = {v: "BLOKUSVARIABLE{}X".format(i) for i, v in enumerate(variables)}
+        url = url_for(endpoint, **markers).replace("{", "{{").replace("}", "}}")
+        for i, marker in enumerate(markers.values()):
+            url = url.replace(marker, "{%d}" % i)
+        template = cache[key] = lambda *values: url.format(
+            *(quote(str(v), safe=_URL_SAFE) for v in values)
+        )
+    return template
+
+def dumps(body):
+    """
+    Serializes a response body to UTF-8 JSON. Uses orjson when it is
+    installed and FAST_JSON is not turned off, the standard library otherwise.
+    """
+    if orjson is not None and current_app.config.get("FAST_JSON", True):
+        return orjson.dumps(body)
+    return json.dumps(body).encode("utf-8")
+
+def add_board(body, key, packed):
+    """
+    Adds a packed board to the body. By default it is added as the legacy
+    400 character string under key. Clients that opt in with ?board=packed
+    get the 200 byte bitboards as base64 under "packed_board" instead.
+    """
+    if request.args.get("board") == "packed":
+        body["packed_board"] = None if packed is None else base64.b64encode(packed).decode("ascii")
+    else:
+        body[key] = None if packed is None else Board.from_bytes(packed).to_string()
+
+def add_move(body, transaction):
+    """
+    Adds the move delta of a transaction: the placed block, its orientation
+    and anchor cell. Left out for passes and legacy transactions.
+    """
+    if transaction.block is not None:
+        body["block"] = transaction.block
+        body["orientation"] = transaction.orientation
+        body["x"] = transaction.x
+        body["y"] = transaction.y
+
+def make_etag(*parts):
+    """
+    Builds an ETag from the given version parts. The query string is part of
+    the tag because it changes the representation, e.g. ?board=packed.
+    """
+    tag = "-".join(str(p) for p in parts)
+    if request.query_string:
+        tag += "-" + hashlib.md5(request.query_string).hexdigest()[:8]
+    return tag
+
+def hash_etag(*parts):
+    """
+    Builds an ETag from a digest of the given content parts
+    """
+    digest = hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()[:16]
+    return make_etag(digest)
+
+def create_not_modified_response(etag):
+    """
+    Returns 304 if the client already holds the representation with the
+    given ETag, otherwise None
+    """
+    if etag in request.if_none_match:
+        resp = Response(status=304)
+        resp.set_etag(etag)
+        return resp
+    return None
+
+def create_cached_response(body, etag, cache_control=None):
+    """
+    Returns the body as a Mason response carrying its ETag
+    """
+    resp = Response(dumps(body), 200, mimetype=MASON)
+    resp.set_etag(etag)
+    if cache_control is not None:
+        resp.headers["Cache-Control"] = cache_control
+    return resp
+
+def get_page_args():
+    """
+    Parses the keyset pagination parameters limit, after and before from
+    the query string. Raises ValueError if they are not valid.
+    """
+    limit = int(request.args.get("limit", PAGE_SIZE))
+    if not 0 < limit <= MAX_PAGE_SIZE:
+        raise ValueError("limit must be between 1 and {}".format(MAX_PAGE_SIZE))
+    after = request.args.get("after")
+    before = request.args.get("before")
+    return (
+        limit,
+        None if after is None else int(after),
+        None if before is None else int(before)
+    )
+
+def get_fields():
+    """
+    Returns the set of item fields requested with ?fields=a,b or None if all
+    fields should be included
+    """
+    fields = request.args.get("fields")
+    if fields is None:
+        return None
+    return {f.strip() for f in fields.split(",") if f.strip()}
+
+def select_fields(item, fields):
+    """
+    Removes the fields not listed in fields from the item. Controls and other
+    Mason properties are kept.
+    """
+    if fields is not None:
+        for key in [k for k in item if k not in fields and not k.startswith("@")]:
+            del item[key]
+
+def paginate(query, column, limit, after=None, before=None):
+    """
+    Returns one page of the query ordered by the unique column and whether
+    there are rows before and after it. Pages are selected by the last
+    value seen (keyset) instead of OFFSET, so deep pages stay fast.
+    """
+    if before is not None:
+        rows = query.filter(column < before).order_by(column.desc()).limit(limit + 1).all()
+        has_prev = len(rows) > limit
+        return rows[:limit][::-1], has_prev, True
+    if after is not None:
+        query = query.filter(column > after)
+    rows = query.order_by(column).limit(limit + 1).all()
+    return rows[:limit], after is not None, len(rows) > limit
+
+def add_page_controls(body, endpoint, first, last, has_prev, has_next):
+    """
+    Adds Mason next and prev controls keeping the other query parameters
+    """
+    args = request.args.to_dict()
+    args.pop("after", None)
+    args.pop("before", None)
+    if has_next and last is not None:
+        body.add_control("next", url_for(endpoint, after=last, **args), title="Next page")
+    if has_prev and first is not None:
+        body.add_control("prev", url_for(endpoint, before=first, **args), title="Previous page")
+
+def parse_used_blocks(used_blocks):
+    """
+    Returns the block ids of a comma separated used_blocks string as a set.
+    Tokens that are not block ids are skipped, the schemas reject them but
+    rows written before may still contain them.
+    """
+    return {int(b) for b in (used_blocks or "").split(",") if b.strip().isdigit()}
+
+def parse_id(value):
+    """
+    Returns the integer id in a URL variable or None if it is not a number.
+    PostgreSQL refuses to compare an integer column with other text.
+    """
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def lock_for_update(query):
+    """
+    Locks the rows of the query until the end of the transaction so commits
+    to the same game wait for each other instead of failing. Rows already in
+    the session are reloaded to see the locked state. SQLite locks the whole
+    database on write and ignores the lock.
+    """
+    return query.with_for_update().populate_existing()
+
+def create_conflict_response(handle):
+    """
+    Rolls back the session and returns 409 with the current version of a
+    game that was changed by another request
+    """
+    db.session.rollback()
+    version = db.session.query(Game.version).filter_by(handle=handle).scalar()
+    return create_error_response(
+        409, "Conflict",
+        "The game was changed by another request, reload it and try again",
+        version=version
+    )
+
+def create_error_response(status_code, title, message=None, **fields):
     resource_url = request.path
-    body = MasonBuilder(resource_url=resource_url)
+    body = MasonBuilder(resource_url=resource_url, **fields)
     body.add_error(title, message)
     body.add_control("profile", href=ERROR_PROFILE)
-    return Response(json.dumps(body), status_code, mimetype=MASON)
+    return Response(dumps(body), status_code, mimetype=MASON)
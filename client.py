@@ -1,19 +1,34 @@
+import os
 import pygame
+import queue
 import requests
 import json
+import threading
+import time
 from dataclasses import dataclass
+from blokus.engine import match_placement
 
 Colors = [(100, 100, 100), (200, 0, 0), (0, 200, 0), (0, 0, 200), (200, 200, 0)]
 WINDOW_HEIGHT = 400
 WINDOW_WIDTH = 600
 BOARD_HEIGHT = 400
 BOARD_WIDTH = 400
+BACKGROUND = (50, 50, 50)
+TEXT_COLOR = (255, 255, 255)
+# Fonts tried in order, pygame falls back to its own font if none is found
+FONT_NAMES = "segoeprint,segoeui,arial"
+# Frames drawn per second at most
+FPS = 30
 
 blocks = []
 selectedBlock = -1
 placeColor = 1
 blockBuffer = []
 placeShape = None
+# The selected block in every rotation, unscaled and scaled to the board
+placeRotations = []
+placeSprites = []
+spriteCache = {}
 blockRotation = 0
 usedBlocks = []
 myTurn = False
@@ -21,13 +36,23 @@ curTurn = '-'
 finished = False
 
 availableBlocks = []
+blockIds = []
 blockSelection = 0
+moveControl = None
+stateHref = None
+gameVersion = None
+lastGame = None
 
 def LoadBlock(blockString):
     """
-    Converts a string encoded (5x5 = 25) block into a 5x5 pygame image
+    Converts a string encoded (5x5 = 25) block into a 5x5 pygame image and
+    its rotations. Images are cached by block and color.
     """
-    global blockBuffer, placeShape
+    global blockBuffer, placeShape, placeRotations, placeSprites
+    cached = spriteCache.get((blockString, placeColor))
+    if cached is not None:
+        placeShape, placeRotations, placeSprites = cached
+        return
     blockBuffer = []
     for c in blockString:
         if c=="0":
@@ -42,6 +67,15 @@ def LoadBlock(blockString):
             blockBuffer.append(Colors[blockID][2])
             blockBuffer.append(0x3F)
     placeShape = pygame.image.frombuffer(bytearray(blockBuffer), (5,5), 'RGBA')
+    placeRotations = [pygame.transform.rotate(placeShape, r) for r in (0, 90, 180, 270)]
+    placeSprites = [pygame.transform.scale(r, (98, 98)) for r in placeRotations]
+    spriteCache[(blockString, placeColor)] = (placeShape, placeRotations, placeSprites)
+
+def RotationIndex():
+    """
+    Returns the index of the current rotation in placeRotations
+    """
+    return (blockRotation % 360) // 90
 
 def ScrollBlocks(dr):
     """
@@ -53,7 +87,7 @@ def ScrollBlocks(dr):
     blockSelection = (blockSelection+dr) % len(availableBlocks)
     tries = 0
     while tries<len(availableBlocks)-1:
-        if not str(blockSelection) in usedBlocks:
+        if not str(blockIds[blockSelection]) in usedBlocks:
             break
         blockSelection = (blockSelection+dr) % len(availableBlocks)
         tries += 1
@@ -70,12 +104,16 @@ def UpdateBoard(game_resource):
     global blocks
     blocks = list(map(int,game_resource["placed_blocks"]))
 
-def Ping(s, game_href):
+def ApplyState(game):
     """
-    Pings the game server for the current game state
+    Updates the game from a state fetched by the network worker.
+    States older than the shown one are ignored.
     """
-    global myTurn, placeColor, usedBlocks, curTurn
-    game = getResource(s, game_href)
+    global myTurn, placeColor, usedBlocks, curTurn, gameVersion, lastGame
+    if gameVersion is not None and game['version'] < gameVersion:
+        return
+    lastGame = game
+    gameVersion = game['version']
     curTurn = str(game['turn_information'])
     UpdateBoard(game)
 
@@ -86,6 +124,38 @@ def Ping(s, game_href):
                 usedBlocks = list(filter(None, p['used_blocks'].split(',')))
                 break
 
+def ApplyMove(body):
+    """
+    Updates the board from the game state in the response to our move
+    """
+    global myTurn, usedBlocks, curTurn, gameVersion
+    gameVersion = body['version']
+    curTurn = str(body['turn_information'])
+    UpdateBoard(body)
+    usedBlocks = list(filter(None, body['used_blocks'].split(',')))
+    myTurn = False
+
+def ProcessNetwork(network):
+    """
+    Applies the results the network worker has sent since the last frame
+    """
+    global myTurn
+    while True:
+        try:
+            event = network.events.get_nowait()
+        except queue.Empty:
+            return
+        if event[0] == "state":
+            ApplyState(event[1])
+        elif event[0] == "moved":
+            ApplyMove(event[1])
+        else:
+            print("Error: {} {}".format(event[1], event[2]))
+            if event[0] == "failed" and lastGame is not None:
+                #Undo the block shown before the server answered
+                myTurn = False
+                ApplyState(lastGame)
+
 def main(s, game_href, player_href):
     """
     Handles drawing and pygame events
@@ -96,25 +166,28 @@ def main(s, game_href, player_href):
     pygame.init()
     SCREEN = pygame.display.set_mode((WINDOW_WIDTH, WINDOW_HEIGHT))
     CLOCK = pygame.time.Clock()
+    network = Network(dict(s.headers), stateHref, moveControl)
+    network.start()
+    renderer = Renderer()
 
     while running:
-        SCREEN.fill((50,50,50))
-        if pygame.time.get_ticks() % 500 == 0:
-            Ping(s, game_href)
-        drawGrid()
+        ProcessNetwork(network)
         if not finished:
             SetSelection(pygame.mouse.get_pos())
-        pygame.display.update()
+        renderer.draw(SCREEN, not finished)
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
+                network.stop()
                 pygame.quit()
                 running = False
+            elif event.type == pygame.VIDEOEXPOSE:
+                renderer.invalidate()
             elif event.type == pygame.MOUSEBUTTONUP:
                 if event.button == 1 and myTurn==True:
-                    SetBlock(s, game_href)
-                    if not ScrollBlocks(1):
-                        finished=True
-                    myTurn=False
+                    if SetBlock(network):
+                        if not ScrollBlocks(1):
+                            finished=True
+                        myTurn=False
                 if event.button == 4:
                     if not ScrollBlocks(-1):
                         finished=True
@@ -132,12 +205,15 @@ def main(s, game_href, player_href):
                         blockRotation -= 360
                 elif event.key == pygame.K_SPACE:
                     if myTurn == True:
-                        skipBlock(s, game_href, placeColor)
+                        skipBlock(network, placeColor)
+                        myTurn = False
+        #Sleep for the rest of the frame instead of spinning
+        CLOCK.tick(FPS)
 
 
 def SetSelection(mouse):
     """
-    Draws the chosen block on currently selected tile
+    Selects the tile under the mouse, the chosen block is drawn on it
     """
     global selectedBlock
     mouseBlock = (mouse[0]//20, mouse[1]//20)
@@ -145,9 +221,6 @@ def SetSelection(mouse):
         selectedBlock = (-1, -1)
     else:
         selectedBlock = (mouseBlock[0], mouseBlock[1])
-        rotated = pygame.transform.rotate(placeShape, blockRotation)
-        scaled = pygame.transform.scale(rotated, (98, 98))
-        SCREEN.blit(scaled, ((mouseBlock[0]-2)*20+1, (mouseBlock[1]-2)*20+1))
 
 def isCorner(pos):
     """
@@ -181,12 +254,13 @@ def CornerAttached(pos):
             return 1
     return 0
         
-def SetBlock(s, game_href):
+def SetBlock(network):
     """
     Checks if block placement is valid, then places it if so.
     First block by any color must cover a corner
     Future blocks must be attached to previous own blocks by a corner
-    and must not be attached by a side
+    and must not be attached by a side.
+    Returns True if the move was sent.
     """
     global placeColor, blockSelection
     selected = []
@@ -196,7 +270,7 @@ def SetBlock(s, game_href):
             firstTime = False
             break
     
-    rotated = pygame.transform.rotate(placeShape, blockRotation)
+    rotated = placeRotations[RotationIndex()]
     st = bytearray(pygame.image.tostring(rotated, 'RGBA'))
     valid = True
     inCorner = False
@@ -218,53 +292,134 @@ def SetBlock(s, game_href):
                 valid = False
         #print(str(pos)+str(st[i*4+3]))
     if valid and cornerAttached and (not firstTime or inCorner):
-        for b in selected:
-            blocks[b] = placeColor
-        placeBlock(s, game_href, placeColor, blockSelection, blocks)
+        if placeBlock(network, placeColor, blockSelection, selected):
+            for b in selected:
+                blocks[b] = placeColor
+            return True
+    return False
 
 
 
-def drawGrid():
-    """
-    Renders the current board and some text on the side
-    """
-    blockSize = 20 #Set the size of the grid block
-    for x in range(0, BOARD_WIDTH, blockSize):
-        for y in range(0, BOARD_HEIGHT, blockSize):
-            pos = y+x//20
-            c = Colors[blocks[pos]]
-            rect = pygame.Rect(x+1, y+1, blockSize-2, blockSize-2)
-            pygame.draw.rect(SCREEN, c, rect, 0)
-
-    font_color=(255,255,255)
-    font_obj=pygame.font.Font("C:\Windows\Fonts\segoeprb.ttf",25)
-    # Render the objects
-    text_obj=font_obj.render("Turn: "+curTurn,True,font_color)
-    SCREEN.blit(text_obj,(BOARD_WIDTH, 10))
-    text_obj=font_obj.render("Blocks left: "+str(len(availableBlocks)-len(usedBlocks)),True,font_color)
-    SCREEN.blit(text_obj,(BOARD_WIDTH, 60))
+class Renderer(object):
+    """
+    Draws the window redrawing only what changed. The board and the side
+    texts are kept on a frame surface on which only changed cells and
+    texts are drawn again. The screen gets the changed regions of the frame
+    and of the block under the mouse, and is not touched at all if nothing
+    changed.
+    """
+    def __init__(self):
+        self.frame = pygame.Surface((WINDOW_WIDTH, WINDOW_HEIGHT))
+        self.font = pygame.font.SysFont(FONT_NAMES, 25, bold=True)
+        self.textCache = {}
+        self.invalidate()
+
+    def invalidate(self):
+        """
+        Makes the next frame draw the whole window
+        """
+        self.frame.fill(BACKGROUND)
+        self.drawnBlocks = [None] * len(blocks)
+        self.texts = {}
+        self.sprite = None
+        self.spriteRect = None
+        self.full = True
+
+    def renderText(self, text):
+        surface = self.textCache.get(text)
+        if surface is None:
+            surface = self.textCache[text] = self.font.render(text, True, TEXT_COLOR)
+        return surface
+
+    def drawCells(self):
+        """
+        Draws the cells changed since the last frame and returns their rects
+        """
+        if blocks == self.drawnBlocks:
+            return []
+        blockSize = 20 #Set the size of the grid block
+        dirty = []
+        for pos, color in enumerate(blocks):
+            if pos < len(self.drawnBlocks) and self.drawnBlocks[pos] == color:
+                continue
+            rect = pygame.Rect((pos % 20)*blockSize+1, (pos // 20)*blockSize+1, blockSize-2, blockSize-2)
+            self.frame.fill(Colors[color], rect)
+            dirty.append(rect)
+        self.drawnBlocks = list(blocks)
+        return dirty
+
+    def drawText(self, pos, text):
+        """
+        Draws a text at pos if it changed and returns the changed rects
+        """
+        old = self.texts.get(pos)
+        if old is not None and old[0] == text:
+            return []
+        dirty = []
+        if old is not None:
+            self.frame.fill(BACKGROUND, old[1])
+            dirty.append(old[1])
+        rect = self.frame.blit(self.renderText(text), pos)
+        self.texts[pos] = (text, rect)
+        dirty.append(rect)
+        return dirty
+
+    def draw(self, screen, showSelection):
+        """
+        Brings the screen up to date with the game
+        """
+        dirty = self.drawCells()
+        dirty += self.drawText((BOARD_WIDTH, 10), "Turn: "+curTurn)
+        dirty += self.drawText((BOARD_WIDTH, 60), "Blocks left: "+str(len(availableBlocks)-len(usedBlocks)))
+
+        sprite = None
+        if showSelection and selectedBlock[0] >= 0 and placeSprites:
+            pos = ((selectedBlock[0]-2)*20+1, (selectedBlock[1]-2)*20+1)
+            sprite = (placeSprites[RotationIndex()], pos)
+        if not dirty and sprite == self.sprite and not self.full:
+            return
+        if self.spriteRect is not None:
+            dirty.append(self.spriteRect)
+
+        if self.full:
+            screen.blit(self.frame, (0, 0))
+        else:
+            for rect in dirty:
+                screen.blit(self.frame, rect, rect)
+        self.sprite = sprite
+        self.spriteRect = None
+        if sprite is not None:
+            self.spriteRect = screen.blit(*sprite)
+            dirty.append(self.spriteRect)
+
+        if self.full:
+            pygame.display.update()
+            self.full = False
+        else:
+            pygame.display.update(dirty)
 
 API_URL = "localhost:5000/"
+# Seconds the server may hold a state request waiting for the game to change
+STATE_WAIT = 20
+# (connect, read) timeouts of requests in seconds
+REQUEST_TIMEOUT = (3.05, 10)
+# Tries of a request before giving up, waiting RETRY_DELAY seconds and
+# doubling the wait after every failed try
+REQUEST_ATTEMPTS = 3
+RETRY_DELAY = 0.5
+BLOCK_CACHE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "blocks_cache.json")
 ## Data classes for the resources
 @dataclass
 class Player:
     color: int
     used_blocks: str
+    ai: bool = False
 
 @dataclass
 class Game:
     handle: str
     placed_blocks: str
 
-@dataclass
-class Transaction:
-    game: str
-    player: int
-    next_player: int = -1
-    placed_blocks: str = "0"*400
-    used_blocks: str = ""
-    commit: int = 0
-
 
 class APIError(Exception):
     """
@@ -318,41 +473,34 @@ def create_resource(s, tag, ctrl):
         print("Error")
         raise APIError(resp.status_code, resp.content)
 
-def edit_resource(s, tag, ctrl):
-    """
-    Puts resource to the server
-    Copied from the function above and edited to work with put
-    """
-    body = {}
-    schema = ctrl["schema"]
-    
-    for name, props in schema["properties"].items():
-        value = getattr(tag, name)
-        if value is not None:
-            value = convert_value(value, props)
-            body[name] = value
-    print("-----{}".format(json.dumps(body,indent=4)))
-    resp = submit_data(s, ctrl, body)
-    if resp.status_code == 204 or resp.status_code == 202:
-        return 204
-    else:
-        print("Error")
-        raise APIError(resp.status_code, resp.content)
-
-
-
 def getBlocks(s, blocks_href):
     """
-    Gets all blocks from the collection
+    Gets the block catalog as lists of shapes and block ids.
+    The catalog is cached on disk by its hash, so it is only downloaded
+    again when the blocks on the server have changed.
     """
-    resp = s.get(API_URL + blocks_href)
-    body = resp.json()
-    blocks = []
-    for i in body['items']:
-        r = s.get(API_URL + i['@controls']['self']['href'])
-        b=r.json()
-        blocks.append(b['shape'])
-    return blocks
+    cached = None
+    try:
+        with open(BLOCK_CACHE_FILE) as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        pass
+    headers = {}
+    if cached is not None:
+        headers["If-None-Match"] = '"{}"'.format(cached['catalog_hash'])
+    resp = s.get(API_URL + blocks_href, headers=headers)
+    if resp.status_code == 304:
+        body = cached
+    else:
+        body = resp.json()
+        try:
+            with open(BLOCK_CACHE_FILE, "w") as f:
+                json.dump({'catalog_hash': body['catalog_hash'], 'items': body['items']}, f)
+        except OSError:
+            pass
+    blocks = [i['shape'] for i in body['items']]
+    ids = [i['id'] for i in body['items']]
+    return blocks, ids
 
 def getResource(s, href):
     """
@@ -362,6 +510,16 @@ def getResource(s, href):
     body = resp.json()
     return body
 
+def getCollectionItems(s, collection):
+    """
+    Returns all items of a paged collection by following its next links
+    """
+    items = list(collection['items'])
+    while 'next' in collection['@controls']:
+        collection = getResource(s, collection['@controls']['next']['href'])
+        items.extend(collection['items'])
+    return items
+
 def getResourceFromLocation(s, location):
     """
     Gets resource from the server using its location gotten from post response
@@ -372,70 +530,129 @@ def getResourceFromLocation(s, location):
 
 
 
-def placeBlock(s, game_href, player_id, block_id, board):
+def sendRequest(s, method, url, timeout=REQUEST_TIMEOUT, **kwargs):
+    """
+    Sends a request, trying again after a growing delay if the server can
+    not be reached or answers with a server error
+    """
+    delay = RETRY_DELAY
+    for attempt in range(REQUEST_ATTEMPTS):
+        last = attempt == REQUEST_ATTEMPTS - 1
+        try:
+            resp = s.request(method, url, timeout=timeout, **kwargs)
+            if resp.status_code < 500 or last:
+                return resp
+        except (requests.ConnectionError, requests.Timeout):
+            if last:
+                raise
+        time.sleep(delay)
+        delay *= 2
+
+class Network(object):
+    """
+    Talks to the server from background threads so the render loop never
+    waits for it. One thread long polls the game state, so there is only
+    one state request in flight at a time, and another sends the moves in
+    order. Results are put to the events queue as ("state", game),
+    ("moved", body), ("failed", status, message) for a rejected move or
+    ("error", status, message) for a failed state request.
+    """
+    def __init__(self, headers, state_href, move_ctrl):
+        self.events = queue.Queue()
+        self._moves = queue.Queue()
+        self._stop = threading.Event()
+        self._headers = headers
+        self._state_url = API_URL + state_href
+        self._move_ctrl = move_ctrl
+        self._threads = [
+            threading.Thread(target=self._pollState, daemon=True),
+            threading.Thread(target=self._sendMoves, daemon=True)
+        ]
+
+    def start(self):
+        for t in self._threads:
+            t.start()
+
+    def stop(self):
+        self._stop.set()
+        self._moves.put(None)
+
+    def sendMove(self, move):
+        self._moves.put(move)
+
+    def _session(self):
+        #Sessions are not thread safe, every thread has its own
+        s = requests.Session()
+        s.headers.update(self._headers)
+        return s
+
+    def _pollState(self):
+        version = None
+        with self._session() as s:
+            while not self._stop.is_set():
+                try:
+                    resp = sendRequest(s, "GET", self._state_url,
+                        params={"version": version, "wait": STATE_WAIT},
+                        timeout=(REQUEST_TIMEOUT[0], STATE_WAIT + REQUEST_TIMEOUT[1])
+                    )
+                except requests.RequestException as e:
+                    self.events.put(("error", None, str(e)))
+                    self._stop.wait(RETRY_DELAY)
+                    continue
+                if resp.status_code == 200:
+                    game = resp.json()
+                    version = game['version']
+                    self.events.put(("state", game))
+                elif resp.status_code != 304:
+                    self.events.put(("error", resp.status_code, resp.text))
+                    self._stop.wait(RETRY_DELAY)
+
+    def _sendMoves(self):
+        with self._session() as s:
+            while True:
+                move = self._moves.get()
+                if move is None:
+                    return
+                #The version makes a repeated move fail with 409 instead of
+                #being applied twice
+                try:
+                    resp = sendRequest(s, self._move_ctrl["method"],
+                        API_URL + self._move_ctrl["href"], json=move)
+                except requests.RequestException as e:
+                    self.events.put(("failed", None, str(e)))
+                    continue
+                if resp.status_code == 201:
+                    self.events.put(("moved", resp.json()))
+                else:
+                    self.events.put(("failed", resp.status_code, resp.text))
+
+def placeBlock(network, player_id, block_index, cells):
     """
-    Does transaction to the server to place a block
+    Sends a move placing the selected block covering the given board cells.
+    Returns False if the cells do not match the block.
     """
-    try:
-        resp = s.get(API_URL + game_href)
-        game_body = resp.json()
-        player_list_id = -1
-        for i, p in enumerate(game_body['players']):
-            if player_id == p['color']:
-                player_list_id = i
-                break
-        next_player = game_body['players'][(player_list_id + 1) % len(game_body['players'])]['color']
-        trans_resp = s.get(API_URL + game_body['@controls']['blokus:transactions-all']['href'])
-        trans_body = trans_resp.json()
-
-        trans_obj = Transaction(game_body['handle'], player_id, next_player)
-        trans_location = create_resource(s, trans_obj, trans_body['@controls']['blokus:add-transaction'])
+    mask = 0
+    for c in cells:
+        mask |= 1 << c
+    match = match_placement(availableBlocks[block_index], mask)
+    if match is None:
+        return False
+    orientation, x, y = match
+    network.sendMove({
+        "player": player_id,
+        "block": blockIds[block_index],
+        "orientation": orientation,
+        "x": x,
+        "y": y,
+        "version": gameVersion
+    })
+    return True
 
-        trans_resource = getResourceFromLocation(s,trans_location)
-        trans_obj.used_blocks = trans_resource['used_blocks'] + "{},".format(block_id)
-        trans_obj.placed_blocks = "".join(map(str, board))
-        trans_obj.next_player = next_player
-        trans_obj.commit = 1
-        edit_resource(s, trans_obj, trans_resource['@controls']['edit'])
-        resp = s.get(API_URL + game_href)
-        game_body = resp.json()
-        return game_body
-    except APIError as e:
-        print(e.code)
-
-def skipBlock(s, game_href, player_id):
+def skipBlock(network, player_id):
     """
-    Does transaction to the server to place a block
+    Passes the turn to the next player
     """
-    try:
-        resp = s.get(API_URL + game_href)
-        game_body = resp.json()
-        player_list_id = -1
-        for i, p in enumerate(game_body['players']):
-            if player_id == p['color']:
-                player_list_id = i
-                break
-        next_player = game_body['players'][(player_list_id + 1) % len(game_body['players'])]['color']
-        trans_resp = s.get(API_URL + game_body['@controls']['blokus:transactions-all']['href'])
-        trans_body = trans_resp.json()
-
-        trans_obj = Transaction(game_body['handle'], player_id, next_player)
-        trans_location = create_resource(s, trans_obj, trans_body['@controls']['blokus:add-transaction'])
-
-        trans_resource = getResourceFromLocation(s,trans_location)
-        trans_obj.used_blocks = trans_resource['used_blocks']
-        trans_obj.placed_blocks = game_body['placed_blocks']
-        trans_obj.next_player = next_player
-        trans_obj.commit = 1
-        edit_resource(s, trans_obj, trans_resource['@controls']['edit'])
-        resp = s.get(API_URL + game_href)
-        game_body = resp.json()
-        return game_body
-    except APIError as e:
-        print(e.code)
-        
-
-
+    network.sendMove({"player": player_id, "version": gameVersion})
 
 
 if __name__ == "__main__":
@@ -450,18 +667,18 @@ if __name__ == "__main__":
             else:
                 #First get all the blocks from the server
                 body = resp.json()
-                availableBlocks = getBlocks(s, body['@controls']['blokus:blocks-all']['href'])
+                availableBlocks, blockIds = getBlocks(s, body['@controls']['blokus:blocks-all']['href'])
 
                 #Get the game collection
-                gameCollection = getResource(s, body['@controls']['blokus:games-all']['href'])
+                #Only games with free seats, without their boards
+                gameCollection = getResource(s, body['@controls']['blokus:games-all']['href'] + "?open=1&fields=handle,open_seats")
 
                 #Select game from the list or create new game
                 print("Select game or create new game:")
                 i=1
                 available_games = {}
-                for g in gameCollection['items']:
-                    game = getResource(s, g['@controls']['self']['href'])
-                    if len(game['players'])<4:
+                for g in getCollectionItems(s, gameCollection):
+                    if g['open_seats']>0:
                         print("{}. {}".format(i,g['handle']))
                         available_games[i] = g['@controls']['self']['href']
                         i += 1
@@ -548,4 +765,6 @@ if __name__ == "__main__":
                 UpdateBoard(picked_game)
                 
                 placeColor = int(player_resource['color'])
+                moveControl = picked_game['@controls']['blokus:make-move']
+                stateHref = picked_game['@controls']['blokus:game-state']['href'].split("{")[0]
                 main(s, picked_game['@controls']['self']['href'], player_resource['@controls']['self']['href'])
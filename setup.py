@@ -11,5 +11,9 @@ setup(
         "flask-restful",
         "flask-sqlalchemy",
         "SQLAlchemy",
-    ]
+    ],
+    extras_require={
+        "postgres": ["psycopg2-binary"],
+        "fast": ["orjson"],
+    }
 )
@@ -0,0 +1,84 @@
+import os
+import shutil
+import socket
+import sqlite3
+import subprocess
+import tempfile
+import pytest
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        "--database",
+        default=os.environ.get("BLOKUS_TEST_DATABASE", "sqlite"),
+        help='Database the tests run on: "sqlite" (default) for a temporary file, '
+             '"postgres" to spawn a throwaway local PostgreSQL server or an '
+             'SQLAlchemy URL of an existing empty database. Also read from '
+             'BLOKUS_TEST_DATABASE.'
+    )
+
+
+@event.listens_for(Engine, "connect")
+def set_sqlite_pragma(dbapi_connection, connection_record):
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture(scope="session")
+def database_server(request):
+    """
+    Returns the URL of the database server the tests share, or None when every
+    test gets its own SQLite file. With "postgres" a server is initialized in
+    a temporary directory with initdb and stopped after the session.
+    """
+    database = request.config.getoption("--database")
+    if database == "sqlite":
+        yield None
+        return
+    if database != "postgres":
+        yield database
+        return
+
+    if shutil.which("initdb") is None or shutil.which("pg_ctl") is None:
+        pytest.exit("--database=postgres needs initdb and pg_ctl on the PATH", returncode=4)
+    data_dir = tempfile.mkdtemp()
+    port = _free_port()
+    subprocess.run(
+        ["initdb", "-D", data_dir, "-U", "postgres", "--auth=trust"],
+        check=True, stdout=subprocess.DEVNULL
+    )
+    subprocess.run(
+        ["pg_ctl", "-D", data_dir, "-w", "-l", os.path.join(data_dir, "server.log"),
+         "-o", "-p {} -k {} -c listen_addresses=''".format(port, data_dir), "start"],
+        check=True, stdout=subprocess.DEVNULL
+    )
+    try:
+        yield "postgresql://postgres@/postgres?host={}&port={}".format(data_dir, port)
+    finally:
+        subprocess.run(["pg_ctl", "-D", data_dir, "-m", "immediate", "stop"], stdout=subprocess.DEVNULL)
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+@pytest.fixture
+def database_uri(database_server):
+    """
+    Returns the database URL of one test. Tests sharing a server must drop
+    their tables when they finish.
+    """
+    if database_server is not None:
+        yield database_server
+        return
+    db_fd, db_fname = tempfile.mkstemp()
+    yield "sqlite:///" + db_fname
+    os.close(db_fd)
+    os.unlink(db_fname)
@@ -1,37 +1,29 @@
+import base64
 import json
 import os
 import pytest
 import tempfile
 import time
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime
 from jsonschema import validate
 from sqlalchemy.engine import Engine
 from sqlalchemy import event
 from sqlalchemy.exc import IntegrityError, StatementError
 
+import blokus.ai
 from blokus import create_app, db
 from blokus.models import *
 
 
 
 
-@event.listens_for(Engine, "connect")
-def set_sqlite_pragma(dbapi_connection, connection_record):
-    cursor = dbapi_connection.cursor()
-    cursor.execute("PRAGMA foreign_keys=ON")
-    cursor.close()
-
-
-# based on http://flask.pocoo.org/docs/1.0/testing/
-# we don't need a client for database testing, just the db handle
-
 # based on http://flask.pocoo.org/docs/1.0/testing/
 # we don't need a client for database testing, just the db handle
 @pytest.fixture
-def client():
-    db_fd, db_fname = tempfile.mkstemp()
+def client(database_uri):
     config = {
-        "SQLALCHEMY_DATABASE_URI": "sqlite:///" + db_fname,
+        "SQLALCHEMY_DATABASE_URI": database_uri,
         "TESTING": True
     }
 
@@ -43,8 +35,10 @@ def client():
 
     yield app.test_client()
 
-    os.close(db_fd)
-    os.unlink(db_fname)
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+        db.engine.dispose()
 
 def _populate_db():
     player = Player(
@@ -94,7 +88,7 @@ def _get_block_json():
     """
     Creates a valid block JSON object to be used for PUT tests.
     """
-    return {"shape":"0"*25}
+    return {"shape":"0"*11 + "11" + "0"*12}
 
 def _check_namespace(client, response):
     """
@@ -204,9 +198,23 @@ class TestBlockCollection(object):
         body = json.loads(resp.data)
         _check_namespace(client, body)
         assert len(body["items"]) == 1
+        assert body["catalog_hash"] == resp.headers["ETag"].strip('"')
         for item in body["items"]:
             _check_control_get_method("self", client, item)
             _check_control_get_method("profile", client, item)
+            assert item["cells"] == 1
+            assert item["orientations"] == [{"offsets": [[0, 0]], "mask": 1 << 12}]
+
+    def test_get_conditional(self, client):
+        resp = client.get(self.RESOURCE_URL)
+        assert "max-age" in resp.headers["Cache-Control"]
+        etag = resp.headers["ETag"]
+        resp = client.get(self.RESOURCE_URL, headers={"If-None-Match": etag})
+        assert resp.status_code == 304
+
+        client.post(self.RESOURCE_URL, json=_get_block_json())
+        resp = client.get(self.RESOURCE_URL, headers={"If-None-Match": etag})
+        assert resp.status_code == 200
 
     def test_post(self, client):
         valid = _get_block_json()
@@ -215,6 +223,10 @@ class TestBlockCollection(object):
         resp = client.post(self.RESOURCE_URL, data=json.dumps(valid))
         assert resp.status_code == 415
 
+        # test with a shape not covering the center cell for 400
+        resp = client.post(self.RESOURCE_URL, json={"shape": "11" + "0"*23})
+        assert resp.status_code == 400
+
         # test with valid and see that it exists afterward
         resp = client.post(self.RESOURCE_URL, json=valid)
         assert resp.status_code == 201
@@ -285,6 +297,61 @@ class TestGameCollection(object):
             _check_control_get_method("profile", client, item)
 
 
+    def test_get_pages(self, client):
+        for i in range(2, 5):
+            client.post(self.RESOURCE_URL, json=_get_game_json(i))
+
+        # walk forwards through the pages
+        resp = client.get(self.RESOURCE_URL + "?limit=3")
+        assert resp.status_code == 200
+        body = json.loads(resp.data)
+        assert [g["handle"] for g in body["items"]] == ["game-1", "game-2", "game-3"]
+        assert "prev" not in body["@controls"]
+        body = client.get(body["@controls"]["next"]["href"]).json
+        assert [g["handle"] for g in body["items"]] == ["game-4"]
+        assert "next" not in body["@controls"]
+
+        # and back again
+        body = client.get(body["@controls"]["prev"]["href"]).json
+        assert [g["handle"] for g in body["items"]] == ["game-1", "game-2", "game-3"]
+
+        # sparse fields leave out the board
+        body = client.get(self.RESOURCE_URL + "?fields=handle").json
+        assert "placed_blocks" not in body["items"][0]
+        assert body["items"][0]["handle"] == "game-1"
+
+        # full games are filtered out
+        for color in range(2, 5):
+            client.post("/api/games/game-1/", json=_get_player_json(color))
+        body = client.get(self.RESOURCE_URL + "?open=1").json
+        assert [g["handle"] for g in body["items"]] == ["game-2", "game-3", "game-4"]
+
+        resp = client.get(self.RESOURCE_URL + "?limit=0")
+        assert resp.status_code == 400
+        resp = client.get(self.RESOURCE_URL + "?after=first")
+        assert resp.status_code == 400
+
+    def test_get_player_counts(self, client):
+        for i in range(2, 10):
+            client.post(self.RESOURCE_URL, json=_get_game_json(i))
+            client.post("/api/games/game-{}/".format(i), json=_get_player_json(1))
+
+        statements = []
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+        with client.application.app_context():
+            engine = db.engine
+        event.listen(engine, "before_cursor_execute", count)
+        try:
+            body = client.get(self.RESOURCE_URL).json
+        finally:
+            event.remove(engine, "before_cursor_execute", count)
+        assert len(statements) == 1
+        assert len(body["items"]) == 9
+        for item in body["items"]:
+            assert item["player_count"] == 1
+            assert item["open_seats"] == 3
+
     def test_post(self, client):
         valid = _get_game_json()
 
@@ -292,6 +359,10 @@ class TestGameCollection(object):
         resp = client.post(self.RESOURCE_URL, data=json.dumps(valid))
         assert resp.status_code == 415
 
+        # test with a shape not covering the center cell for 400
+        resp = client.post(self.RESOURCE_URL, json={"shape": "11" + "0"*23})
+        assert resp.status_code == 400
+
         # test with valid and see that it exists afterward
         resp = client.post(self.RESOURCE_URL, json=valid)
         assert resp.status_code == 201
@@ -323,10 +394,64 @@ class TestGameItem(object):
         _check_control_get_method("blokus:games-all", client, body)
         _check_control_delete_method("blokus:delete", client, body)
         _check_control_get_method("blokus:transactions-all", client, body)
+        assert body["@controls"]["blokus:make-move"]["method"] == "POST"
         resp = client.get(self.INVALID_URL)
         assert resp.status_code == 404
 
 
+    def test_get_conditional(self, client):
+        resp = client.get(self.RESOURCE_URL)
+        etag = resp.headers["ETag"]
+        resp = client.get(self.RESOURCE_URL, headers={"If-None-Match": etag})
+        assert resp.status_code == 304
+        assert resp.data == b""
+
+        # a new player bumps the game version
+        client.post(self.RESOURCE_URL, json=_get_player_json(2))
+        resp = client.get(self.RESOURCE_URL, headers={"If-None-Match": etag})
+        assert resp.status_code == 200
+        assert resp.headers["ETag"] != etag
+
+        # a different representation has a different tag
+        resp = client.get(self.RESOURCE_URL + "?board=packed", headers={"If-None-Match": etag})
+        assert resp.status_code == 200
+
+    def test_get_cached(self, client):
+        statements = []
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+        with client.application.app_context():
+            engine = db.engine
+        event.listen(engine, "before_cursor_execute", count)
+        try:
+            client.get(self.RESOURCE_URL)
+            # a cold game is loaded with its players in one round of eager loading
+            assert len(statements) == 2
+            del statements[:]
+            # hot games are served from memory
+            resp = client.get(self.RESOURCE_URL)
+            assert resp.status_code == 200
+            assert statements == []
+        finally:
+            event.remove(engine, "before_cursor_execute", count)
+
+        # joining writes the new state through to the cache
+        client.post(self.RESOURCE_URL, json=_get_player_json(2))
+        resp = client.get(self.RESOURCE_URL)
+        assert [p["color"] for p in resp.json["players"]] == [1, 2]
+
+        # deleted games are dropped from the cache
+        client.delete(self.RESOURCE_URL)
+        resp = client.get(self.RESOURCE_URL)
+        assert resp.status_code == 404
+
+    def test_get_packed(self, client):
+        resp = client.get(self.RESOURCE_URL + "?board=packed")
+        assert resp.status_code == 200
+        body = json.loads(resp.data)
+        assert "placed_blocks" not in body
+        assert base64.b64decode(body["packed_board"]) == bytes(200)
+
     def test_delete(self, client):
         resp = client.delete(self.RESOURCE_URL)
         assert resp.status_code == 204
@@ -342,6 +467,10 @@ class TestGameItem(object):
         resp = client.post(self.RESOURCE_URL, data=json.dumps(valid))
         assert resp.status_code == 415
 
+        # test with a shape not covering the center cell for 400
+        resp = client.post(self.RESOURCE_URL, json={"shape": "11" + "0"*23})
+        assert resp.status_code == 400
+
         # test with valid and see that it exists afterward
         resp = client.post(self.RESOURCE_URL, json=valid)
         assert resp.status_code == 201
@@ -355,6 +484,311 @@ class TestGameItem(object):
         assert resp.status_code == 409
 
 
+class TestGameState(object):
+    """
+    This class tests all the possible methods for the Game state (get)
+    """
+    RESOURCE_URL = "/api/games/game-1/state/"
+    INVALID_URL = "/api/games/game-x/state/"
+
+    def test_get(self, client):
+        resp = client.get(self.RESOURCE_URL)
+        assert resp.status_code == 200
+        body = json.loads(resp.data)
+        _check_control_get_method("self", client, body)
+        _check_control_get_method("up", client, body)
+        assert body["placed_blocks"] == "0"*400
+        version = body["version"]
+
+        # unchanged game does not send the state again
+        resp = client.get(self.RESOURCE_URL + "?version={}".format(version))
+        assert resp.status_code == 304
+
+        # a new player changes the version
+        client.post("/api/games/game-1/", json=_get_player_json(2))
+        resp = client.get(self.RESOURCE_URL + "?version={}&wait=1".format(version))
+        assert resp.status_code == 200
+        assert resp.json["version"] == version + 1
+        assert len(resp.json["players"]) == 2
+
+        resp = client.get(self.RESOURCE_URL + "?wait=soon")
+        assert resp.status_code == 400
+        resp = client.get(self.RESOURCE_URL + "?version={}&wait=nan".format(version + 1))
+        assert resp.status_code == 400
+        resp = client.get(self.RESOURCE_URL + "?version={}&wait=inf".format(version + 1))
+        assert resp.status_code == 400
+        # a negative wait does not wait at all
+        resp = client.get(self.RESOURCE_URL + "?version={}&wait=-5".format(version + 1))
+        assert resp.status_code == 304
+        resp = client.get(self.INVALID_URL)
+        assert resp.status_code == 404
+
+class TestMoveFactory(object):
+    """
+    This class tests all the possible methods for the Move factory (post)
+    """
+    RESOURCE_URL = "/api/games/game-2/moves/"
+    INVALID_URL = "/api/games/game-x/moves/"
+
+    def test_post(self, client):
+        client.post("/api/games/", json=_get_game_json(2))
+        client.post("/api/games/game-2/", json=_get_player_json(1))
+        client.post("/api/games/game-2/", json=_get_player_json(2))
+        valid = {"player": 1, "block": 1, "orientation": 0, "x": 0, "y": 0}
+
+        # test with wrong content type
+        resp = client.post(self.RESOURCE_URL, data=json.dumps(valid))
+        assert resp.status_code == 415
+
+        resp = client.post(self.INVALID_URL, json=valid)
+        assert resp.status_code == 404
+
+        # test with a block that does not exist
+        resp = client.post(self.RESOURCE_URL, json=dict(valid, block=5))
+        assert resp.status_code == 404
+
+        # test out of turn
+        resp = client.post(self.RESOURCE_URL, json=dict(valid, player=2, x=19))
+        assert resp.status_code == 409
+
+        # test with an outdated version of the game
+        version = client.get("/api/games/game-2/state/").json["version"]
+        resp = client.post(self.RESOURCE_URL, json=dict(valid, version=version - 1))
+        assert resp.status_code == 409
+        assert resp.json["version"] == version
+
+        # test first move away from corners
+        resp = client.post(self.RESOURCE_URL, json=dict(valid, x=5, y=5))
+        assert resp.status_code == 400
+
+        # test a valid move and see that the game changed
+        resp = client.post(self.RESOURCE_URL, json=valid)
+        assert resp.status_code == 201
+        assert resp.json["turn_information"] == 2
+        resp = client.get(resp.headers["Location"])
+        assert resp.status_code == 200
+        body = client.get("/api/games/game-2/").json
+        assert body["placed_blocks"] == "1" + "0"*399
+        assert body["turn_information"] == 2
+        assert body["players"][0]["used_blocks"] == "1,"
+
+        # the only block is used, so player 2 moves and player 1 is passed
+        resp = client.post(self.RESOURCE_URL, json=dict(valid, player=2, x=19))
+        assert resp.status_code == 201
+        assert resp.json["turn_information"] == 0
+
+        # remove the anchor for 400
+        resp = client.post(self.RESOURCE_URL, json={"player": 1, "block": 1})
+        assert resp.status_code == 400
+
+class TestAIPlayer(object):
+    """
+    This class tests joining AI players and that they play their turns
+    """
+    RESOURCE_URL = "/api/games/game-2/"
+
+    def test_ai_moves(self, client):
+        client.application.config.update(AI_INLINE=True, AI_MOVE_TIME=0.01)
+        client.post("/api/games/", json=_get_game_json(2))
+        client.post(self.RESOURCE_URL, json=_get_player_json(1))
+        resp = client.post(self.RESOURCE_URL, json={"color": 2, "ai": "yes"})
+        assert resp.status_code == 400
+        for color in (2, 3, 4):
+            resp = client.post(self.RESOURCE_URL, json={"color": color, "ai": True})
+            assert resp.status_code == 201
+        body = client.get(self.RESOURCE_URL).json
+        assert [p["ai"] for p in body["players"]] == [False, True, True, True]
+        assert client.get(self.RESOURCE_URL + "players/2/").json["ai"] is True
+        # Bots wait for the human player
+        assert body["turn_information"] == 1
+
+        # After the human move the bots take the other three corners and the
+        # only block of everyone is used
+        move = {"player": 1, "block": 1, "orientation": 0, "x": 0, "y": 0}
+        resp = client.post(self.RESOURCE_URL + "moves/", json=move)
+        assert resp.status_code == 201
+        body = client.get(self.RESOURCE_URL).json
+        assert body["turn_information"] == 0
+        board = body["placed_blocks"]
+        assert sorted(board[i] for i in (0, 19, 380, 399)) == ["1", "2", "3", "4"]
+        assert [p["used_blocks"] for p in body["players"]] == ["1,"] * 4
+
+    def _join_bots(self, client):
+        client.application.config.update(AI_INLINE=True, AI_MOVE_TIME=0.01)
+        client.post("/api/games/", json=_get_game_json(2))
+        client.post(self.RESOURCE_URL, json=_get_player_json(1))
+        for color in (2, 3, 4):
+            client.post(self.RESOURCE_URL, json={"color": color, "ai": True})
+
+    def test_ai_search_fails(self, client, monkeypatch):
+        """
+        Tests that a bot whose search fails passes instead of keeping the turn
+        """
+        self._join_bots(client)
+        choose_move = blokus.ai.choose_move
+        calls = []
+        def fail_once(*args):
+            calls.append(args)
+            if len(calls) == 1:
+                raise RuntimeError("search failed")
+            return choose_move(*args)
+        monkeypatch.setattr(blokus.ai, "choose_move", fail_once)
+
+        move = {"player": 1, "block": 1, "orientation": 0, "x": 0, "y": 0}
+        resp = client.post(self.RESOURCE_URL + "moves/", json=move)
+        assert resp.status_code == 201
+        # Bot 2 passed its first turn and placed its block in its second
+        assert len(calls) == 4
+        body = client.get(self.RESOURCE_URL).json
+        assert body["turn_information"] == 0
+        assert [p["used_blocks"] for p in body["players"]] == ["1,"] * 4
+
+    def test_ai_resumes(self, client, monkeypatch):
+        """
+        Tests that reading the state plays a bot turn that was not scheduled,
+        like after a restart of the server
+        """
+        self._join_bots(client)
+        monkeypatch.setattr(blokus.ai.BotRunner, "schedule", lambda self, state: None)
+        move = {"player": 1, "block": 1, "orientation": 0, "x": 0, "y": 0}
+        resp = client.post(self.RESOURCE_URL + "moves/", json=move)
+        assert resp.status_code == 201
+        assert client.get(self.RESOURCE_URL).json["turn_information"] == 2
+        monkeypatch.undo()
+
+        client.get(self.RESOURCE_URL + "state/")
+        body = client.get(self.RESOURCE_URL).json
+        assert body["turn_information"] == 0
+        assert [p["used_blocks"] for p in body["players"]] == ["1,"] * 4
+
+    def test_ai_pool_broken(self, client, monkeypatch):
+        """
+        Tests that a move is saved when the search of the next bot can not be
+        started and that the bot plays once the game is read again
+        """
+        self._join_bots(client)
+        client.application.config["AI_INLINE"] = False
+        class BrokenPool(object):
+            def submit(self, *args):
+                raise BrokenProcessPool()
+            def shutdown(self, wait=True):
+                pass
+        bots = client.application.extensions["blokus_bots"]
+        monkeypatch.setattr(bots, "_pool", BrokenPool())
+
+        move = {"player": 1, "block": 1, "orientation": 0, "x": 0, "y": 0}
+        resp = client.post(self.RESOURCE_URL + "moves/", json=move)
+        assert resp.status_code == 201
+        assert bots._pending == set()
+        assert bots._pool is None
+
+        # the first read starts the bots, the second one sees their moves
+        client.application.config["AI_INLINE"] = True
+        client.get(self.RESOURCE_URL)
+        body = client.get(self.RESOURCE_URL).json
+        assert body["turn_information"] == 0
+        assert [p["used_blocks"] for p in body["players"]] == ["1,"] * 4
+
+class TestGameReplay(object):
+    """
+    This class tests all the possible methods for the Game replay (get)
+    """
+    RESOURCE_URL = "/api/games/game-2/replay/"
+    INVALID_URL = "/api/games/game-x/replay/"
+
+    def test_get(self, client):
+        client.application.config["SNAPSHOT_INTERVAL"] = 2
+        client.post("/api/games/", json=_get_game_json(2))
+        client.post("/api/games/game-2/", json=_get_player_json(1))
+        client.post("/api/games/game-2/", json=_get_player_json(2))
+
+        # nothing has been played yet
+        resp = client.get(self.RESOURCE_URL)
+        assert resp.status_code == 200
+        body = json.loads(resp.data)
+        _check_namespace(client, body)
+        _check_control_get_method("self", client, body)
+        assert body["placed_blocks"] == "0"*400
+        assert body["transaction"] is None
+
+        move = {"player": 1, "block": 1, "orientation": 0, "x": 0, "y": 0}
+        first = client.post("/api/games/game-2/moves/", json=move).headers["Location"]
+        second = client.post("/api/games/game-2/moves/", json=dict(move, player=2, x=19)).headers["Location"]
+        first_id = int(first.rstrip("/").split("/")[-1])
+        second_id = int(second.rstrip("/").split("/")[-1])
+
+        # moves store only the delta, the second one is snapshotted
+        body = client.get(first).json
+        assert body["board_state"] is None
+        assert body["block"] == 1 and body["x"] == 0 and body["y"] == 0
+        _check_control_get_method("blokus:replay", client, body)
+        with client.application.app_context():
+            assert [s.transaction_id for s in Snapshot.query.all()] == [second_id]
+
+        body = client.get(self.RESOURCE_URL + "?at={}".format(first_id)).json
+        assert body["placed_blocks"] == "1" + "0"*399
+        assert body["transaction"] == first_id
+        assert body["turn_information"] == 2
+
+        final = "1" + "0"*18 + "2" + "0"*380
+        body = client.get(self.RESOURCE_URL + "?at={}".format(second_id)).json
+        assert body["placed_blocks"] == final
+        body = client.get(self.RESOURCE_URL).json
+        assert body["placed_blocks"] == final
+        assert body["placed_blocks"] == client.get("/api/games/game-2/").json["placed_blocks"]
+
+        resp = client.get(self.RESOURCE_URL + "?at=x")
+        assert resp.status_code == 400
+        # the uncommitted transaction of game-1
+        resp = client.get(self.RESOURCE_URL + "?at=1")
+        assert resp.status_code == 404
+        resp = client.get(self.INVALID_URL)
+        assert resp.status_code == 404
+
+class TestGameHistory(object):
+    """
+    This class tests all the possible methods for the Game history (get)
+    """
+    RESOURCE_URL = "/api/games/game-2/history/"
+    INVALID_URL = "/api/games/game-x/history/"
+
+    def test_get(self, client):
+        client.post("/api/games/", json=_get_game_json(2))
+        client.post("/api/games/game-2/", json=_get_player_json(1))
+        client.post("/api/games/game-2/", json=_get_player_json(2))
+
+        resp = client.get(self.RESOURCE_URL)
+        assert resp.status_code == 200
+        body = json.loads(resp.data)
+        _check_namespace(client, body)
+        _check_control_get_method("self", client, body)
+        assert body["items"] == []
+
+        move = {"player": 1, "block": 1, "orientation": 0, "x": 0, "y": 0}
+        client.post("/api/games/game-2/moves/", json=move)
+        client.post("/api/games/game-2/moves/", json=dict(move, player=2, x=19))
+
+        body = json.loads(client.get(self.RESOURCE_URL).data)
+        assert [(i["player"], i["x"]) for i in body["items"]] == [(1, 0), (2, 19)]
+        assert body["items"][0]["next_player"] == 2
+
+        resp = client.get(self.RESOURCE_URL + "?format=ndjson")
+        assert resp.mimetype == "application/x-ndjson"
+        lines = [json.loads(line) for line in resp.data.decode().splitlines()]
+        assert lines == body["items"]
+        resp = client.get(self.RESOURCE_URL, headers={"Accept": "application/x-ndjson"})
+        assert resp.mimetype == "application/x-ndjson"
+        assert len(resp.data.decode().splitlines()) == 2
+
+        # continue after the first move
+        resp = client.get(self.RESOURCE_URL + "?format=ndjson&after={}".format(lines[0]["transaction"]))
+        assert [json.loads(line) for line in resp.data.decode().splitlines()] == lines[1:]
+
+        resp = client.get(self.RESOURCE_URL + "?after=x")
+        assert resp.status_code == 400
+        resp = client.get(self.INVALID_URL)
+        assert resp.status_code == 404
+
 class TestPlayerItem(object):
     """
     This class tests all the possible methods for the Player item(get)
@@ -370,6 +804,28 @@ class TestPlayerItem(object):
         _check_control_get_method("profile", client, body)
         _check_control_get_method("self", client, body)
         _check_control_get_method("game", client, body)
+        _check_control_get_method("blokus:moves", client, body)
+
+        resp = client.get(self.INVALID_URL)
+        assert resp.status_code == 404
+
+class TestPlayerMoveCollection(object):
+    """
+    This class tests all the possible methods for the Player move collection (get)
+    """
+    RESOURCE_URL = "/api/games/game-1/players/1/moves/"
+    INVALID_URL = "/api/games/game-1/players/3/moves/"
+
+    def test_get(self, client):
+        resp = client.get(self.RESOURCE_URL)
+        assert resp.status_code == 200
+        body = json.loads(resp.data)
+        _check_namespace(client, body)
+        _check_control_get_method("self", client, body)
+        _check_control_get_method("up", client, body)
+        # The single block fits in each of the four corners on an empty board
+        assert body["count"] == 4
+        assert {(m["x"], m["y"]) for m in body["items"]} == {(0, 0), (19, 0), (0, 19), (19, 19)}
 
         resp = client.get(self.INVALID_URL)
         assert resp.status_code == 404
@@ -392,6 +848,21 @@ class TestTransactionFactory(object):
             _check_control_get_method("profile", client, item)
 
 
+    def test_get_filtered(self, client):
+        client.post("/api/games/", json=_get_game_json(2))
+        client.post("/api/games/game-2/", json=_get_player_json(1))
+        client.post(self.RESOURCE_URL, json=_get_transaction_json(game=2))
+
+        body = client.get(self.RESOURCE_URL + "?game=game-2&fields=used_blocks").json
+        assert len(body["items"]) == 1
+        assert "board_state" not in body["items"][0]
+        assert body["items"][0]["@controls"]["self"]["href"].endswith("/2/")
+
+        body = client.get(self.RESOURCE_URL + "?limit=1").json
+        assert len(body["items"]) == 1
+        body = client.get(body["@controls"]["next"]["href"]).json
+        assert body["items"][0]["@controls"]["self"]["href"].endswith("/2/")
+
     def test_post(self, client):
         valid = _get_transaction_json()
 
@@ -399,6 +870,10 @@ class TestTransactionFactory(object):
         resp = client.post(self.RESOURCE_URL, data=json.dumps(valid))
         assert resp.status_code == 415
 
+        # test with a shape not covering the center cell for 400
+        resp = client.post(self.RESOURCE_URL, json={"shape": "11" + "0"*23})
+        assert resp.status_code == 400
+
         # test with valid and see that it exists afterward
         resp = client.post(self.RESOURCE_URL, json=valid)
         assert resp.status_code == 201
@@ -491,18 +966,59 @@ class TestTransactionItem(object):
         assert resp.status_code == 204
 
 
-        #commit
+        #used blocks that are not a comma separated list of ids for 400
+        valid["used_blocks"] = "x,"
+        resp = client.put(self.RESOURCE_URL, json=valid)
+        assert resp.status_code == 400
+
+        #commit out of turn for 409
         valid["commit"] = 1
-        valid["used_blocks"] = "111"
+        valid["used_blocks"] = "1,"
+        valid["placed_blocks"] = "1" + "0"*399
+        resp = client.put(self.RESOURCE_URL, json=valid)
+        assert resp.status_code == 409
+        with client.application.app_context():
+            Game.query.filter_by(handle="game-1").first().turn_information = 1
+            db.session.commit()
+
+        #commit an illegal board for 400
         valid["placed_blocks"] = "1"*400
         resp = client.put(self.RESOURCE_URL, json=valid)
+        assert resp.status_code == 400
+
+        #commit a legal first move covering a corner
+        valid["placed_blocks"] = "1" + "0"*399
+        resp = client.put(self.RESOURCE_URL, json=valid)
         assert resp.status_code == 202
 
-        #check if resources were changed correctly
+        #check if resources were changed correctly, the used blocks are
+        #taken from the placed block and not from the client
         resp = client.get("/api/games/game-1/players/1/")
-        assert resp.json["used_blocks"] == '111'
+        assert resp.json["used_blocks"] == "1,"
         resp = client.get("/api/games/game-1/")
-        assert resp.json["placed_blocks"] == "1"*400
+        assert resp.json["placed_blocks"] == "1" + "0"*399
+        #the commit is part of the history of the game
+        resp = client.get("/api/games/game-1/replay/")
+        assert resp.json["placed_blocks"] == "1" + "0"*399
+        assert resp.json["transaction"] == 1
+        resp = client.get("/api/games/game-1/history/?format=ndjson")
+        lines = [json.loads(line) for line in resp.data.decode().splitlines()]
+        assert [(l["transaction"], l["player"], l["board_state"]) for l in lines] == [(1, 1, "1" + "0"*399)]
+
+        #the server decides the next turn and ignores next_player, player 1
+        #has no blocks left so the game is over
+        assert client.get("/api/games/game-1/").json["turn_information"] == 0
+        with client.application.app_context():
+            Game.query.filter_by(handle="game-1").first().turn_information = 1
+            db.session.commit()
+
+        #the only block is used now, placing it again is illegal
+        resp = client.post("/api/transactions/", json=_get_transaction_json())
+        second = resp.headers["Location"]
+        resp = client.put(second, json=dict(valid, placed_blocks="1" + "0"*18 + "1" + "0"*380))
+        assert resp.status_code == 400
+        resp = client.get("/api/games/game-1/players/1/")
+        assert resp.json["used_blocks"] == "1,"
 
 
         # remove field for 400
@@ -523,3 +1039,60 @@ class TestTransactionItem(object):
         assert resp.status_code == 404
         resp = client.delete(self.INVALID_URL)
         assert resp.status_code == 404
+
+    def test_committed(self, client):
+        """
+        Tests that committed transactions can not be changed or deleted
+        """
+        client.post("/api/games/", json=_get_game_json(2))
+        client.post("/api/games/game-2/", json=_get_player_json(1))
+        client.post("/api/games/game-2/", json=_get_player_json(2))
+        move = {"player": 1, "block": 1, "orientation": 0, "x": 0, "y": 0}
+        location = client.post("/api/games/game-2/moves/", json=move).headers["Location"]
+
+        resp = client.put(location, json=dict(_get_transaction_json(game=2), placed_blocks="4"*400))
+        assert resp.status_code == 409
+        resp = client.delete(location)
+        assert resp.status_code == 409
+        body = client.get("/api/games/game-2/replay/").json
+        assert body["placed_blocks"] == "1" + "0"*399
+
+    def test_commit_next_turn(self, client):
+        """
+        Tests that committing a transaction passes the turn to the next
+        player whatever next_player the client sends
+        """
+        client.post("/api/games/", json=_get_game_json(2))
+        client.post("/api/games/game-2/", json=_get_player_json(1))
+        client.post("/api/games/game-2/", json=_get_player_json(2))
+        commit = dict(_get_transaction_json(game=2), next_player=1, commit=1)
+
+        location = client.post("/api/transactions/", json=_get_transaction_json(game=2)).headers["Location"]
+        resp = client.put(location, json=dict(commit, placed_blocks="1" + "0"*399))
+        assert resp.status_code == 202
+        assert client.get("/api/games/game-2/").json["turn_information"] == 2
+
+        # player 1 can not keep the turn by naming itself
+        location = client.post("/api/transactions/", json=_get_transaction_json(game=2)).headers["Location"]
+        resp = client.put(location, json=dict(commit, placed_blocks="1" + "0"*18 + "1" + "0"*380))
+        assert resp.status_code == 409
+
+    def test_commit_fails(self, client, monkeypatch):
+        """
+        Tests that a commit that can not be saved returns 500 and changes
+        nothing
+        """
+        client.post("/api/games/", json=_get_game_json(2))
+        client.post("/api/games/game-2/", json=_get_player_json(1))
+        client.post("/api/games/game-2/", json=_get_player_json(2))
+        def fail(db_game):
+            raise RuntimeError("database is gone")
+        monkeypatch.setattr("blokus.resources.transaction.commit_game", fail)
+
+        location = client.post("/api/transactions/", json=_get_transaction_json(game=2)).headers["Location"]
+        commit = dict(_get_transaction_json(game=2), commit=1, placed_blocks="1" + "0"*399)
+        resp = client.put(location, json=commit)
+        assert resp.status_code == 500
+        body = client.get("/api/games/game-2/").json
+        assert body["placed_blocks"] == "0"*400
+        assert body["turn_information"] == 1
@@ -0,0 +1,53 @@
+import random
+
+from blokus.ai import choose_move
+from blokus.engine import *
+
+MONOMINO = "0" * 12 + "1" + "0" * 12
+DOMINO = "0" * 7 + "1" + "0" * 4 + "1" + "0" * 12
+TROMINO = "0" * 7 + "1" + "0" * 4 + "1" + "0" * 4 + "1" + "0" * 7
+
+
+def test_choose_move_is_legal():
+    """
+    Tests that the search returns a legal move of the color to move
+    """
+    catalog = [(1, MONOMINO), (2, DOMINO), (3, TROMINO)]
+    board = Board()
+    board.place(1, placement_mask(TROMINO, 0, 0, 1))
+    seats = [(1, {3}), (2, set()), (3, set()), (4, set())]
+    for seed in range(3):
+        move = choose_move(board.to_bytes(), seats, 2, catalog, 0.05, seed=seed)
+        assert move in legal_moves(board, 2, catalog)
+
+
+def test_choose_move_wins():
+    """
+    Tests that the search picks the move that wins the game. Color 1 can
+    only fill a pocket of three cells, with the tromino it beats color 2 and
+    with the monomino it loses.
+    """
+    catalog = [(1, MONOMINO), (3, TROMINO)]
+    board = Board()
+    board.place(1, cell_bit(0, 0))
+    board.place(2, cell_bit(19, 19) | cell_bit(18, 18) | cell_bit(17, 17))
+    pocket = cell_bit(1, 1) | cell_bit(1, 2) | cell_bit(1, 3)
+    board.place(3, FULL_BOARD & ~(board.occupied | pocket))
+    seats = [(1, set()), (2, {1, 3})]
+    assert sorted(b for b, _, _, _ in legal_moves(board, 1, catalog)) == [1, 3]
+    block_id, orientation, x, y = choose_move(board.to_bytes(), seats, 1, catalog, 0.2, seed=1)
+    assert block_id == 3
+
+
+def test_choose_move_passes():
+    """
+    Tests that a color without moves passes and a single move is returned
+    without searching
+    """
+    board = Board()
+    board.place(1, cell_bit(0, 0))
+    seats = [(1, {1}), (2, set())]
+    assert choose_move(board.to_bytes(), seats, 1, [(1, MONOMINO)], 0.05) is None
+    for corner in ((19, 0), (0, 19), (19, 19)):
+        board.place(3, cell_bit(*corner))
+    assert choose_move(board.to_bytes(), seats, 2, [(1, MONOMINO)], 10) is None
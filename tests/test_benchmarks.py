@@ -0,0 +1,19 @@
+from benchmarks.run import compare, run_benchmarks
+
+
+def test_benchmarks_run():
+    """
+    Tests that a tiny benchmark run completes and reports every endpoint
+    """
+    results = run_benchmarks(games=2, moves=4, requests=3, warmup=1, engine_number=1)
+    for section in ("test_client", "wsgi"):
+        assert set(results[section]) == {
+            "GameItem.get", "GameCollection.get",
+            "TransactionFactory.post", "TransactionItem.put commit"
+        }
+        for stats in results[section].values():
+            assert stats["requests"] == 3
+            assert stats["p50_ms"] <= stats["p99_ms"]
+    assert results["meta"]["transactions"] > 0
+    assert results["engine"]["legal_moves"] > 0
+    assert len(compare(results, results)) == 8 + 4
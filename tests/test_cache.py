@@ -0,0 +1,54 @@
+from blokus.cache import LocalBackend
+
+
+def _state(version):
+    return {"handle": "game", "version": version}
+
+
+def test_local_backend_lru():
+    """
+    Tests that the least recently used entry is evicted first
+    """
+    cache = LocalBackend(max_size=2, idle_timeout=60)
+    cache.set("a", _state(1))
+    cache.set("b", _state(2))
+    assert cache.get("a") == _state(1)
+    cache.set("c", _state(3))
+    assert cache.get("b") is None
+    assert cache.get("a") == _state(1)
+    assert cache.get("c") == _state(3)
+    cache.delete("a")
+    assert cache.get("a") is None
+    assert len(cache) == 1
+
+
+def test_local_backend_idle_timeout(monkeypatch):
+    """
+    Tests that entries not used for the idle timeout are dropped
+    """
+    now = [1000.0]
+    monkeypatch.setattr("blokus.cache.time.monotonic", lambda: now[0])
+    cache = LocalBackend(max_size=10, idle_timeout=5)
+    cache.set("a", _state(1))
+    cache.set("b", _state(2))
+    now[0] += 4
+    assert cache.get("a") == _state(1)
+    now[0] += 4
+    # b has been idle for 8 seconds, a only for 4
+    assert cache.get("b") is None
+    assert cache.get("a") == _state(1)
+    now[0] += 6
+    cache.set("c", _state(3))
+    assert len(cache) == 1
+
+
+def test_local_backend_keeps_newer_version():
+    """
+    Tests that a state only replaces a cached state of an older version
+    """
+    cache = LocalBackend(max_size=10, idle_timeout=60)
+    cache.set("a", _state(2))
+    cache.set("a", _state(1))
+    assert cache.get("a") == _state(2)
+    cache.set("a", _state(3))
+    assert cache.get("a") == _state(3)
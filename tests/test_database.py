@@ -5,21 +5,17 @@ from datetime import datetime
 from sqlalchemy.engine import Engine
 from sqlalchemy import event
 from sqlalchemy.exc import IntegrityError, StatementError
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.exc import StaleDataError
 
 from blokus import create_app, db
 from blokus.models import *
-@event.listens_for(Engine, "connect")
-def set_sqlite_pragma(dbapi_connection, connection_record):
-    cursor = dbapi_connection.cursor()
-    cursor.execute("PRAGMA foreign_keys=ON")
-    cursor.close()
 
 
 @pytest.fixture
-def app():
-    db_fd, db_fname = tempfile.mkstemp()
+def app(database_uri):
     config = {
-        "SQLALCHEMY_DATABASE_URI": "sqlite:///" + db_fname,
+        "SQLALCHEMY_DATABASE_URI": database_uri,
         "TESTING": True
     }
 
@@ -30,8 +26,10 @@ def app():
 
     yield app
 
-    os.close(db_fd)
-    os.unlink(db_fname)
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+        db.engine.dispose()
 
 
 
@@ -120,7 +118,7 @@ def test_created_instance(app):
         player2 = _get_player(3)
         db.session.add(player2)
         game.players.append(player2)
-        game.placed_blocks = "1234"
+        game.placed_blocks = "1234" + "0"*396
         block.shape = "0000"
         db.session.commit()
 
@@ -128,7 +126,7 @@ def test_created_instance(app):
         db_player2 = Player.query.filter_by(id=2).first()
         assert db_player.color == 2
         assert db_player2 in db_game.players
-        assert db_game.placed_blocks == "1234"
+        assert db_game.placed_blocks == "1234" + "0"*396
         assert db_block.shape == "0000"
 
         #4 Remove existing models
@@ -186,3 +184,82 @@ def test_generate_blocks(app):
     with app.app_context():
         generate_blocks()
         assert Block.query.count() == 12
+
+def test_game_version_conflict(app):
+    """
+    Tests that a game changed by another session can not be overwritten
+    """
+    with app.app_context():
+        db.session.add(_get_game())
+        db.session.commit()
+
+        other = Session(db.engine)
+        other_game = other.query(Game).first()
+
+        game = Game.query.first()
+        game.turn_information = 1
+        game.version += 1
+        db.session.commit()
+
+        other_game.turn_information = 2
+        other_game.version += 1
+        with pytest.raises(StaleDataError):
+            other.commit()
+        other.close()
+
+        assert Game.query.first().turn_information == 1
+
+def test_player_color_unique(app):
+    """
+    Tests that a color can be taken only once in a game
+    """
+    with app.app_context():
+        game = _get_game()
+        game.players.append(_get_player())
+        game.players.append(_get_player())
+        db.session.add(game)
+        with pytest.raises(IntegrityError):
+            db.session.commit()
+
+def test_migrate_legacy_database(app):
+    """
+    Tests upgrading a database made by the first version of the api in place
+    """
+    from sqlalchemy import inspect, text
+    from blokus.migrate import upgrade_database
+
+    with app.app_context():
+        db.drop_all()
+        with db.engine.begin() as conn:
+            conn.execute(text("CREATE TABLE game (id INTEGER PRIMARY KEY, handle VARCHAR NOT NULL UNIQUE, "
+                "placed_blocks VARCHAR, turn_information INTEGER)"))
+            conn.execute(text("CREATE TABLE player (id INTEGER PRIMARY KEY, color INTEGER NOT NULL, "
+                "used_blocks VARCHAR, game_id INTEGER REFERENCES game(id) ON DELETE CASCADE)"))
+            conn.execute(text("CREATE TABLE block (id INTEGER PRIMARY KEY, shape VARCHAR NOT NULL)"))
+            conn.execute(text("CREATE TABLE \"transaction\" (id INTEGER PRIMARY KEY, game_id INTEGER, "
+                "player_id INTEGER, \"commit\" INTEGER, used_blocks VARCHAR, board_state VARCHAR, "
+                "next_player INTEGER)"))
+            conn.execute(text("INSERT INTO game VALUES (1, 'old game', :board, 1)"),
+                {"board": "1" + "0"*399})
+            conn.execute(text("INSERT INTO player VALUES (1, 1, '1,', 1)"))
+            conn.execute(text("INSERT INTO \"transaction\" VALUES (1, 1, 1, 1, '1,', :board, 1)"),
+                {"board": "1" + "0"*399})
+
+        messages = []
+        upgrade_database(messages.append)
+        assert "Created table snapshot" in messages
+        assert "Added column game.board" in messages
+        assert "Created index ix_player_game_id_color" in messages
+
+        inspector = inspect(db.engine)
+        assert "ix_transaction_game_id_id" in {i["name"] for i in inspector.get_indexes("transaction")}
+
+        game = Game.query.first()
+        assert game.placed_blocks == "1" + "0"*399
+        assert game.version == 0
+        assert Transaction.query.first().board_state == "1" + "0"*399
+
+        # Running again changes nothing
+        messages = []
+        upgrade_database(messages.append)
+        assert messages == []
@@ -0,0 +1,185 @@
+import pytest
+
+from blokus.engine import *
+
+
+def _board_with(cells):
+    """
+    Creates a placed_blocks string with the given {(x, y): color} cells set
+    """
+    board = ["0"] * CELL_COUNT
+    for (x, y), color in cells.items():
+        board[x + y * BOARD_SIZE] = str(color)
+    return "".join(board)
+
+
+def _mask(*cells):
+    mask = 0
+    for x, y in cells:
+        mask |= cell_bit(x, y)
+    return mask
+
+
+def test_string_roundtrip():
+    """
+    Tests that a board survives conversion to bitboards and back
+    """
+    state = _board_with({(0, 0): 1, (19, 0): 2, (5, 7): 3, (19, 19): 4})
+    board = Board.from_string(state)
+    assert board.to_string() == state
+    assert board.bitboards[1] == cell_bit(0, 0)
+    assert board.bitboards[4] == cell_bit(19, 19)
+
+    with pytest.raises(ValueError):
+        Board.from_string("0" * 399)
+    with pytest.raises(ValueError):
+        Board.from_string("5" * 400)
+
+
+def test_neighbour_masks_do_not_wrap():
+    """
+    Tests that edge and diagonal masks stay on the board and inside their rows
+    """
+    assert edges(cell_bit(19, 0)) == _mask((18, 0), (19, 1))
+    assert edges(cell_bit(0, 1)) == _mask((0, 0), (1, 1), (0, 2))
+    assert diagonals(cell_bit(0, 0)) == _mask((1, 1))
+    assert diagonals(cell_bit(19, 5)) == _mask((18, 4), (18, 6))
+
+
+def test_first_move_rule():
+    """
+    Tests that the first block of a color must cover a corner
+    """
+    board = Board()
+    assert board.is_legal(1, _mask((0, 0), (1, 0)))
+    assert not board.is_legal(1, _mask((5, 5)))
+    with pytest.raises(IllegalMoveError):
+        board.validate_placement(1, _mask((5, 5)))
+
+
+def test_corner_and_edge_rules():
+    """
+    Tests overlap, side contact and corner contact with an existing block
+    """
+    board = Board.from_string(_board_with({(0, 0): 1, (2, 2): 2}))
+    # Touches own block by a corner only
+    assert board.is_legal(1, _mask((1, 1)))
+    # Shares a side with own block
+    assert not board.is_legal(1, _mask((1, 0), (1, 1)))
+    # Not connected to own blocks at all
+    assert not board.is_legal(1, _mask((5, 5)))
+    # Overlaps another color
+    assert not board.is_legal(1, _mask((1, 1), (2, 1), (2, 2)))
+    # Touching another color by a side is allowed
+    assert board.is_legal(1, _mask((1, 1), (1, 2)))
+
+
+def test_validate_transition():
+    """
+    Tests checking a whole board update against the previous state
+    """
+    old = Board.from_string(_board_with({(0, 0): 1}))
+
+    new = Board.from_string(_board_with({(0, 0): 1, (1, 1): 1, (1, 2): 1}))
+    assert old.validate_transition(new, 1) == _mask((1, 1), (1, 2))
+
+    # Passing leaves the board unchanged
+    assert old.validate_transition(Board.from_string(old.to_string()), 1) == 0
+
+    # Two separate pieces at once
+    new = Board.from_string(_board_with({(0, 0): 1, (1, 1): 1, (5, 5): 1}))
+    with pytest.raises(IllegalMoveError):
+        old.validate_transition(new, 1)
+
+    # Changing blocks of another color
+    new = Board.from_string(_board_with({(0, 0): 1, (19, 19): 2}))
+    with pytest.raises(IllegalMoveError):
+        old.validate_transition(new, 1)
+
+    # Removing an existing block
+    with pytest.raises(IllegalMoveError):
+        old.validate_transition(Board(), 1)
+
+
+def test_compile_shape_orientations():
+    """
+    Tests that symmetric rotations and reflections are deduplicated
+    """
+    monomino = "0" * 12 + "1" + "0" * 12
+    line = ("00100"
+            "00100"
+            "00100"
+            "00000"
+            "00000")
+    l_shape = ("00000"
+               "00110"
+               "00100"
+               "00100"
+               "00000")
+    assert len(compile_shape(monomino)) == 1
+    assert len(compile_shape(line)) == 2
+    assert len(compile_shape(l_shape)) == 8
+    assert compile_shape("0" * 25) == ()
+
+    # Orientations are cached per shape
+    assert compile_shape(l_shape) is compile_shape(l_shape)
+
+    # The first orientation is the shape as given around the frame center
+    first = compile_shape(l_shape)[0]
+    assert sorted(first.offsets) == [(0, -1), (0, 0), (0, 1), (1, -1)]
+    assert first.placements[0] == 0
+    assert first.placements[5 + 5 * BOARD_SIZE] == _mask((5, 4), (6, 4), (5, 5), (5, 6))
+
+
+def test_match_placement():
+    """
+    Tests finding the orientation and anchor of placed cells
+    """
+    l_shape = ("00000"
+               "00110"
+               "00100"
+               "00100"
+               "00000")
+    for index, orientation in enumerate(compile_shape(l_shape)):
+        mask = orientation.placements[10 + 10 * BOARD_SIZE]
+        assert match_placement(l_shape, mask) == (index, 10, 10)
+    assert match_placement(l_shape, _mask((0, 0), (1, 0))) is None
+
+
+def test_legal_moves():
+    """
+    Tests move generation from corner candidates
+    """
+    monomino = "0" * 12 + "1" + "0" * 12
+    domino = "0" * 7 + "1" + "0" * 4 + "1" + "0" * 12
+
+    # First move may only go to a corner
+    moves = legal_moves(Board(), 1, [(1, monomino)])
+    assert sorted((x, y) for _, _, x, y in moves) == [(0, 0), (0, 19), (19, 0), (19, 19)]
+
+    board = Board.from_string(_board_with({(0, 0): 1}))
+    moves = legal_moves(board, 1, [(1, monomino), (2, domino)])
+    assert (1, 0, 1, 1) in moves
+    for block_id, orientation, x, y in moves:
+        shape = monomino if block_id == 1 else domino
+        mask = compile_shape(shape)[orientation].placements[x + y * BOARD_SIZE]
+        assert board.is_legal(1, mask)
+    # A monomino at (1, 1) plus dominoes growing right and down from it
+    assert len(moves) == 3
+
+    # No moves once the only corner is taken
+    board = Board.from_string(_board_with({(0, 0): 1, (1, 1): 2}))
+    assert legal_moves(board, 1, [(1, monomino)]) == []
+
+
+def test_bytes_roundtrip():
+    """
+    Tests packing a board into per color bitboard bytes and back
+    """
+    state = _board_with({(0, 0): 1, (19, 0): 2, (5, 7): 3, (19, 19): 4})
+    packed = Board.from_string(state).to_bytes()
+    assert len(packed) == PACKED_BOARD_SIZE
+    assert Board.from_bytes(packed).to_string() == state
+
+    with pytest.raises(ValueError):
+        Board.from_bytes(b"\0" * 10)
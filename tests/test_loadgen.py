@@ -0,0 +1,35 @@
+import asyncio
+import os
+import tempfile
+import pytest
+
+from benchmarks.loadgen import make_parser, run_load, start_server
+
+
+@pytest.mark.parametrize("moves, endpoints", [
+    ("transaction", {"TransactionFactory.post", "TransactionItem.put"}),
+    ("single", {"MoveFactory.post"}),
+])
+def test_loadgen_run(moves, endpoints):
+    """
+    Tests that a short run with a few players joins, moves and reports every
+    endpoint of the flow without errors
+    """
+    db_fd, db_fname = tempfile.mkstemp()
+    process, base = start_server(db_fname, {})
+    try:
+        args = make_parser().parse_args([
+            "--players", "4", "--duration", "3", "--ramp", "1", "--think", "0",
+            "--poll", "0.02", "--interval", "10", "--moves", moves
+        ])
+        report = asyncio.run(run_load(base, args))
+    finally:
+        process.terminate()
+        process.join()
+        os.close(db_fd)
+        os.unlink(db_fname)
+    assert report["counters"]["games_joined"] >= 4
+    assert report["counters"]["moves"] > 0
+    assert endpoints | {"GameCollection.get", "GameItem.get", "GameItem.post"} <= set(report["endpoints"])
+    assert all(s["errors"] == 0 for s in report["endpoints"].values())
+    assert report["intervals"]
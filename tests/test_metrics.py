@@ -0,0 +1,74 @@
+import logging
+import pytest
+
+from blokus import create_app, db
+
+
+@pytest.fixture
+def make_app(database_uri):
+    """
+    Returns a function creating an app with metrics and the given config on
+    the test database
+    """
+    apps = []
+    def make(**config):
+        app = create_app(dict({
+            "SQLALCHEMY_DATABASE_URI": database_uri,
+            "TESTING": True,
+            "METRICS": True
+        }, **config))
+        with app.app_context():
+            db.create_all()
+        apps.append(app)
+        return app
+
+    yield make
+
+    for app in apps:
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+            db.engine.dispose()
+
+
+def test_metrics_endpoint(make_app):
+    """
+    Tests that requests are counted per endpoint with their SQL statements
+    """
+    app = make_app()
+    client = app.test_client()
+    client.post("/api/games/", json={"handle": "game-1"})
+    client.get("/api/games/")
+    client.get("/api/games/game-1/")
+
+    resp = client.get("/metrics")
+    assert resp.status_code == 200
+    assert resp.content_type.startswith("text/plain")
+    text = resp.data.decode()
+    assert "# TYPE blokus_request_duration_seconds histogram" in text
+    assert 'blokus_request_duration_seconds_count{endpoint="api.gamecollection",method="GET",status="200"} 1' in text
+    assert 'blokus_request_duration_seconds_count{endpoint="api.gamecollection",method="POST",status="201"} 1' in text
+    assert 'blokus_response_size_bytes_count{endpoint="api.gameitem",method="GET"} 1' in text
+    # Listing the games takes a single statement
+    assert 'blokus_request_sql_statements_bucket{endpoint="api.gamecollection",method="GET",le="1"} 1' in text
+    # The metrics endpoint itself is not recorded
+    assert 'endpoint="metrics"' not in text
+
+
+def test_slow_request_log(make_app, caplog):
+    """
+    Tests that slow requests are logged with their statements
+    """
+    app = make_app(METRICS_SLOW_REQUEST=0)
+    with caplog.at_level(logging.WARNING):
+        app.test_client().get("/api/games/")
+    assert "Slow request GET /api/games/?" in caplog.text
+    assert "SELECT" in caplog.text
+
+
+def test_metrics_disabled(make_app):
+    """
+    Tests that metrics are off unless enabled
+    """
+    app = make_app(METRICS=False)
+    assert app.test_client().get("/metrics").status_code == 404
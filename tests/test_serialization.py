@@ -0,0 +1,59 @@
+import json
+import pytest
+from flask import url_for
+
+from blokus import create_app, db
+from blokus.models import *
+from blokus.utils import dumps, url_template
+
+
+@pytest.fixture
+def app(database_uri):
+    app = create_app({
+        "SQLALCHEMY_DATABASE_URI": database_uri,
+        "TESTING": True
+    })
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+        db.engine.dispose()
+
+
+def test_url_template(app):
+    """
+    Tests that URL templates build the same URLs as url_for
+    """
+    with app.test_request_context():
+        for handle in ("game-1", "a b", "ä/ö?#{x}", "100%"):
+            assert url_template("api.gameitem", "game")(handle) == url_for("api.gameitem", game=handle)
+            assert url_template("api.playeritem", "game", "player")(handle, 3) == \
+                url_for("api.playeritem", game=handle, player=3)
+        assert url_template("api.gamecollection")() == url_for("api.gamecollection")
+        assert url_template("api.gameitem", "game") is url_template("api.gameitem", "game")
+
+    # A different URL root gets its own templates
+    with app.test_request_context(base_url="http://localhost/root/"):
+        assert url_template("api.gameitem", "game")("x") == "/root/api/games/x/"
+
+
+def test_dumps(app):
+    """
+    Tests that both encoders produce the same document
+    """
+    body = {"handle": "ä", "items": [{"offsets": ((0, 1),)}], "count": 2}
+    with app.app_context():
+        fast = dumps(body)
+        app.config["FAST_JSON"] = False
+        plain = dumps(body)
+    assert isinstance(fast, bytes) and isinstance(plain, bytes)
+    assert json.loads(fast) == json.loads(plain)
+
+
+def test_schemas_are_built_once():
+    """
+    Tests that the control schemas are reused between requests
+    """
+    assert Game.get_schema() is Game.get_schema()
+    assert Transaction.get_schema() is Transaction.get_schema()
+    assert Transaction.get_move_schema() is Transaction.get_move_schema()
@@ -0,0 +1,48 @@
+import random
+import pytest
+
+from blokus.engine import Board, cell_bit
+from blokus.models import BLOCK_SHAPES
+from blokus.simulate import Violation, check_move, simulate
+
+CATALOG = list(enumerate(BLOCK_SHAPES, start=1))
+
+
+def test_engine_games():
+    """
+    Tests that engine games follow the rules and repeat with the same seed
+    """
+    report = simulate(games=3, strategies=["random", "greedy"], processes=1, seed=5)
+    assert report["games"] == 3
+    assert report["violation_count"] == 0
+    assert report["moves"] > 0
+    assert sum(report["wins"].values()) == pytest.approx(3)
+    again = simulate(games=3, strategies=["random", "greedy"], processes=1, seed=5)
+    assert (again["moves"], again["wins"]) == (report["moves"], report["wins"])
+
+
+def test_api_games():
+    """
+    Tests that games played through the api match the engine
+    """
+    report = simulate(games=1, mode="api", processes=1, probe_rate=0.5)
+    assert report["violation_count"] == 0
+    assert report["moves"] > 0
+
+
+def test_check_move():
+    """
+    Tests that an illegal move handed out as legal is reported
+    """
+    board = Board()
+    board.place(1, cell_bit(0, 0))
+    shapes = dict(CATALOG)
+    moves = [(1, 0, 1, 1)]
+    assert check_move(board, 1, (1, 0, 1, 1), moves, shapes, random.Random(0)) == cell_bit(1, 1)
+    with pytest.raises(Violation):
+        check_move(board, 1, (1, 0, 1, 0), moves, shapes, random.Random(0))
+
+
+def test_unknown_player():
+    with pytest.raises(ValueError):
+        simulate(games=1, strategies=["perfect"], processes=1)
@@ -0,0 +1,49 @@
+import os
+import tempfile
+
+from blokus import create_app, db
+
+
+def _pragma(name):
+    with db.engine.connect() as conn:
+        return conn.exec_driver_sql("PRAGMA {}".format(name)).scalar()
+
+
+def test_production_profile():
+    """
+    Tests that the production profile tunes every connection
+    """
+    db_fd, db_fname = tempfile.mkstemp()
+    app = create_app({
+        "SQLALCHEMY_DATABASE_URI": "sqlite:///" + db_fname,
+        "TESTING": True,
+        "SQLITE_PROFILE": "production",
+        "SQLITE_BUSY_TIMEOUT": 2000
+    })
+    with app.app_context():
+        assert _pragma("journal_mode") == "wal"
+        assert _pragma("synchronous") == 1
+        assert _pragma("busy_timeout") == 2000
+        assert _pragma("foreign_keys") == 1
+        assert db.engine.pool.size() == 10
+        db.engine.dispose()
+    os.close(db_fd)
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(db_fname + suffix):
+            os.unlink(db_fname + suffix)
+
+
+def test_default_profile():
+    """
+    Tests that SQLite is left as it is by default
+    """
+    db_fd, db_fname = tempfile.mkstemp()
+    app = create_app({
+        "SQLALCHEMY_DATABASE_URI": "sqlite:///" + db_fname,
+        "TESTING": True
+    })
+    with app.app_context():
+        assert _pragma("journal_mode") == "delete"
+        db.engine.dispose()
+    os.close(db_fd)
+    os.unlink(db_fname)